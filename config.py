@@ -12,6 +12,156 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 # Ma'lumotlar bazasi nomini .env faylidan olish
 DB_NAME = os.getenv("DB_NAME")
 
+# Ma'lumotlar bazasi ulanishlar hovuzi sozlamalari
+# O'quvchi ulanishlar soni (yozuvchi ulanish doim bitta)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# Har bir ulanishda saqlanadigan tayyorlangan so'rovlar soni
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Baza band bo'lganda kutish vaqti (millisekund)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Javoblarni guruhlab saqlash: bitta tranzaksiyadagi maksimal javoblar soni
+ANSWER_BATCH_SIZE = int(os.getenv("ANSWER_BATCH_SIZE", "200"))
+# Guruh to'planishini kutish oynasi (millisekund)
+ANSWER_BATCH_WINDOW_MS = int(os.getenv("ANSWER_BATCH_WINDOW_MS", "20"))
+# Xotirada saqlanadigan test yozuvlarining maksimal soni
+TEST_CACHE_SIZE = int(os.getenv("TEST_CACHE_SIZE", "2000"))
+# Xotirada saqlanadigan jonli reytinglar (testlar) soni va ko'rsatiladigan o'rinlar soni
+LEADERBOARD_CACHE_SIZE = int(os.getenv("LEADERBOARD_CACHE_SIZE", "200"))
+LEADERBOARD_TOP_N = int(os.getenv("LEADERBOARD_TOP_N", "10"))
+# Referral konkursi reytingida ko'rsatiladigan (va xotirada saqlanadigan) o'rinlar soni
+CONTEST_TOP_SIZE = int(os.getenv("CONTEST_TOP_SIZE", "10"))
+
+# Majburiy obuna tekshiruvi keshi sozlamalari
+# A'zo bo'lgan foydalanuvchi natijasi qancha saqlanadi (soniya)
+SUBSCRIPTION_POSITIVE_TTL = int(os.getenv("SUBSCRIPTION_POSITIVE_TTL", "300"))
+# A'zo bo'lmagan foydalanuvchi natijasi qancha saqlanadi (soniya)
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "15"))
+# Keshdagi (foydalanuvchi, kanal) juftliklarining maksimal soni
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "100000"))
+# Bir vaqtda yuboriladigan get_chat_member so'rovlarining maksimal soni
+SUBSCRIPTION_CHECK_CONCURRENCY = int(os.getenv("SUBSCRIPTION_CHECK_CONCURRENCY", "20"))
+# Bitta get_chat_member so'rovi uchun kutish chegarasi (soniya)
+SUBSCRIPTION_CHECK_TIMEOUT = float(os.getenv("SUBSCRIPTION_CHECK_TIMEOUT", "5"))
+
+# Telegram'ga ommaviy yuborish cheklovlari
+# Bot bo'yicha soniyasiga yuboriladigan xabarlarning maksimal soni
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+# Bitta chatga ketma-ket xabarlar orasidagi minimal interval (soniya)
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1"))
+# Tarmoq xatosi yoki flood-wait bo'lganda qayta urinishlar soni
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# Ommaviy xabar yuboruvchi parallel ishchilar soni
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "16"))
+# Bir bosqichda olinadigan foydalanuvchilar soni (kursor shu bosqichlarda saqlanadi;
+# jarayon bosqich o'rtasida to'xtasa, davom ettirilganda shuncha xabar qayta yuborilishi mumkin)
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "200"))
+
+# Test yakunlanganda natijalarni yetkazish sozlamalari
+RESULT_DELIVERY_WORKERS = int(os.getenv("RESULT_DELIVERY_WORKERS", "16"))
+# Navbatdan bir marta olinadigan natijalar soni
+RESULT_DELIVERY_BATCH_SIZE = int(os.getenv("RESULT_DELIVERY_BATCH_SIZE", "100"))
+# Yetkazib bo'lmagan natija uchun maksimal urinishlar soni
+RESULT_MAX_ATTEMPTS = int(os.getenv("RESULT_MAX_ATTEMPTS", "5"))
+# Qayta urinishlar orasidagi asosiy kutish (soniya)
+RESULT_RETRY_DELAY = int(os.getenv("RESULT_RETRY_DELAY", "60"))
+# Test egasiga jarayon haqidagi xabarni yangilash oralig'i (soniya)
+RESULT_PROGRESS_INTERVAL = float(os.getenv("RESULT_PROGRESS_INTERVAL", "3"))
+
+# Rejalashtiruvchi va o'qituvchi kiritadigan vaqtlar uchun vaqt mintaqasi
+TIMEZONE = os.getenv("TIMEZONE", "Asia/Tashkent")
+# Tugash vaqti kelgan testlar shu oraliqda tekshiriladi va yopiladi (soniya)
+AUTO_CLOSE_CHECK_INTERVAL = int(os.getenv("AUTO_CLOSE_CHECK_INTERVAL", "60"))
+
+# Vaqtli testlar: o'quvchiga "vaqt tugashiga N daqiqa qoldi" va "vaqt tugadi" xabarlari
+DEADLINE_WARNING_MINUTES = int(os.getenv("DEADLINE_WARNING_MINUTES", "5"))
+# Muddatlar shu aniqlikda (soniya) guruhlanadi va bitta guruh bo'lib yuboriladi
+DEADLINE_TICK_SECONDS = int(os.getenv("DEADLINE_TICK_SECONDS", "5"))
+# Bot ishlamay turganda o'tib ketgan muddat uchun "vaqt tugadi" xabari shu vaqt ichida yuboriladi (soniya)
+DEADLINE_MISSED_GRACE = int(os.getenv("DEADLINE_MISSED_GRACE", "600"))
+# Ogohlantirishlarni yuboruvchi parallel ishchilar soni
+DEADLINE_NOTICE_WORKERS = int(os.getenv("DEADLINE_NOTICE_WORKERS", "8"))
+
+# Shaxsiy sertifikatlar sozlamalari
+# Sertifikat beriladigan o'rinlar soni. O'rin uchun `N-o'rin.png` shabloni bo'lmasa,
+# umumiy shablon ishlatiladi va o'rin raqami uning ustiga yoziladi
+CERTIFICATE_TOP_PLACES = int(os.getenv("CERTIFICATE_TOP_PLACES", "3"))
+CERTIFICATE_GENERIC_TEMPLATE = os.getenv("CERTIFICATE_GENERIC_TEMPLATE", "sertifikat.png")
+# Ism va natija yoziladigan shrift (topilmasa, Pillow'ning standart shrifti ishlatiladi)
+CERTIFICATE_FONT_PATH = os.getenv("CERTIFICATE_FONT_PATH", "DejaVuSans-Bold.ttf")
+# Xotirada saqlanadigan tayyor sertifikatlar soni
+CERTIFICATE_CACHE_SIZE = int(os.getenv("CERTIFICATE_CACHE_SIZE", "64"))
+
+# Og'ir hisoblashlar (sertifikat chizish, Excel hisobot) uchun jarayonlar soni
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "2"))
+
+# FSM holatlarini saqlash (bazada)
+# Tashlab ketilgan holat qancha vaqtdan keyin o'chiriladi (soniya)
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))
+# Xotirada saqlanadigan faol holatlar soni
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# O'zgarishlarni bazaga yozish oralig'i (soniya); shu oraliqdagi bir kalitga yozuvlar birlashtiriladi
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+# Yozilmagan o'zgarishlar shu songa yetsa, oraliqni kutmasdan yoziladi
+FSM_FLUSH_MAX_PENDING = int(os.getenv("FSM_FLUSH_MAX_PENDING", "1000"))
+
+# Javoblar kaliti o'zgartirilganda bitta tranzaksiyada qayta baholanadigan javoblar soni
+REGRADE_CHUNK_SIZE = int(os.getenv("REGRADE_CHUNK_SIZE", "1000"))
+
+# Migratsiyalardagi katta to'ldirish (backfill) ishlari: bitta tranzaksiyadagi qatorlar soni
+MIGRATION_CHUNK_SIZE = int(os.getenv("MIGRATION_CHUNK_SIZE", "5000"))
+# Bo'laklar orasidagi tanaffus (soniya), boshqa yozuvchilarga navbat berish uchun
+MIGRATION_CHUNK_PAUSE = float(os.getenv("MIGRATION_CHUNK_PAUSE", "0.01"))
+
+# Eski testlarni arxivlash va bazani ixchamlash
+# Yopilgan test shuncha kundan keyin arxivga ko'chiriladi
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "4"))
+# Arxivlash va tozalash har kuni shu soatda (TIMEZONE bo'yicha, kam yuklangan vaqt) ishga tushadi
+RETENTION_HOUR = int(os.getenv("RETENTION_HOUR", "4"))
+# Arxiv fayllari (test_<kod>_<id>.jsonl.gz) saqlanadigan papka
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Bitta qisqa tranzaksiyada o'chiriladigan qatorlar soni va bo'laklar orasidagi tanaffus (soniya)
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "1000"))
+RETENTION_CHUNK_PAUSE = float(os.getenv("RETENTION_CHUNK_PAUSE", "0.05"))
+# Incremental vacuum bir qadamda bo'shatadigan sahifalar soni
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", "1000"))
+
+# Update'larni qabul qilish usuli: "polling" yoki "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Ishga tushishda Telegram'da to'planib qolgan update'larni tashlab yuborish (odatda ha, avvalgidek).
+# Yangi versiya chiqarilganda update'lar yo'qolmasligi uchun "false" qiling
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "true").lower() in ("1", "true", "yes")
+# Webhook rejimi sozlamalari
+# Telegram murojaat qiladigan tashqi manzil, masalan: https://bot.example.com
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Telegram har bir so'rovda X-Telegram-Bot-Api-Secret-Token sarlavhasida yuboradigan maxfiy kalit
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Bir vaqtda qayta ishlanayotgan update'larning maksimal soni
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "100"))
+# Telegram ochadigan parallel ulanishlar soni (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Ko'p jarayonli rejim: update'larni qayta ishlovchi ishchi jarayonlar soni
+# (0 yoki 1 - hammasi bitta jarayonda). Bazaga yozish doim bosh jarayonda bajariladi.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+# Ishchilarga yuborilgan, lekin hali qayta ishlanmagan update'larning maksimal soni
+CLUSTER_MAX_IN_FLIGHT = int(os.getenv("CLUSTER_MAX_IN_FLIGHT", "200"))
+
+# /start bosgan foydalanuvchilar keshi: ma'lumotlari o'zgarmagan bo'lsa bazaga qayta yozilmaydi
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))
+# Foydalanuvchilarning oxirgi faolligi (last_seen) xotirada to'planib, shu oraliqda bitta tranzaksiyada yoziladi (soniya)
+LAST_SEEN_FLUSH_INTERVAL = float(os.getenv("LAST_SEEN_FLUSH_INTERVAL", "30"))
+
+# Test kodlarini ajratish: "sequential" (1001, 1002, ...) yoki "random" (taxmin qilib bo'lmaydigan kodlar)
+TEST_CODE_MODE = os.getenv("TEST_CODE_MODE", "sequential").lower()
+# Ketma-ket kodlar bazadan shuncha-shuncha bloklab band qilinadi va xotiradan beriladi
+TEST_CODE_BLOCK_SIZE = int(os.getenv("TEST_CODE_BLOCK_SIZE", "100"))
+# Tasodifiy kodlar uzunligi (raqamlar soni)
+TEST_CODE_RANDOM_DIGITS = int(os.getenv("TEST_CODE_RANDOM_DIGITS", "6"))
+
 # Super Adminlar ro'yxatini .env faylidan olish
 # Avval string (matn) sifatida olinadi, keyin sonlar ro'yxatiga o'tkaziladi
 admins_str = os.getenv("SUPER_ADMINS", "") # Agar topilmasa, bo'sh satr oladi
@@ -25,5 +175,11 @@ if not BOT_TOKEN:
     raise ValueError("Xatolik: BOT_TOKEN o'zgaruvchisi .env faylida topilmadi yoki bo'sh!")
 if not DB_NAME:
     raise ValueError("Xatolik: DB_NAME o'zgaruvchisi .env faylida topilmadi yoki bo'sh!")
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("Xatolik: BOT_MODE faqat 'polling' yoki 'webhook' bo'lishi mumkin!")
+if TEST_CODE_MODE not in ("sequential", "random"):
+    raise ValueError("Xatolik: TEST_CODE_MODE faqat 'sequential' yoki 'random' bo'lishi mumkin!")
+if BOT_MODE == "webhook" and not (WEBHOOK_BASE_URL and WEBHOOK_SECRET):
+    raise ValueError("Xatolik: webhook rejimi uchun WEBHOOK_BASE_URL va WEBHOOK_SECRET .env faylida ko'rsatilishi kerak!")
 if not SUPER_ADMINS:
     print("Ogohlantirish: SUPER_ADMINS ro'yxati .env faylida topilmadi yoki bo'sh!")
@@ -1,200 +1,980 @@
 # database.py
 import aiosqlite
+import asyncio
 import logging
-from config import DB_NAME
+import sqlite3
+from contextlib import asynccontextmanager, contextmanager
+from config import DB_NAME, DB_READ_POOL_SIZE, DB_STATEMENT_CACHE_SIZE, DB_BUSY_TIMEOUT_MS, TEST_CACHE_SIZE, CONTEST_TOP_SIZE, USER_CACHE_SIZE, USER_CACHE_TTL, REGRADE_CHUNK_SIZE
+from migrations import apply_migrations
+from services import cluster
+from services import scoring
+from services import leaderboard
+from services import test_codes
+from services.cache import TTLCache
 import time
 
-async def setup_database():
-    async with aiosqlite.connect(DB_NAME) as db:
+# Har bir ulanish uchun bir marta bajariladigan sozlamalar.
+# WAL rejimida o'quvchilar yozuvchini kutmaydi. synchronous=NORMAL faqat o'quvchi
+# ulanishlarda qoladi: yozuvchi uni FULL ga almashtiradi (pastda, _connect), chunki
+# saqlangan javob elektr uzilishida ham yo'qolmasligi kerak, fsync narxi esa
+# guruhli commit (services/answer_writer.py) tufayli har bir javobga emas, guruhga tushadi.
+_CONNECTION_PRAGMAS = (
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+
+class ConnectionPool:
+    """
+    Ma'lumotlar bazasiga doimiy ulanishlar hovuzi: bitta yozuvchi va
+    bir nechta o'quvchi. Ulanishlar `setup_database()` da bir marta ochiladi
+    va `close_database()` da yopiladi.
+    """
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.writer = None
+        self._write_lock = None
+        self._readers = None
+        self._all_readers = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._readers is not None
+
+    async def _connect(self, read_only: bool):
+        # `cached_statements` - har bir ulanishdagi tayyorlangan so'rovlar keshi.
+        # Ulanish doimiy bo'lgani uchun bir xil SQL qayta kompilyatsiya qilinmaydi.
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_STATEMENT_CACHE_SIZE)
+        pragmas = list(_CONNECTION_PRAGMAS)
+        if read_only:
+            pragmas.append("PRAGMA query_only = ON")
+        else:
+            # auto_vacuum WAL yoqilishidan oldin turishi shart: yangi bazada sarlavha shu yerda
+            # yoziladi, eskisida esa birinchi to'liq VACUUM'gacha ta'sir qilmaydi
+            # (services/retention.py uni bir marta, kam yuklangan vaqtda bajaradi)
+            pragmas[:0] = ["PRAGMA auto_vacuum = INCREMENTAL", "PRAGMA journal_mode = WAL"]
+            # Yozuvchida har bir commit diskka to'liq yoziladi: javoblar guruhlab
+            # saqlangani uchun fsync har bir javobga emas, har bir guruhga to'g'ri keladi
+            pragmas.append("PRAGMA synchronous = FULL")
+        # executescript har bir PRAGMA'ni oxirigacha bajaradi, ochiq qolgan
+        # so'rov bazani qulflab qo'ymaydi.
+        await conn.executescript(";\n".join(pragmas))
+        return conn
+
+    async def open(self, writer: bool = True):
+        """`writer=False` - faqat o'qish uchun (ko'p jarayonli rejimdagi ishchilar, yozish bosh jarayonda)."""
+        if self.is_open:
+            return
+        self._readers = asyncio.Queue()
+        try:
+            if writer:
+                self.writer = await self._connect(read_only=False)
+                self._write_lock = asyncio.Lock()
+            for _ in range(self.readers_count):
+                conn = await self._connect(read_only=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+        except Exception:
+            await self.close()
+            raise
+        logging.info(f"Ma'lumotlar bazasi ulanishlari ochildi ({1 if writer else 0} yozuvchi, {self.readers_count} o'quvchi).")
+
+    async def close(self):
+        if not self.is_open:
+            return
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = None
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+        logging.info("Ma'lumotlar bazasi ulanishlari yopildi.")
+
+    @asynccontextmanager
+    async def read(self):
+        if not self.is_open:
+            raise RuntimeError("Ma'lumotlar bazasi ochilmagan: avval setup_database() chaqirilishi kerak.")
+        conn = await self._readers.get()
         try:
-            await db.execute("ALTER TABLE tests ADD COLUMN status TEXT DEFAULT 'active'")
-            await db.execute("ALTER TABLE tests ADD COLUMN question_file_type TEXT")
-            await db.execute("ALTER TABLE channels ADD COLUMN username TEXT")
-            await db.execute("ALTER TABLE channels ADD COLUMN invite_link TEXT")
-            await db.commit()
-        except aiosqlite.OperationalError:
-            pass
-
-        await db.execute('''CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, full_name TEXT, referred_by_id INTEGER, referral_count INTEGER DEFAULT 0, status TEXT DEFAULT 'active')''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS channels (channel_id INTEGER PRIMARY KEY, username TEXT, invite_link TEXT)''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY AUTOINCREMENT, test_code INTEGER UNIQUE, owner_user_id INTEGER, question_file_id TEXT, question_file_type TEXT, answer_key TEXT, duration_minutes INTEGER, created_at INTEGER NOT NULL, status TEXT DEFAULT 'active')''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS user_test_sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, test_id INTEGER, start_time INTEGER, FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE, UNIQUE(user_id, test_id))''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS user_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id INTEGER, user_id INTEGER, score INTEGER, submitted_answers TEXT, submitted_at INTEGER, FOREIGN KEY (session_id) REFERENCES user_test_sessions (id) ON DELETE CASCADE, UNIQUE(session_id, user_id))''')
-        await db.commit()
-        logging.info("Ma'lumotlar bazasi muvaffaqiyatli sozlandi.")
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Yagona yozuvchi ulanishda tranzaksiya: muvaffaqiyatda commit, xatoda rollback."""
+        if not self.is_open:
+            raise RuntimeError("Ma'lumotlar bazasi ochilmagan: avval setup_database() chaqirilishi kerak.")
+        if self.writer is None:
+            raise RuntimeError("Bu jarayonda yozuvchi ulanish yo'q: yozish bosh jarayon orqali bajariladi.")
+        async with self._write_lock:
+            try:
+                yield self.writer
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+
+pool = ConnectionPool(DB_NAME, DB_READ_POOL_SIZE)
+
+
+async def close_database():
+    await pool.close()
+
+
+async def setup_database():
+    await pool.open()
+    async with pool.write() as db:
+        # Sxema migratsiyalar orqali yaratiladi va yangilanadi (migrations.py)
+        await apply_migrations(db)
+    logging.info("Ma'lumotlar bazasi muvaffaqiyatli sozlandi.")
+
+# Yaqinda saqlangan foydalanuvchilar: user_id -> (username, full_name).
+# /start takrorlanganda ma'lumot o'zgarmagan bo'lsa, bazaga umuman murojaat qilinmaydi.
+_recent_users = TTLCache(maxsize=USER_CACHE_SIZE, default_ttl=USER_CACHE_TTL)
+
+@cluster.replicated
+def _forget_recent_users(user_ids):
+    for user_id in user_ids:
+        _recent_users.pop(user_id)
 
 async def add_user(user_id, username, full_name, referred_by_id=None) -> bool:
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-        user_exists = await cursor.fetchone()
-
-        if not user_exists:
-            await db.execute(
-                "INSERT INTO users (user_id, username, full_name, referred_by_id) VALUES (?, ?, ?, ?)",
-                (user_id, username, full_name, referred_by_id)
-            )
-            await db.commit()
+    """Foydalanuvchini saqlaydi yoki ma'lumotlarini yangilaydi. Yangi foydalanuvchi bo'lsa True."""
+    if _recent_users.get(user_id) == (username, full_name):
+        return False
+    is_new = await _upsert_user(user_id, username, full_name, referred_by_id)
+    _recent_users.set(user_id, (username, full_name))
+    return is_new
+
+@cluster.writer
+async def _upsert_user(user_id, username, full_name, referred_by_id) -> bool:
+    async with pool.write() as db:
+        # SQLite'da upsert'ning RETURNING qismi qo'shilgan va yangilangan qatorni ajratmaydi,
+        # referral bonusi uchun esa aynan shu kerak - shuning uchun avval DO NOTHING
+        cursor = await db.execute(
+            "INSERT INTO users (user_id, username, full_name, referred_by_id) VALUES (?, ?, ?, ?) ON CONFLICT(user_id) DO NOTHING",
+            (user_id, username, full_name, referred_by_id)
+        )
+        if cursor.rowcount == 1:
             return True
-        else:
-            await db.execute(
-                "UPDATE users SET username = ?, full_name = ?, status = 'active' WHERE user_id = ?",
-                (username, full_name, user_id)
-            )
-            await db.commit()
-            return False
+        # Mavjud foydalanuvchi: faqat nimadir o'zgargan bo'lsa yoziladi
+        await db.execute(
+            "UPDATE users SET username = ?, full_name = ?, status = 'active' WHERE user_id = ? AND (username IS NOT ? OR full_name IS NOT ? OR status IS NOT 'active')",
+            (username, full_name, user_id, username, full_name)
+        )
+        return False
+
+@cluster.writer
+async def save_last_seen(items):
+    """`items` - (user_id, vaqt) ro'yxati; bitta tranzaksiyada yoziladi."""
+    async with pool.write() as db:
+        await db.executemany("UPDATE users SET last_seen = ? WHERE user_id = ? AND (last_seen IS NULL OR last_seen < ?)", [(seen, user_id, seen) for user_id, seen in items])
+
+# Majburiy kanallar ro'yxati har bir xabarda kerak bo'ladi, shuning uchun xotirada
+# saqlanadi. `add_channel` va `delete_channel` uni bekor qiladi.
+_channels_cache = None
+_channels_generation = 0
+
+@cluster.replicated
+def invalidate_channels_cache():
+    global _channels_cache, _channels_generation
+    _channels_cache = None
+    _channels_generation += 1
 
+@cluster.writer
 async def add_channel(channel_id, username=None, invite_link=None):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.write() as db:
         cursor = await db.execute("SELECT channel_id FROM channels WHERE channel_id = ?", (channel_id,))
         if await cursor.fetchone():
             await db.execute("UPDATE channels SET username = ?, invite_link = ? WHERE channel_id = ?", (username, invite_link, channel_id))
-            await db.commit()
-            return False
+            is_new = False
         else:
             await db.execute("INSERT INTO channels (channel_id, username, invite_link) VALUES (?, ?, ?)", (channel_id, username, invite_link))
-            await db.commit()
-            return True
+            is_new = True
+    invalidate_channels_cache()
+    return is_new
 
 async def get_channels():
-    async with aiosqlite.connect(DB_NAME) as db:
+    global _channels_cache
+    if _channels_cache is not None:
+        return list(_channels_cache)
+    generation = _channels_generation
+    async with pool.read() as db:
         cursor = await db.execute("SELECT channel_id, username, invite_link FROM channels")
-        return await cursor.fetchall()
+        channels = await cursor.fetchall()
+    # O'qish davomida ro'yxat o'zgargan bo'lsa, eskirgan natija keshga yozilmaydi
+    if generation == _channels_generation:
+        _channels_cache = tuple(channels)
+    return channels
+
+# --- Referral konkursi ---
+# Ballar joriy (eng katta ID'li) konkurs bo'yicha `contest_referrals` da saqlanadi.
+# Reytingning TOP qismi xotirada: ballar faqat oshgani uchun uni har bir
+# yangi taklifda bazaga murojaat qilmasdan yangilash mumkin.
+_contest_top = None
+_contest_generation = 0
+_CURRENT_CONTEST = "(SELECT MAX(id) FROM contests)"
+
+@cluster.replicated
+def _apply_referral(user_id, full_name, count):
+    global _contest_top, _contest_generation
+    _contest_generation += 1
+    if _contest_top is None:
+        return
+    top = [entry for entry in _contest_top if entry[0] != user_id]
+    if len(top) < CONTEST_TOP_SIZE or count > top[-1][2]:
+        top.append((user_id, full_name, count))
+        # sorted() barqaror: teng ball bo'lsa, avvalroq erishgan yuqorida qoladi
+        top = sorted(top, key=lambda entry: -entry[2])[:CONTEST_TOP_SIZE]
+    _contest_top = top
+
+@cluster.replicated
+def _reset_contest_top():
+    global _contest_top, _contest_generation
+    # Yangi yoki tozalangan konkursda hali hech kim yo'q
+    _contest_top = []
+    _contest_generation += 1
 
+@cluster.writer
 async def update_referral_count(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ?", (user_id,))
-        await db.commit()
+    async with pool.write() as db:
+        cursor = await db.execute(
+            f"INSERT INTO contest_referrals (contest_id, user_id, count) VALUES ({_CURRENT_CONTEST}, ?, 1) "
+            "ON CONFLICT(contest_id, user_id) DO UPDATE SET count = count + 1 RETURNING count",
+            (user_id,)
+        )
+        count = (await cursor.fetchone())[0]
+        cursor = await db.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+    _apply_referral(user_id, row[0] if row else None, count)
 
 async def get_referred_by(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         cursor = await db.execute("SELECT referred_by_id FROM users WHERE user_id = ?", (user_id,))
         result = await cursor.fetchone()
         return result[0] if result else None
 
-async def create_test(owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes):
-    async with aiosqlite.connect(DB_NAME) as db:
-        cursor = await db.execute("SELECT MAX(test_code) FROM tests")
-        last_code_result = await cursor.fetchone()
-        last_code = last_code_result[0] if last_code_result[0] else 1000
-        new_code = 1001 if last_code < 1001 else last_code + 1
-        await db.execute(
-            "INSERT INTO tests (test_code, owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes, created_at, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (new_code, owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes, int(time.time()), 'active')
-        )
-        await db.commit()
-        return new_code
+# --- Aktiv testlar keshi ---
+# Imtihon paytida bir xil test_code minglab marta so'raladi, shuning uchun test
+# yozuvlari xotirada saqlanadi. Testni yaratish, yopish va o'chirish keshni
+# aniq yangilaydi yoki bekor qiladi.
+_test_cache = TTLCache(maxsize=TEST_CACHE_SIZE)
+_test_loads = {}
+# Har bir bekor qilishda oshiriladi: o'qish davomida o'zgargan yozuv keshga yozilmaydi
+_test_cache_generation = 0
 
-async def get_test_by_code(test_code):
-    async with aiosqlite.connect(DB_NAME) as db:
+def _set_test_cache(test_code, row):
+    global _test_cache_generation
+    _test_cache_generation += 1
+    if row is None:
+        _test_cache.pop(test_code)
+    else:
+        _test_cache.set(test_code, row)
+
+@cluster.replicated
+def _invalidate_test_cache(test_code, row=None):
+    _set_test_cache(test_code, row)
+
+@cluster.replicated
+def _mark_test_closed_in_cache(test_code):
+    row = _test_cache.get(test_code)
+    _set_test_cache(test_code, row[:6] + ('closed',) if row else None)
+
+@cluster.writer
+async def create_test(owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes, ends_at=None):
+    # Kod xotiradagi zaxiradan olinadi (MAX(test_code) o'qilmaydi)
+    while True:
+        new_code = await test_codes.allocate()
+        try:
+            async with pool.write() as db:
+                cursor = await db.execute(
+                    "INSERT INTO tests (test_code, owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes, created_at, status, ends_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (new_code, owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes, int(time.time()), 'active', ends_at)
+                )
+                test_id = cursor.lastrowid
+            break
+        except aiosqlite.IntegrityError:
+            # Kod boshqa yo'l bilan (masalan, qo'lda) band qilingan - keyingisi olinadi
+            logging.warning(f"Test kodi {new_code} band, boshqasi olinmoqda.")
+    _invalidate_test_cache(new_code, (test_id, question_file_id, question_file_type, duration_minutes, owner_user_id, answer_key, 'active'))
+    return new_code
+
+@cluster.writer
+async def reserve_sequence_block(name: str, size: int) -> int:
+    """Ketma-ketlikdan `size` ta qiymatni band qiladi va birinchisini qaytaradi."""
+    async with pool.write() as db:
+        cursor = await db.execute("UPDATE sequences SET next_value = next_value + ? WHERE name = ? RETURNING next_value - ?", (size, name, size))
+        return (await cursor.fetchone())[0]
+
+# Bitta `IN (...)` so'roviga beriladigan qiymatlar soni (SQLite o'zgaruvchilar chegarasidan ancha past)
+_IN_CHUNK_SIZE = 500
+
+async def find_existing_test_codes(codes) -> set:
+    """Berilgan kodlardan bazada allaqachon mavjudlari (SQLite o'zgaruvchilar chegarasi uchun 500 tadan so'rovda)."""
+    codes = list(codes)
+    existing = set()
+    async with pool.read() as db:
+        for start in range(0, len(codes), _IN_CHUNK_SIZE):
+            chunk = codes[start:start + _IN_CHUNK_SIZE]
+            cursor = await db.execute(f"SELECT test_code FROM tests WHERE test_code IN ({','.join('?' * len(chunk))})", chunk)
+            existing.update(row[0] for row in await cursor.fetchall())
+    return existing
+
+async def count_test_codes_between(low: int, high: int) -> int:
+    """[low, high) oralig'idagi band test kodlari soni."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM tests WHERE test_code >= ? AND test_code < ?", (low, high))
+        return (await cursor.fetchone())[0]
+
+async def _load_test_by_code(test_code):
+    generation = _test_cache_generation
+    async with pool.read() as db:
         cursor = await db.execute(
             "SELECT id, question_file_id, question_file_type, duration_minutes, owner_user_id, answer_key, status FROM tests WHERE test_code = ?",
             (test_code,)
         )
-        return await cursor.fetchone()
+        row = await cursor.fetchone()
+    if row is not None and generation == _test_cache_generation:
+        _test_cache.set(test_code, tuple(row))
+    return row
+
+async def get_test_by_code(test_code):
+    row = _test_cache.get(test_code)
+    if row is not None:
+        return row
+    # Bir vaqtda kelgan so'rovlar bazaga bitta so'rov yuboradi
+    task = _test_loads.get(test_code)
+    if task is None:
+        task = asyncio.ensure_future(_load_test_by_code(test_code))
+        _test_loads[test_code] = task
+        task.add_done_callback(lambda _: _test_loads.pop(test_code, None))
+    return await asyncio.shield(task)
 
 async def get_user_fullname(user_id):
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,)); result = await cursor.fetchone(); return result[0] if result else None
+    async with pool.read() as db: cursor = await db.execute("SELECT full_name FROM users WHERE user_id = ?", (user_id,)); result = await cursor.fetchone(); return result[0] if result else None
 
 async def get_user_referral_count(user_id):
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT referral_count FROM users WHERE user_id = ?", (user_id,)); result = await cursor.fetchone(); return result[0] if result else 0
+    async with pool.read() as db: cursor = await db.execute(f"SELECT count FROM contest_referrals WHERE contest_id = {_CURRENT_CONTEST} AND user_id = ?", (user_id,)); result = await cursor.fetchone(); return result[0] if result else 0
 
 async def get_contest_stats():
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT full_name, referral_count FROM users WHERE referral_count > 0 ORDER BY referral_count DESC LIMIT 10"); return await cursor.fetchall()
+    """Joriy konkursning TOP qismi: (full_name, count) ro'yxati. Odatda xotiradan qaytadi."""
+    global _contest_top
+    if _contest_top is None:
+        generation = _contest_generation
+        async with pool.read() as db:
+            cursor = await db.execute(f"SELECT cr.user_id, u.full_name, cr.count FROM contest_referrals cr LEFT JOIN users u ON u.user_id = cr.user_id WHERE cr.contest_id = {_CURRENT_CONTEST} ORDER BY cr.count DESC LIMIT ?", (CONTEST_TOP_SIZE,))
+            top = await cursor.fetchall()
+        # O'qish davomida ball o'zgargan bo'lsa, eskirgan natija keshga yozilmaydi
+        if generation == _contest_generation:
+            _contest_top = top
+        return [(full_name, count) for _, full_name, count in top]
+    return [(full_name, count) for _, full_name, count in _contest_top]
+
+@cluster.writer
+async def start_new_contest():
+    """Yangi konkurs - bitta qator qo'shiladi; avvalgi konkurs ballari tarix sifatida qoladi."""
+    async with pool.write() as db: await db.execute("INSERT INTO contests (started_at) VALUES (?)", (int(time.time()),))
+    _reset_contest_top()
 
-async def clear_all_referral_counts():
-    async with aiosqlite.connect(DB_NAME) as db: await db.execute("UPDATE users SET referral_count = 0"); await db.commit()
+@cluster.writer
+async def clear_current_contest():
+    """Joriy konkurs ballarini o'chiradi (faqat shu konkurs ishtirokchilari qatorlari)."""
+    async with pool.write() as db: await db.execute(f"DELETE FROM contest_referrals WHERE contest_id = {_CURRENT_CONTEST}")
+    _reset_contest_top()
 
 async def get_all_user_ids():
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT user_id FROM users WHERE status = 'active'"); return [row[0] for row in await cursor.fetchall()]
+    async with pool.read() as db: cursor = await db.execute("SELECT user_id FROM users WHERE status = 'active'"); return [row[0] for row in await cursor.fetchall()]
 
 async def get_active_users_count():
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT COUNT(user_id) FROM users WHERE status = 'active'"); result = await cursor.fetchone(); return result[0] if result else 0
+    async with pool.read() as db: cursor = await db.execute("SELECT COUNT(user_id) FROM users WHERE status = 'active'"); result = await cursor.fetchone(); return result[0] if result else 0
 
+@cluster.writer
 async def delete_channel(channel_id):
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,)); await db.commit(); return cursor.rowcount > 0
+    async with pool.write() as db: cursor = await db.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
+    invalidate_channels_cache()
+    return cursor.rowcount > 0
 
+@cluster.writer
 async def close_test(test_code: int):
-    async with aiosqlite.connect(DB_NAME) as db: await db.execute("UPDATE tests SET status = 'closed' WHERE test_code = ?", (test_code,)); await db.commit()
+    async with pool.write() as db: await db.execute("UPDATE tests SET status = 'closed' WHERE test_code = ?", (test_code,))
+    _mark_test_closed_in_cache(test_code)
 
-async def start_user_session(user_id, test_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        try:
-            await db.execute("INSERT INTO user_test_sessions (user_id, test_id, start_time) VALUES (?, ?, ?)", (user_id, test_id, int(time.time())))
-            await db.commit()
-            return True
-        except aiosqlite.IntegrityError:
-            return False
+@cluster.writer
+async def start_user_session(user_id, test_id, duration_minutes=0):
+    """Yangi sessiya: (session_id, deadline_at) - vaqt cheklanmagan bo'lsa deadline_at None. Sessiya mavjud bo'lsa None."""
+    start_time = int(time.time())
+    deadline_at = start_time + duration_minutes * 60 if duration_minutes > 0 else None
+    try:
+        async with pool.write() as db:
+            cursor = await db.execute("INSERT INTO user_test_sessions (user_id, test_id, start_time, deadline_at) VALUES (?, ?, ?, ?)", (user_id, test_id, start_time, deadline_at))
+        return cursor.lastrowid, deadline_at
+    except aiosqlite.IntegrityError:
+        return None
+
+async def iter_pending_deadlines(since: int, batch_size: int = 10000):
+    """Hali "vaqt tugadi" xabari yuborilmagan muddatlar: (session_id, deadline_at, notice_state) bo'laklari."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT id, deadline_at, notice_state FROM user_test_sessions WHERE notice_state < 2 AND deadline_at IS NOT NULL AND deadline_at >= ?", (since,))
+        while True:
+            rows = await cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+async def get_deadline_recipients(session_ids, notice_state: int):
+    """Xabar kerak bo'lgan sessiyalar: (session_id, user_id, test_code) - javob bermagan, test aktiv, xabar hali yuborilmagan."""
+    session_ids = list(session_ids)
+    async with pool.read() as db:
+        cursor = await db.execute(
+            f"SELECT uts.id, uts.user_id, t.test_code FROM user_test_sessions uts JOIN tests t ON t.id = uts.test_id "
+            f"WHERE uts.id IN ({','.join('?' * len(session_ids))}) AND uts.notice_state < ? AND t.status = 'active' "
+            "AND NOT EXISTS (SELECT 1 FROM user_answers ua WHERE ua.session_id = uts.id)",
+            (*session_ids, notice_state)
+        )
+        return await cursor.fetchall()
+
+@cluster.writer
+async def set_notice_state(session_ids, notice_state: int):
+    async with pool.write() as db:
+        await db.executemany("UPDATE user_test_sessions SET notice_state = ? WHERE id = ? AND notice_state < ?", [(notice_state, session_id, notice_state) for session_id in session_ids])
 
 async def get_user_session(user_id, test_id):
-     async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT id, start_time FROM user_test_sessions WHERE user_id = ? AND test_id = ?", (user_id, test_id)); return await cursor.fetchone()
+     async with pool.read() as db: cursor = await db.execute("SELECT id, start_time FROM user_test_sessions WHERE user_id = ? AND test_id = ?", (user_id, test_id)); return await cursor.fetchone()
+
+async def _record_item_stats(db, answers) -> list:
+    """
+    Yangi saqlangan javoblar bo'yicha savollar tahlilini shu (yozish) tranzaksiyasida oshiradi.
+    `answers` - (session_id, score, submitted_answers, submitted_at) ro'yxati.
+    Ball bazadagi joriy kalit bo'yicha qayta hisoblanadi: javob keshdagi eski kalit bilan
+    baholanib, qayta baholash uning sessiyasidan o'tib ketgandan keyin yozilsa, bali shu yerda tuzatiladi.
+    Jonli reyting uchun (test_id, user_id, full_name, score, sarflangan_vaqt) ro'yxatini qaytaradi.
+    """
+    # Butun guruh sessiyalari bitta (katta guruhda - bir necha) so'rov bilan olinadi
+    session_ids = list({answer[0] for answer in answers})
+    sessions = {}
+    for start in range(0, len(session_ids), _IN_CHUNK_SIZE):
+        chunk = session_ids[start:start + _IN_CHUNK_SIZE]
+        cursor = await db.execute(f"SELECT uts.id, t.id, t.answer_key, uts.user_id, uts.start_time, u.full_name FROM user_test_sessions uts JOIN tests t ON t.id = uts.test_id LEFT JOIN users u ON u.user_id = uts.user_id WHERE uts.id IN ({','.join('?' * len(chunk))})", chunk)
+        sessions.update((row[0], row[1:]) for row in await cursor.fetchall())
+    by_test = {}
+    for session_id, score, submitted_answers, submitted_at in answers:
+        row = sessions.get(session_id)
+        if row:
+            test_id, answer_key, user_id, start_time, full_name = row
+            by_test.setdefault((test_id, answer_key), []).append((session_id, score, submitted_answers or "", user_id, full_name, submitted_at - start_time))
+    entries = []
+    for (test_id, answer_key), items in by_test.items():
+        submissions = [item[2] for item in items]
+        scores = scoring.grade_bulk(answer_key, submissions)[0].tolist()
+        stale = [(score, item[0]) for item, score in zip(items, scores) if score != item[1]]
+        if stale:
+            await db.executemany("UPDATE user_answers SET score = ? WHERE session_id = ?", stale)
+        entries.extend((test_id, user_id, full_name, score, duration) for (_, _, _, user_id, full_name, duration), score in zip(items, scores))
+        questions, options = scoring.item_increments(answer_key, submissions, scores)
+        await db.execute("INSERT INTO test_stats (test_id, participants, score_sum, score_sq_sum) VALUES (?, ?, ?, ?) ON CONFLICT(test_id) DO UPDATE SET participants = participants + excluded.participants, score_sum = score_sum + excluded.score_sum, score_sq_sum = score_sq_sum + excluded.score_sq_sum", (test_id, len(items), sum(scores), sum(score * score for score in scores)))
+        await db.executemany("INSERT INTO question_stats (test_id, question, correct, correct_score_sum) VALUES (?, ?, ?, ?) ON CONFLICT(test_id, question) DO UPDATE SET correct = correct + excluded.correct, correct_score_sum = correct_score_sum + excluded.correct_score_sum", [(test_id, *row) for row in questions])
+        await db.executemany("INSERT INTO option_stats (test_id, question, option, count) VALUES (?, ?, ?, ?) ON CONFLICT(test_id, question, option) DO UPDATE SET count = count + excluded.count", [(test_id, *row) for row in options])
+    return entries
 
+@cluster.writer
 async def save_user_answer(session_id, user_id, score, submitted_answers):
-    async with aiosqlite.connect(DB_NAME) as db:
-        try:
-            await db.execute("INSERT INTO user_answers (session_id, user_id, score, submitted_answers, submitted_at) VALUES (?, ?, ?, ?, ?)", (session_id, user_id, score, submitted_answers, int(time.time())))
-            await db.commit()
-            return True
-        except aiosqlite.IntegrityError:
-            return False
+    submitted_at = int(time.time())
+    try:
+        async with pool.write() as db:
+            await db.execute("INSERT INTO user_answers (session_id, user_id, score, submitted_answers, submitted_at) VALUES (?, ?, ?, ?, ?)", (session_id, user_id, score, submitted_answers, submitted_at))
+            entries = await _record_item_stats(db, [(session_id, score, submitted_answers, submitted_at)])
+    except aiosqlite.IntegrityError:
+        return False
+    # Reyting faqat commit'dan keyin yangilanadi
+    leaderboard.record(entries)
+    return True
+
+@cluster.writer
+async def save_user_answers_batch(rows) -> list:
+    """
+    Bir nechta javobni bitta tranzaksiyada saqlaydi (guruhli commit).
+    `rows` - (session_id, user_id, score, submitted_answers, submitted_at) ro'yxati.
+    Har bir qator uchun yozildi/yozilmadi (takroriy javob) natijasini qaytaradi.
+    """
+    results = []
+    async with pool.write() as db:
+        for row in rows:
+            cursor = await db.execute("INSERT INTO user_answers (session_id, user_id, score, submitted_answers, submitted_at) VALUES (?, ?, ?, ?, ?) ON CONFLICT(session_id, user_id) DO NOTHING", row)
+            results.append(cursor.rowcount == 1)
+        entries = await _record_item_stats(db, [(row[0], row[2], row[3], row[4]) for row, inserted in zip(rows, results) if inserted])
+    leaderboard.record(entries)
+    return results
 
 async def get_user_tests(owner_user_id):
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT test_code FROM tests WHERE owner_user_id = ? AND status = 'active' ORDER BY id DESC", (owner_user_id,)); return await cursor.fetchall()
+    async with pool.read() as db: cursor = await db.execute("SELECT test_code FROM tests WHERE owner_user_id = ? AND status = 'active' ORDER BY id DESC", (owner_user_id,)); return await cursor.fetchall()
 
 async def get_test_participant_count(test_code: int) -> int:
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT COUNT(ua.id) FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id JOIN tests t ON uts.test_id = t.id WHERE t.test_code = ?", (test_code,)); result = await cursor.fetchone(); return result[0] if result else 0
+    async with pool.read() as db: cursor = await db.execute("SELECT COUNT(ua.id) FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id JOIN tests t ON uts.test_id = t.id WHERE t.test_code = ?", (test_code,)); result = await cursor.fetchone(); return result[0] if result else 0
+
+# SQL so'roviga `uts.start_time` va `ua.submitted_at` qo'shildi
+# ORDER BY: avval balli yuqorilar, keyin tezroq ishlaganlar
+_TEST_RESULTS_QUERY = """
+SELECT
+    u.user_id,
+    u.full_name,
+    ua.score,
+    uts.start_time,
+    ua.submitted_at
+FROM
+    user_answers ua
+JOIN
+    user_test_sessions uts ON ua.session_id = uts.id
+JOIN
+    users u ON ua.user_id = u.user_id
+WHERE
+    uts.test_id = ?
+ORDER BY
+    ua.score DESC,
+    (ua.submitted_at - uts.start_time) ASC
+"""
 
 # --- O'ZGARISH: `get_test_results` funksiyasi to'liq yangilandi ---
+async def get_leaderboard_rows(test_id: int):
+    """Jonli reytingni tiklash uchun: (user_id, full_name, score, sarflangan_vaqt), reyting tartibida."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT uts.user_id, u.full_name, ua.score, ua.submitted_at - uts.start_time FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id LEFT JOIN users u ON u.user_id = uts.user_id WHERE uts.test_id = ? ORDER BY ua.score DESC, (ua.submitted_at - uts.start_time) ASC", (test_id,))
+        return await cursor.fetchall()
+
 async def get_test_results(test_code):
     """
     Excel uchun barcha kerakli ma'lumotlarni oladi:
     F.I.O, ID, ball, boshlash vaqti, tugatish vaqti.
     """
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with pool.read() as db:
         cursor = await db.execute("SELECT id, owner_user_id, answer_key FROM tests WHERE test_code = ?", (test_code,))
         test_info = await cursor.fetchone()
         if not test_info:
             return None, None, None
 
         test_id, owner_user_id, answer_key = test_info
-
-        # SQL so'roviga `uts.start_time` va `ua.submitted_at` qo'shildi
-        query = """
-        SELECT
-            u.user_id,
-            u.full_name,
-            ua.score,
-            uts.start_time,
-            ua.submitted_at
-        FROM
-            user_answers ua
-        JOIN
-            user_test_sessions uts ON ua.session_id = uts.id
-        JOIN
-            users u ON ua.user_id = u.user_id
-        WHERE
-            uts.test_id = ?
-        ORDER BY
-            ua.score DESC,
-            (ua.submitted_at - uts.start_time) ASC
-        """
-        # ORDER BY: avval balli yuqorilar, keyin tezroq ishlaganlar
-        cursor = await db.execute(query, (test_id,))
+        cursor = await db.execute(_TEST_RESULTS_QUERY, (test_id,))
         results = await cursor.fetchall()
 
         return results, owner_user_id, answer_key
 
+# --- Sinxron o'qish (ishchi oqim yoki jarayonlar uchun) ---
+
+@contextmanager
+def open_readonly_connection():
+    """Event loop'dan tashqarida ishlatiladigan alohida, faqat o'qish uchun ulanish."""
+    conn = sqlite3.connect(f"file:{DB_NAME}?mode=ro", uri=True)
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def get_test_results_summary(conn, test_id):
+    """
+    Natijalar jadvali ustunlarining kengligi uchun kerakli maksimumlarni bitta
+    agregat so'rov bilan hisoblaydi: (qatorlar soni, eng uzun ism, eng uzun ID).
+    """
+    cursor = conn.execute(
+        "SELECT COUNT(*), MAX(COALESCE(LENGTH(u.full_name), 4)), MAX(LENGTH(u.user_id)) FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id JOIN users u ON ua.user_id = u.user_id WHERE uts.test_id = ?",
+        (test_id,)
+    )
+    count, name_length, id_length = cursor.fetchone()
+    return count, name_length or 0, id_length or 0
+
+def stream_test_results(conn, test_id, batch_size: int = 1000):
+    """Natijalarni `get_test_results` tartibida, xotiraga to'liq yuklamasdan qaytaradi."""
+    cursor = conn.execute(_TEST_RESULTS_QUERY, (test_id,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+@cluster.writer
+async def update_answer_key(test_code: int, answer_key: str) -> bool:
+    """Aktiv testning javoblar kalitini almashtiradi. Test topilmasa yoki yopilgan bo'lsa False."""
+    async with pool.write() as db:
+        cursor = await db.execute("UPDATE tests SET answer_key = ? WHERE test_code = ? AND status = 'active'", (answer_key, test_code))
+        updated = cursor.rowcount == 1
+    if updated:
+        _invalidate_test_cache(test_code)
+    return updated
+
+async def get_test_submissions_after(test_id: int, after_session_id: int, limit: int):
+    """Qayta baholash uchun: (session_id, answer_id, submitted_answers, score), sessiya ID bo'yicha sahifalab."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT uts.id, ua.id, ua.submitted_answers, ua.score FROM user_test_sessions uts JOIN user_answers ua ON ua.session_id = uts.id WHERE uts.test_id = ? AND uts.id > ? ORDER BY uts.id LIMIT ?", (test_id, after_session_id, limit))
+        return await cursor.fetchall()
+
+async def get_answer_key(test_id: int):
+    """Bazadagi joriy kalit (keshdan emas) - qayta baholash shu bilan boshlanadi."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT answer_key FROM tests WHERE id = ?", (test_id,))
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+@cluster.writer
+async def update_answer_scores(test_id: int, answer_key: str, changes) -> bool:
+    """
+    `changes` - (yangi_ball, answer_id) ro'yxati; bitta qisqa tranzaksiyada yoziladi.
+    Testning kaliti shu orada yana o'zgargan bo'lsa, hech narsa yozilmaydi va False qaytadi.
+    """
+    async with pool.write() as db:
+        cursor = await db.execute("SELECT answer_key FROM tests WHERE id = ?", (test_id,))
+        row = await cursor.fetchone()
+        if not row or row[0] != answer_key:
+            return False
+        await db.executemany("UPDATE user_answers SET score = ? WHERE id = ?", changes)
+        return True
+
+async def _reset_item_stats(test_id: int) -> int:
+    """Test tahlilini tozalaydi. Shu paytgacha saqlangan eng katta javob ID'sini qaytaradi."""
+    async with pool.write() as db:
+        for table in ("test_stats", "question_stats", "option_stats"):
+            await db.execute(f"DELETE FROM {table} WHERE test_id = ?", (test_id,))
+        cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM user_answers")
+        return (await cursor.fetchone())[0]
+
+async def _add_item_stats_page(test_id: int, after_session_id: int, max_answer_id: int, limit: int) -> int:
+    """Bitta sahifa javobni tahlilga qo'shadi (alohida qisqa tranzaksiya). Sahifadagi oxirgi sessiya ID'si yoki 0."""
+    async with pool.write() as db:
+        cursor = await db.execute(
+            "SELECT uts.id, ua.score, ua.submitted_answers, ua.submitted_at FROM user_test_sessions uts JOIN user_answers ua ON ua.session_id = uts.id "
+            "WHERE uts.test_id = ? AND uts.id > ? AND ua.id <= ? ORDER BY uts.id LIMIT ?",
+            (test_id, after_session_id, max_answer_id, limit)
+        )
+        rows = await cursor.fetchall()
+        await _record_item_stats(db, rows)
+    return rows[-1][0] if rows else 0
+
+@cluster.writer
+async def rebuild_item_stats(test_id: int):
+    """
+    Kalit o'zgargandan keyin test tahlilini saqlangan javoblardan qaytadan hisoblaydi.
+    Javoblar REGRADE_CHUNK_SIZE tadan, har sahifa alohida tranzaksiyada qo'shiladi - yozuvchi
+    qulfi butun test uchun ushlab turilmaydi. Tozalashdan keyin kelgan javoblarni saqlash
+    yo'lining o'zi qo'shadi, shuning uchun sahifalar faqat undan oldingilarni (ua.id <= max) oladi.
+    """
+    max_answer_id = await _reset_item_stats(test_id)
+    last_session_id = 0
+    while True:
+        last_session_id = await _add_item_stats_page(test_id, last_session_id, max_answer_id, REGRADE_CHUNK_SIZE)
+        if not last_session_id:
+            break
+        await asyncio.sleep(0)
+    # Ballar o'zgargan - jonli reyting keyingi so'rovda bazadan qayta tiklanadi
+    leaderboard.invalidate(test_id)
+
+async def get_test_stats(test_id: int):
+    """(ishtirokchilar, ballar yig'indisi, ballar kvadratlari yig'indisi) yoki None."""
+    async with pool.read() as db: cursor = await db.execute("SELECT participants, score_sum, score_sq_sum FROM test_stats WHERE test_id = ?", (test_id,)); return await cursor.fetchone()
+
+async def get_question_stats(test_id: int, question: int):
+    """(to'g'ri javoblar soni, ularning ballari yig'indisi, [(variant, soni), ...]) - savol 0 dan raqamlanadi."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT correct, correct_score_sum FROM question_stats WHERE test_id = ? AND question = ?", (test_id, question))
+        row = await cursor.fetchone()
+        cursor = await db.execute("SELECT option, count FROM option_stats WHERE test_id = ? AND question = ? ORDER BY option", (test_id, question))
+        options = await cursor.fetchall()
+    correct, correct_score_sum = row if row else (0, 0)
+    return correct, correct_score_sum, options
+
 async def get_user_answer_details(test_code, user_id):
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT t.answer_key, ua.submitted_answers FROM tests t JOIN user_test_sessions uts ON t.id = uts.test_id JOIN user_answers ua ON uts.id = ua.session_id WHERE t.test_code = ? AND uts.user_id = ?", (test_code, user_id)); return await cursor.fetchone()
+    async with pool.read() as db: cursor = await db.execute("SELECT t.answer_key, ua.submitted_answers FROM tests t JOIN user_test_sessions uts ON t.id = uts.test_id JOIN user_answers ua ON uts.id = ua.session_id WHERE t.test_code = ? AND uts.user_id = ?", (test_code, user_id)); return await cursor.fetchone()
 
 async def has_user_answered(user_id, test_id):
-    async with aiosqlite.connect(DB_NAME) as db: cursor = await db.execute("SELECT ua.id FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id WHERE uts.user_id = ? AND uts.test_id = ?", (user_id, test_id)); return await cursor.fetchone() is not None
-
-async def delete_old_tests(days_old: int = 4):
-    async with aiosqlite.connect(DB_NAME) as db:
-        time_threshold = int(time.time()) - (days_old * 24 * 60 * 60)
-        cursor = await db.execute("DELETE FROM tests WHERE created_at < ? AND status = 'closed'", (time_threshold,))
-        deleted_count = cursor.rowcount
-        await db.commit()
-        if deleted_count > 0:
-            logging.info(f"{deleted_count} ta eskirgan va yopilgan test bazadan o'chirildi.")
-        return deleted_count
+    async with pool.read() as db: cursor = await db.execute("SELECT ua.id FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id WHERE uts.user_id = ? AND uts.test_id = ?", (user_id, test_id)); return await cursor.fetchone() is not None
+
+# --- Arxivlash va tozalash (services/retention.py) ---
+# Har bir qadam alohida qisqa tranzaksiya: yozish qulfi uzoq ushlab turilmaydi.
+
+async def get_archivable_tests(older_than: int, limit: int = 100):
+    """Arxivlanadigan yopilgan testlar: (id, test_code, owner_user_id, answer_key, duration_minutes, created_at). Natijalari hali yuborilayotganlar chiqarib tashlanadi."""
+    async with pool.read() as db:
+        cursor = await db.execute(
+            "SELECT t.id, t.test_code, t.owner_user_id, t.answer_key, t.duration_minutes, t.created_at FROM tests t "
+            "WHERE t.created_at < ? AND t.status = 'closed' AND t.archived_at IS NULL "
+            "AND NOT EXISTS (SELECT 1 FROM result_jobs j WHERE j.test_code = t.test_code AND j.status = 'running') LIMIT ?",
+            (older_than, limit)
+        )
+        return await cursor.fetchall()
+
+async def get_test_archive_rows(test_id: int, after_session_id: int, limit: int):
+    """Arxiv uchun sessiyalar va javoblar: (session_id, user_id, start_time, score, submitted_answers, submitted_at), sessiya ID bo'yicha sahifalab."""
+    async with pool.read() as db:
+        cursor = await db.execute(
+            "SELECT uts.id, uts.user_id, uts.start_time, ua.score, ua.submitted_answers, ua.submitted_at FROM user_test_sessions uts "
+            "LEFT JOIN user_answers ua ON ua.session_id = uts.id WHERE uts.test_id = ? AND uts.id > ? ORDER BY uts.id LIMIT ?",
+            (test_id, after_session_id, limit)
+        )
+        return await cursor.fetchall()
+
+@cluster.writer
+async def mark_test_archived(test_id: int):
+    async with pool.write() as db:
+        await db.execute("UPDATE tests SET archived_at = ? WHERE id = ?", (int(time.time()), test_id))
+
+async def get_archived_tests():
+    """Arxiv fayli yozilgan, lekin bazadan hali o'chirilmagan testlar: (id, test_code)."""
+    async with pool.read() as db: cursor = await db.execute("SELECT id, test_code FROM tests WHERE archived_at IS NOT NULL"); return await cursor.fetchall()
+
+@cluster.writer
+async def delete_archived_test_chunk(test_id: int, test_code: int, limit: int) -> int:
+    """Arxivlangan testning bir bo'lak sessiya/javob yoki natija qatorlarini o'chiradi. O'chirilgan qatorlar soni."""
+    async with pool.write() as db:
+        cursor = await db.execute("SELECT id FROM user_test_sessions WHERE test_id = ? LIMIT ?", (test_id, limit))
+        session_ids = [(row[0],) for row in await cursor.fetchall()]
+        if session_ids:
+            await db.executemany("DELETE FROM user_answers WHERE session_id = ?", session_ids)
+            await db.executemany("DELETE FROM user_test_sessions WHERE id = ?", session_ids)
+            return len(session_ids)
+        cursor = await db.execute("DELETE FROM result_outbox WHERE id IN (SELECT id FROM result_outbox WHERE test_code = ? LIMIT ?)", (test_code, limit))
+        return cursor.rowcount
+
+@cluster.writer
+async def delete_archived_test(test_id: int, test_code: int):
+    """Bo'laklar o'chirilgandan keyin testning o'zi va uning statistikasi."""
+    async with pool.write() as db:
+        for table in ("test_stats", "question_stats", "option_stats"):
+            await db.execute(f"DELETE FROM {table} WHERE test_id = ?", (test_id,))
+        await db.execute("DELETE FROM result_jobs WHERE test_code = ?", (test_code,))
+        await db.execute("DELETE FROM tests WHERE id = ?", (test_id,))
+    _invalidate_test_cache(test_code)
+
+# Tashqi kalitlar (PRAGMA foreign_keys) o'chiq, shuning uchun ota qatori yo'q qatorlar
+# o'z-o'zidan o'chmaydi: jadval -> ota qatori yo'qligi sharti. Tartib muhim: sessiyalar javoblardan oldin.
+ORPHAN_RULES = {
+    "user_test_sessions": "NOT EXISTS (SELECT 1 FROM tests t WHERE t.id = user_test_sessions.test_id)",
+    "user_answers": "NOT EXISTS (SELECT 1 FROM user_test_sessions s WHERE s.id = user_answers.session_id)",
+    "result_outbox": "NOT EXISTS (SELECT 1 FROM tests t WHERE t.test_code = result_outbox.test_code)",
+    "result_jobs": "NOT EXISTS (SELECT 1 FROM tests t WHERE t.test_code = result_jobs.test_code)",
+    "test_stats": "NOT EXISTS (SELECT 1 FROM tests t WHERE t.id = test_stats.test_id)",
+}
+# WITHOUT ROWID jadvallar (kichik, test bo'yicha) bitta so'rov bilan tozalanadi
+ORPHAN_STATS_TABLES = ("question_stats", "option_stats")
+
+async def get_max_rowid(table: str) -> int:
+    async with pool.read() as db: cursor = await db.execute(f"SELECT MAX(rowid) FROM {table}"); result = await cursor.fetchone(); return result[0] or 0
+
+@cluster.writer
+async def delete_orphans_in_range(table: str, low: int, high: int) -> int:
+    """`table` ning rowid oralig'idagi ota qatori yo'q qatorlarini o'chiradi."""
+    async with pool.write() as db:
+        cursor = await db.execute(f"DELETE FROM {table} WHERE rowid > ? AND rowid <= ? AND {ORPHAN_RULES[table]}", (low, high))
+        return cursor.rowcount
+
+@cluster.writer
+async def delete_orphan_stats() -> int:
+    deleted = 0
+    async with pool.write() as db:
+        for table in ORPHAN_STATS_TABLES:
+            cursor = await db.execute(f"DELETE FROM {table} WHERE test_id NOT IN (SELECT id FROM tests)")
+            deleted += cursor.rowcount
+    return deleted
+
+async def get_storage_stats() -> dict:
+    """Baza fayli holati: sahifa hajmi, sahifalar soni, bo'sh sahifalar va auto_vacuum rejimi."""
+    async with pool.read() as db:
+        stats = {}
+        for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+            cursor = await db.execute(f"PRAGMA {pragma}")
+            stats[pragma] = (await cursor.fetchone())[0]
+    return stats
+
+@cluster.writer
+async def incremental_vacuum(pages: int):
+    """Bo'sh sahifalarning bir qismini fayl oxiridan qirqadi (auto_vacuum = INCREMENTAL bo'lsa)."""
+    async with pool.write() as db:
+        cursor = await db.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+        await cursor.fetchall()
+
+@cluster.writer
+async def enable_incremental_vacuum():
+    """Eski bazani INCREMENTAL rejimiga o'tkazish: bir martalik to'liq VACUUM (butun bazani qayta yozadi)."""
+    async with pool.write() as db:
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+
+@cluster.writer
+async def checkpoint_wal():
+    """WAL'dagi o'zgarishlarni asosiy faylga ko'chirib, WAL faylini qisqartiradi."""
+    async with pool.write() as db:
+        cursor = await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        await cursor.fetchall()
+
+# --- Ommaviy xabar yuborish vazifalari ---
+
+async def get_active_user_ids_after(after_user_id: int, limit: int):
+    """Faol foydalanuvchilar ID'larini `user_id` bo'yicha sahifalab qaytaradi (kursor uchun)."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT user_id FROM users WHERE status = 'active' AND user_id > ? ORDER BY user_id LIMIT ?", (after_user_id, limit))
+        return [row[0] for row in await cursor.fetchall()]
+
+@cluster.writer
+async def mark_users_inactive(user_ids):
+    if not user_ids:
+        return
+    async with pool.write() as db:
+        await db.executemany("UPDATE users SET status = 'inactive' WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+    # Keyingi /start holatni yana 'active' qilishi uchun keshdan chiqariladi
+    _forget_recent_users(list(user_ids))
+
+@cluster.writer
+async def create_broadcast_job(admin_chat_id, from_chat_id, message_id, status_message_id, total) -> int:
+    async with pool.write() as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcast_jobs (admin_chat_id, from_chat_id, message_id, status_message_id, total, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (admin_chat_id, from_chat_id, message_id, status_message_id, total, int(time.time()))
+        )
+        return cursor.lastrowid
+
+_BROADCAST_JOB_COLUMNS = "id, admin_chat_id, from_chat_id, message_id, status_message_id, cursor, total, sent, failed, blocked"
+
+async def get_broadcast_job(job_id):
+    async with pool.read() as db:
+        cursor = await db.execute(f"SELECT {_BROADCAST_JOB_COLUMNS} FROM broadcast_jobs WHERE id = ?", (job_id,))
+        return await cursor.fetchone()
+
+async def get_unfinished_broadcast_jobs():
+    async with pool.read() as db:
+        cursor = await db.execute(f"SELECT {_BROADCAST_JOB_COLUMNS} FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+        return await cursor.fetchall()
+
+@cluster.writer
+async def save_broadcast_progress(job_id, cursor_user_id, sent, failed, blocked):
+    async with pool.write() as db:
+        await db.execute("UPDATE broadcast_jobs SET cursor = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?", (cursor_user_id, sent, failed, blocked, job_id))
+
+@cluster.writer
+async def finish_broadcast_job(job_id):
+    async with pool.write() as db:
+        await db.execute("UPDATE broadcast_jobs SET status = 'done', finished_at = ? WHERE id = ?", (int(time.time()), job_id))
+
+# --- Test natijalarini yetkazib berish (outbox) ---
+
+@cluster.writer
+async def close_test_with_outbox(test_code: int, status_chat_id=None, status_message_id=None):
+    """
+    Testni yopadi va barcha ishtirokchilar natijalarini bitta tranzaksiyada
+    `result_outbox` ga yozadi. Test allaqachon yopilgan bo'lsa None qaytaradi,
+    aks holda (test_id, owner_user_id, answer_key, ishtirokchilar soni) ni.
+    """
+    async with pool.write() as db:
+        cursor = await db.execute("UPDATE tests SET status = 'closed' WHERE test_code = ? AND status = 'active'", (test_code,))
+        if cursor.rowcount == 0:
+            return None
+        cursor = await db.execute("SELECT id, owner_user_id, answer_key FROM tests WHERE test_code = ?", (test_code,))
+        test_id, owner_user_id, answer_key = await cursor.fetchone()
+        cursor = await db.execute(_TEST_RESULTS_QUERY, (test_id,))
+        results = await cursor.fetchall()
+        await db.execute(
+            "INSERT OR REPLACE INTO result_jobs (test_code, owner_user_id, total_questions, status_chat_id, status_message_id, total, status, created_at) VALUES (?, ?, ?, ?, ?, ?, 'running', ?)",
+            (test_code, owner_user_id, len(answer_key), status_chat_id, status_message_id, len(results), int(time.time()))
+        )
+        await db.executemany(
+            "INSERT OR IGNORE INTO result_outbox (test_code, user_id, place, full_name, score) VALUES (?, ?, ?, ?, ?)",
+            [(test_code, user_id, place, full_name, score) for place, (user_id, full_name, score, _, _) in enumerate(results, 1)]
+        )
+    _mark_test_closed_in_cache(test_code)
+    return test_id, owner_user_id, answer_key, len(results)
+
+async def get_due_tests(now: int, limit: int = 500):
+    """Tugash vaqti kelgan aktiv testlar: (test_code, owner_user_id), eng avval tugaganlari birinchi."""
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT test_code, owner_user_id FROM tests WHERE status = 'active' AND ends_at IS NOT NULL AND ends_at <= ? ORDER BY ends_at LIMIT ?", (now, limit))
+        return await cursor.fetchall()
+
+async def get_pending_result_deliveries(limit: int):
+    async with pool.read() as db:
+        cursor = await db.execute(
+            "SELECT o.id, o.test_code, o.user_id, o.place, o.full_name, o.score, o.attempts, j.total_questions FROM result_outbox o JOIN result_jobs j ON j.test_code = o.test_code WHERE o.status = 'pending' AND o.next_attempt_at <= ? ORDER BY o.id LIMIT ?",
+            (int(time.time()), limit)
+        )
+        return await cursor.fetchall()
+
+@cluster.writer
+async def update_result_deliveries(updates):
+    """`updates` - (status, attempts, next_attempt_at, outbox_id) ro'yxati."""
+    async with pool.write() as db:
+        await db.executemany("UPDATE result_outbox SET status = ?, attempts = ?, next_attempt_at = ? WHERE id = ?", updates)
+
+async def get_result_job(test_code: int):
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT test_code, owner_user_id, status_chat_id, status_message_id, total, report_sent, status FROM result_jobs WHERE test_code = ?", (test_code,))
+        return await cursor.fetchone()
+
+async def get_running_result_jobs():
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT test_code, report_sent FROM result_jobs WHERE status = 'running'")
+        return await cursor.fetchall()
+
+@cluster.writer
+async def set_result_job_status_message(test_code: int, status_chat_id: int, status_message_id: int):
+    async with pool.write() as db:
+        await db.execute("UPDATE result_jobs SET status_chat_id = ?, status_message_id = ? WHERE test_code = ?", (status_chat_id, status_message_id, test_code))
+
+@cluster.writer
+async def mark_result_report_sent(test_code: int, state: int = 1):
+    """`report_sent`: 0 - hisobot hali tayyorlanmoqda, 1 - yuborildi, 2 - yuborilmadi (xato yoki ishtirokchi yo'q)."""
+    async with pool.write() as db:
+        await db.execute("UPDATE result_jobs SET report_sent = ? WHERE test_code = ?", (state, test_code))
+
+async def get_result_delivery_counts(test_code: int) -> dict:
+    async with pool.read() as db:
+        cursor = await db.execute("SELECT status, COUNT(*) FROM result_outbox WHERE test_code = ? GROUP BY status", (test_code,))
+        return dict(await cursor.fetchall())
+
+@cluster.writer
+async def finish_result_job(test_code: int) -> bool:
+    """Vazifani yakunlaydi (hisobot bosqichi tugagan bo'lsa). Faqat uni haqiqatan yakunlagan chaqiruv True oladi."""
+    async with pool.write() as db:
+        cursor = await db.execute(
+            "UPDATE result_jobs SET status = 'done', finished_at = ? WHERE test_code = ? AND status = 'running' AND report_sent != 0",
+            (int(time.time()), test_code)
+        )
+        return cursor.rowcount > 0
+
+# --- Telegram'ga yuklangan fayllar keshi ---
+
+async def get_media_file_id(cache_key: str):
+    async with pool.read() as db: cursor = await db.execute("SELECT file_id FROM media_files WHERE cache_key = ?", (cache_key,)); result = await cursor.fetchone(); return result[0] if result else None
+
+@cluster.writer
+async def save_media_file_id(cache_key: str, file_id: str):
+    async with pool.write() as db: await db.execute("INSERT OR REPLACE INTO media_files (cache_key, file_id, updated_at) VALUES (?, ?, ?)", (cache_key, file_id, int(time.time())))
+
+@cluster.writer
+async def delete_media_file_id(cache_key: str):
+    async with pool.write() as db: await db.execute("DELETE FROM media_files WHERE cache_key = ?", (cache_key,))
+
+# --- FSM holatlari (services/fsm_storage.py) ---
+
+async def get_fsm_record(key: str, min_updated_at: int):
+    """(state, data_json) yoki None. Muddati o'tgan (min_updated_at dan eski) yozuvlar hisobga olinmaydi."""
+    async with pool.read() as db: cursor = await db.execute("SELECT state, data FROM fsm_states WHERE storage_key = ? AND updated_at >= ?", (key, min_updated_at)); return await cursor.fetchone()
+
+@cluster.writer
+async def save_fsm_records(records):
+    """
+    `records` - (storage_key, state, data_json, updated_at) ro'yxati; bitta tranzaksiyada yoziladi.
+    Holati ham, ma'lumoti ham bo'sh bo'lgan kalitlar o'chiriladi.
+    """
+    async with pool.write() as db:
+        for key, state, data, updated_at in records:
+            if state is None and data is None:
+                await db.execute("DELETE FROM fsm_states WHERE storage_key = ?", (key,))
+            else:
+                await db.execute("INSERT INTO fsm_states (storage_key, state, data, updated_at) VALUES (?, ?, ?, ?) ON CONFLICT(storage_key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at", (key, state, data, updated_at))
+
+@cluster.writer
+async def delete_expired_fsm_records(before: int, limit: int = 5000) -> int:
+    async with pool.write() as db:
+        cursor = await db.execute("DELETE FROM fsm_states WHERE rowid IN (SELECT rowid FROM fsm_states WHERE updated_at < ? LIMIT ?)", (before, limit))
+        return cursor.rowcount
@@ -5,12 +5,11 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramBadRequest
-import asyncio
 import logging
 
 import database as db
 from config import SUPER_ADMINS
+from services import broadcast
 from keyboards import (
     admin_panel_keyboard, main_menu_keyboard, confirm_broadcast_keyboard,
     BTN_ADMIN_PANEL, BTN_BACK, BTN_ADD_CHANNEL, BTN_DEL_CHANNEL,
@@ -148,12 +147,12 @@ async def channels_list_handler(message: Message, bot: Bot):
 # --- KONKURS BOSHQARUVI ---
 @router.message(F.text == BTN_START_CONTEST)
 async def start_contest_handler(message: Message):
-    await db.clear_all_referral_counts()
-    await message.answer("✅ Yangi referral konkursi boshlandi! Barcha foydalanuvchilarning ballari 0 ga tushirildi.")
+    await db.start_new_contest()
+    await message.answer("✅ Yangi referral konkursi boshlandi! Barcha foydalanuvchilarning ballari 0 dan boshlanadi.")
 
 @router.message(F.text == BTN_CLEAR_CONTEST)
 async def clear_contest_handler(message: Message):
-    await db.clear_all_referral_counts()
+    await db.clear_current_contest()
     await message.answer("✅ Konkurs statistikasi tozalandi.")
 
 # --- OMMOBIY XABAR YUBORISH (PROGRESS BAR BILAN) ---
@@ -198,39 +197,12 @@ async def send_broadcast_confirmed(callback: CallbackQuery, state: FSMContext, b
         await callback.message.answer("Xatolik: Yuboriladigan xabar topilmadi. Qaytadan urinib ko'ring.", reply_markup=admin_panel_keyboard())
         return
 
-    user_ids = await db.get_all_user_ids()
-    total_users = len(user_ids)
-    sent_count = 0
-    failed_count = 0
-    last_update_text = ""
-
-    for i, user_id in enumerate(user_ids, 1):
-        try:
-            await bot.copy_message(chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id_to_send)
-            sent_count += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            failed_count += 1
-            logging.error(f"Failed to send message to {user_id}: {e}")
-
-        if i % 25 == 0 or i == total_users:
-            percentage = (i / total_users) * 100
-            progress_text = f"⏳ Yuborilmoqda: {percentage:.1f}% ({i}/{total_users})"
-
-            if progress_text != last_update_text:
-                try:
-                    await status_message.edit_text(progress_text)
-                    last_update_text = progress_text
-                except TelegramBadRequest:
-                    pass
-
-    await status_message.delete()
-    await callback.message.answer(
-        f"✅ Xabar yuborish yakunlandi!\n\n"
-        f"🟢 Yuborildi: {sent_count} ta foydalanuvchiga\n"
-        f"🔴 Xatolik: {failed_count} ta foydalanuvchiga",
-        reply_markup=admin_panel_keyboard()
-    )
+    # Yuborish fon vazifasida bajariladi; holati bazada saqlanadi va
+    # jarayon qayta ishga tushsa ham to'xtagan joyidan davom etadi
+    total_users = await db.get_active_users_count()
+    job_id = await db.create_broadcast_job(callback.message.chat.id, from_chat_id, message_id_to_send, status_message.message_id, total_users)
+    job = await db.get_broadcast_job(job_id)
+    broadcast.start_broadcast_job(bot, job)
 
 @router.callback_query(F.data == "confirm_broadcast_cancel", BroadcastState.confirming)
 async def cancel_broadcast_confirmed(callback: CallbackQuery, state: FSMContext):
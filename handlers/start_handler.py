@@ -1,61 +1,30 @@
 # handlers/start_handler.py
 
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, BufferedInputFile, FSInputFile
+from aiogram.types import Message, CallbackQuery
 from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
 import logging
-import asyncio
-import io
-from datetime import timedelta
-import openpyxl
-from openpyxl.styles import Font, Alignment
+import re
 
 import database as db
 from keyboards import (
     main_menu_keyboard, share_keyboard, my_tests_keyboard,
     test_management_keyboard, confirm_close_test_keyboard,
-    show_error_details_keyboard, subscribe_keyboard
+    subscribe_keyboard, cancel_edit_key_keyboard,
+    question_stats_keyboard, question_details_keyboard, standings_keyboard
 )
-from config import SUPER_ADMINS
+from config import SUPER_ADMINS, LEADERBOARD_TOP_N
+from services.subscription import check_subscription
+from services import results, scoring, leaderboard
+from services.regrade import start_regrade
 
 router = Router()
 
-async def generate_excel_report(test_code: int, results: list, total_questions: int) -> bytes:
-    workbook = openpyxl.Workbook()
-    sheet = workbook.active
-    sheet.title = f"Test #{test_code} Natijalari"
-    headers = ["№", "F.I.O", "Telegram ID", "To'g'ri javoblar", "Natija (%)", "Sarflangan vaqt (MM:SS)"]
-    sheet.append(headers)
-    for cell in sheet[1]:
-        cell.font = Font(bold=True)
-        cell.alignment = Alignment(horizontal='center')
-    for i, row in enumerate(results, 1):
-        user_id, full_name, score, start_time, submitted_at = row
-        percentage = f"{(score / total_questions) * 100:.1f}%" if total_questions > 0 else "0.0%"
-        time_taken_seconds = submitted_at - start_time
-        time_taken_formatted = str(timedelta(seconds=time_taken_seconds)).split('.')[0][2:]
-        sheet.append([i, full_name, user_id, f"{score}/{total_questions}", percentage, time_taken_formatted])
-    for column_cells in sheet.columns:
-        length = max(len(str(cell.value)) for cell in column_cells)
-        sheet.column_dimensions[column_cells[0].column_letter].width = length + 2
-    file_stream = io.BytesIO()
-    workbook.save(file_stream)
-    file_stream.seek(0)
-    return file_stream.getvalue()
-
-async def check_subscription(user_id: int, bot: Bot):
-    channels = await db.get_channels()
-    if not channels: return True
-    for channel_id, username, invite_link in channels:
-        try:
-            member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-            if member.status.lower() not in ['member', 'administrator', 'creator']: return False
-        except Exception as e:
-            logging.error(f"Subscription check error for user {user_id} in channel {channel_id}: {e}")
-            return False
-    return True
+class AnswerKeyEditStates(StatesGroup):
+    waiting_for_new_key = State()
 
 async def give_referral_bonus(user_id: int, bot: Bot):
     referrer_id = await db.get_referred_by(user_id)
@@ -88,7 +57,8 @@ async def cmd_start(message: Message, bot: Bot, state: FSMContext):
 @router.callback_query(F.data == "check_subscription")
 async def callback_check_subscription(callback: CallbackQuery, bot: Bot):
     await callback.answer(text="Tekshirilmoqda...", show_alert=False)
-    if await check_subscription(callback.from_user.id, bot):
+    # Foydalanuvchi hozirgina a'zo bo'lgan bo'lishi mumkin, shuning uchun kesh chetlab o'tiladi
+    if await check_subscription(callback.from_user.id, bot, use_cache=False):
         referrer_id = await db.get_referred_by(callback.from_user.id)
         if referrer_id: await give_referral_bonus(callback.from_user.id, bot)
         await callback.message.delete()
@@ -169,82 +139,184 @@ async def confirm_close_handler(callback: CallbackQuery):
     except (ValueError, IndexError):
         await callback.answer("Xatolik: Test kodi topilmadi.", show_alert=True)
 
-async def send_results_and_close_test(callback: CallbackQuery, bot: Bot, test_code: int):
-    results, owner_id, answer_key = await db.get_test_results(test_code)
-    if results is None:
+@router.callback_query(F.data.startswith("close_test_"))
+async def close_test_handler(callback: CallbackQuery, bot: Bot):
+    try:
+        test_code = int(callback.data.split("_")[2])
+    except (ValueError, IndexError):
+        await callback.answer("Xatolik: Test kodi topilmadi.", show_alert=True)
+        return
+
+    test_data = await db.get_test_by_code(test_code)
+    if not test_data:
         await callback.answer(f"❌ Test #{test_code} topilmadi.", show_alert=True)
-        return 0, False
+        return
+    owner_id = test_data[4]
     if callback.from_user.id != owner_id and callback.from_user.id not in SUPER_ADMINS:
         await callback.answer("❌ Siz bu testni yakunlay olmaysiz.", show_alert=True)
-        return 0, False
-    total_questions = len(answer_key)
-    sent_count = 0
-    top_winners = results[:3]
-    other_participants = results[3:]
-
-    # 1. G'oliblarga sertifikat va natijalarni yuborish
-    for i, winner_data in enumerate(top_winners):
-        place = i + 1
-        user_id, full_name, score, _, _ = winner_data
-        percentage = (score / total_questions) * 100 if total_questions > 0 else 0
-        if place == 1:
-            photo_path = "1-o'rin.png"
-            caption_title = "🏆 TABRIKLAYMIZ, SIZ MUTLAQ G'OLIBSIZ! 🏆"
-        elif place == 2:
-            photo_path = "2-o'rin.png"
-            caption_title = "🥈 TABRIKLAYMIZ, SIZ 2-O'RIN SOVRINDORISIZ! 🥈"
-        else:
-            photo_path = "3-o'rin.png"
-            caption_title = "🥉 TABRIKLAYMIZ, SIZ 3-O'RIN SOVRINDORISIZ! 🥉"
-        try:
-            certificate_photo = FSInputFile(photo_path)
-            caption_text = (f"<b>{caption_title}</b>\n\n"
-                            f"Siz <b>Test #{test_code}</b> da faxrli <b>{place}-o'rinni</b> egalladingiz!\n\n"
-                            f"Natijangiz: <b>{score}/{total_questions}</b> ({percentage:.1f}%)")
-            await bot.send_photo(chat_id=user_id, photo=certificate_photo, caption=caption_text, reply_markup=show_error_details_keyboard(test_code))
-            sent_count += 1
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            logging.error(f"{place}-o'rin g'olibiga ({user_id}) sertifikat yuborishda xato: {e}")
+        return
 
-    # 2. Qolgan ishtirokchilarga oddiy natija yuborish
-    for participant_data in other_participants:
-        user_id, full_name, score, _, _ = participant_data
-        percentage = (score / total_questions) * 100 if total_questions > 0 else 0
-        result_text = (f"<b>Test #{test_code} Natijasi</b>\n\nIshtirokchi: <b>{full_name}</b>\nTo'g'ri javoblar soni: <b>{score} / {total_questions}</b>\nO'zlashtirish: <b>{percentage:.1f}%</b>")
-        try:
-            await bot.send_message(user_id, result_text, reply_markup=show_error_details_keyboard(test_code))
-            sent_count += 1
-            await asyncio.sleep(0.05)
-        except Exception: pass
-
-    # 3. Test egasiga Excel hisobotini yuborish
-    excel_sent = False
-    if results:
-        try:
-            excel_bytes = await generate_excel_report(test_code, results, total_questions)
-            report_file = BufferedInputFile(excel_bytes, filename=f"test_{test_code}_natijalar.xlsx")
-            await bot.send_document(chat_id=owner_id, document=report_file, caption=f"✅ <b>Test #{test_code}</b> uchun yakuniy hisobot.")
-            excel_sent = True
-        except Exception as e:
-            logging.error(f"Excel hisobotini yuborishda xato: {e}")
-            await bot.send_message(owner_id, f"❗️ Test #{test_code} uchun Excel-hisobotni yaratishda xatolik yuz berdi.")
-    await db.close_test(test_code)
-    return sent_count, excel_sent
+    await callback.message.edit_text(f"⏳ Test #{test_code} yakunlanmoqda... Natijalar yuborilmoqda.")
+    # Natijalar fon rejimida yuboriladi, holat xabari esa jarayon davomida yangilanadi
+    if not await results.close_test_and_notify(bot, test_code, callback.message.chat.id, callback.message.message_id):
+        await callback.answer(f"Test #{test_code} allaqachon yakunlangan.", show_alert=True)
+        return
+    await callback.answer("Test yakunlandi! Natijalar ishtirokchilarga yuborilmoqda.", show_alert=True)
 
-@router.callback_query(F.data.startswith("close_test_"))
-async def close_test_handler(callback: CallbackQuery, bot: Bot):
+
+@router.callback_query(F.data.startswith("edit_key_"))
+async def edit_answer_key_handler(callback: CallbackQuery, state: FSMContext):
     try:
         test_code = int(callback.data.split("_")[2])
-        await callback.message.edit_text(f"⏳ Test #{test_code} yakunlanmoqda... Natijalar yuborilmoqda.")
-        sent_count, excel_sent = await send_results_and_close_test(callback, bot, test_code)
-        final_text = f"✅ Test #{test_code} muvaffaqiyatli yakunlandi.\n\nNatijalar {sent_count} ta ishtirokchiga yuborildi."
-        if excel_sent: final_text += "\n\n📊 Batafsil hisobot (Excel) sizga shaxsiy xabar qilib yuborildi."
-        await callback.message.edit_text(final_text)
-        await callback.answer("Test yakunlandi!", show_alert=True)
     except (ValueError, IndexError):
         await callback.answer("Xatolik: Test kodi topilmadi.", show_alert=True)
+        return
+
+    test_data = await db.get_test_by_code(test_code)
+    if not test_data or (callback.from_user.id != test_data[4] and callback.from_user.id not in SUPER_ADMINS):
+        await callback.answer("❌ Siz bu testning kalitini o'zgartira olmaysiz.", show_alert=True)
+        return
+    if test_data[6] == 'closed':
+        await callback.answer("❌ Test yakunlangan, kalitni o'zgartirib bo'lmaydi.", show_alert=True)
+        return
+
+    answer_key = test_data[5]
+    await state.set_state(AnswerKeyEditStates.waiting_for_new_key)
+    await state.update_data(test_code=test_code)
+    await callback.message.edit_text(
+        f"<b>Test #{test_code}</b> uchun joriy kalit:\n<code>{answer_key}</code>\n\n"
+        f"To'g'rilangan kalitni yuboring (<b>{len(answer_key)} ta</b> javob). "
+        "Barcha topshirilgan javoblar yangi kalit bo'yicha qayta baholanadi.",
+        reply_markup=cancel_edit_key_keyboard(test_code)
+    )
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("cancel_edit_key_"))
+async def cancel_edit_answer_key(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await view_test_details(callback)
+
+@router.message(AnswerKeyEditStates.waiting_for_new_key, F.text)
+async def process_new_answer_key(message: Message, state: FSMContext):
+    data = await state.get_data()
+    test_code = data.get('test_code')
+    test_data = await db.get_test_by_code(test_code) if test_code else None
+    if not test_data or test_data[6] == 'closed':
+        await state.clear()
+        await message.answer("❌ Test topilmadi yoki yakunlangan.")
+        return
 
+    new_key = re.sub(r'[^a-zA-Z]', '', message.text).lower()
+    old_key = test_data[5]
+    if len(new_key) != len(old_key):
+        await message.answer(f"❌ Kalitda <b>{len(old_key)} ta</b> javob bo'lishi kerak, siz <b>{len(new_key)} ta</b> yubordingiz. Qayta yuboring.")
+        return
+    await state.clear()
+    if new_key == old_key:
+        await message.answer("Kalit o'zgarmadi.")
+        return
+
+    if not await db.update_answer_key(test_code, new_key):
+        await message.answer("❌ Kalitni saqlab bo'lmadi: test yakunlangan bo'lishi mumkin.")
+        return
+    status = await message.answer(f"⏳ Test #{test_code} kaliti yangilandi. Javoblar qayta baholanmoqda...")
+    # Qayta baholash fonda ishlaydi va shu xabarni yangilab boradi
+    start_regrade(message.bot, test_code, test_data[0], status.chat.id, status.message_id)
+
+
+async def _get_owned_test(callback: CallbackQuery, test_code: int):
+    test_data = await db.get_test_by_code(test_code)
+    if not test_data or (callback.from_user.id != test_data[4] and callback.from_user.id not in SUPER_ADMINS):
+        await callback.answer("❌ Bu test statistikasini ko'ra olmaysiz.", show_alert=True)
+        return None
+    return test_data
+
+@router.callback_query(F.data.startswith("stats_"))
+async def test_stats_handler(callback: CallbackQuery):
+    try:
+        _, test_code, page = callback.data.split("_")
+        test_code, page = int(test_code), int(page)
+    except ValueError:
+        await callback.answer("Xatolik: Test kodi topilmadi.", show_alert=True)
+        return
+    test_data = await _get_owned_test(callback, test_code)
+    if not test_data:
+        return
+
+    total_questions = len(test_data[5])
+    participants, score_sum, score_sq_sum = await db.get_test_stats(test_data[0]) or (0, 0, 0)
+    text = f"📈 <b>Test #{test_code} statistikasi</b>\n\nIshtirokchilar: <b>{participants} ta</b>\n"
+    if participants:
+        mean = score_sum / participants
+        text += f"O'rtacha ball: <b>{mean:.1f}/{total_questions}</b>\n"
+    text += "\nSavol bo'yicha tahlil uchun raqamini tanlang:"
+    await callback.message.edit_text(text, reply_markup=question_stats_keyboard(test_code, total_questions, page))
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("qstat_"))
+async def question_stats_handler(callback: CallbackQuery):
+    try:
+        _, test_code, question = callback.data.split("_")
+        test_code, question = int(test_code), int(question)
+    except ValueError:
+        await callback.answer("Xatolik: Savol topilmadi.", show_alert=True)
+        return
+    test_data = await _get_owned_test(callback, test_code)
+    if not test_data:
+        return
+    answer_key = test_data[5]
+    if not 0 <= question < len(answer_key):
+        await callback.answer("Xatolik: Savol topilmadi.", show_alert=True)
+        return
+
+    # Barcha qiymatlar oldindan yig'ilgan: ishtirokchilar soniga bog'liq emas
+    participants, score_sum, score_sq_sum = await db.get_test_stats(test_data[0]) or (0, 0, 0)
+    correct, correct_score_sum, options = await db.get_question_stats(test_data[0], question)
+    difficulty, discrimination = scoring.item_statistics(participants, score_sum, score_sq_sum, correct, correct_score_sum)
+
+    text = (f"📈 <b>Test #{test_code}, {question + 1}-savol</b>\n\n"
+            f"To'g'ri javob: <b>{answer_key[question].upper()}</b>\n")
+    if not participants:
+        text += "\nHozircha javoblar yo'q."
+    else:
+        text += f"Qiyinlik (to'g'ri javoblar ulushi): <b>{difficulty * 100:.1f}%</b> ({correct}/{participants})\n"
+        text += ("Ajrata olish (nuqtali-biserial): <b>" + (f"{discrimination:.2f}" if discrimination is not None else "—") + "</b>\n")
+        text += "\n<b>Javoblar taqsimoti:</b>\n"
+        for option, count in options:
+            mark = " ✅" if option == answer_key[question] else ""
+            text += f"{option.upper()}{mark} — {count} ta ({count / participants * 100:.1f}%)\n"
+    await callback.message.edit_text(text, reply_markup=question_details_keyboard(test_code, question))
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("standings_"))
+async def test_standings_handler(callback: CallbackQuery):
+    try:
+        test_code = int(callback.data.split("_")[1])
+    except (ValueError, IndexError):
+        await callback.answer("Xatolik: Test kodi topilmadi.", show_alert=True)
+        return
+    test_data = await _get_owned_test(callback, test_code)
+    if not test_data:
+        return
+
+    # Reyting xotirada: har bir yangi javob bilan yangilanadi, bazaga so'rov yuborilmaydi
+    board = await leaderboard.get_board(test_data[0])
+    total_questions = len(test_data[5])
+    text = f"🏅 <b>Test #{test_code} - joriy reyting</b>\n\nIshtirokchilar: <b>{len(board)} ta</b>\n\n"
+    emojis = ["🥇", "🥈", "🥉"]
+    for i, (user_id, full_name, score, duration) in enumerate(board.top(LEADERBOARD_TOP_N)):
+        place = emojis[i] if i < len(emojis) else f"{i + 1}."
+        minutes, seconds = divmod(max(duration, 0), 60)
+        text += f"{place} {full_name or user_id} - <b>{score}/{total_questions}</b> ({minutes:02d}:{seconds:02d})\n"
+    if not len(board):
+        text += "Hozircha javoblar yo'q."
+    try:
+        await callback.message.edit_text(text, reply_markup=standings_keyboard(test_code))
+    except TelegramBadRequest:
+        # Reyting o'zgarmagan bo'lsa Telegram "message is not modified" qaytaradi
+        pass
+    await callback.answer()
 
 # --- YAKUNIY O'ZGARISH: BU FUNKSIYA BU YERGA KO'CHIRILDI VA TUZATILDI ---
 @router.callback_query(F.data.startswith("show_errors_"))
@@ -264,15 +336,14 @@ async def show_error_details(callback: CallbackQuery):
 
     correct_key, user_answers = details
     analysis_text = f"<b>Test #{test_code} uchun tahlil:</b>\n\n"
-    total_score = 0
+    total_score, bitmap = scoring.score_submission(correct_key, user_answers)
 
-    for i in range(len(correct_key)):
+    for i, is_correct in enumerate(scoring.unpack_bitmap(bitmap, len(correct_key))):
         user_ans = user_answers[i].upper() if i < len(user_answers) else '?'
         corr_ans = correct_key[i].upper()
 
-        if user_ans == corr_ans:
+        if is_correct:
             analysis_text += f"✅ {i+1}-savol: {user_ans} (To'g'ri)\n"
-            total_score += 1
         else:
             analysis_text += f"❌ {i+1}-savol: Sizning javob {user_ans} (To'g'ri: {corr_ans})\n"
 
@@ -5,10 +5,14 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 import re
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 import database as db
 # --- XATO TUZATILDI: `main_menu_keyboard` import qilindi ---
-from keyboards import test_duration_keyboard, main_menu_keyboard
+from keyboards import test_duration_keyboard, test_end_time_keyboard, main_menu_keyboard
+from config import TIMEZONE
 
 router = Router()
 
@@ -16,6 +20,7 @@ class TestCreationStates(StatesGroup):
     waiting_for_file = State()
     waiting_for_answers = State()
     waiting_for_duration = State()
+    waiting_for_end_time = State()
 
 @router.message(F.text == "✍️ Yangi Test Yaratish")
 async def start_test_creation(message: Message, state: FSMContext):
@@ -74,27 +79,74 @@ async def process_answers(message: Message, state: FSMContext):
 @router.callback_query(TestCreationStates.waiting_for_duration, F.data.startswith('duration_'))
 async def process_duration(callback: CallbackQuery, state: FSMContext):
     duration = int(callback.data.split('_')[1])
+    await state.update_data(duration=duration)
+    await callback.message.edit_text(
+        "<b>4-qadam:</b> Test qachon avtomatik yakunlansin? Shu vaqtda test yopiladi va natijalar e'lon qilinadi.\n\n"
+        "Quyidagilardan birini tanlang yoki vaqtni o'zingiz yozing: <code>18:30</code> yoki <code>25.12.2025 18:30</code>",
+        reply_markup=test_end_time_keyboard()
+    )
+    await state.set_state(TestCreationStates.waiting_for_end_time)
+    await callback.answer()
+
+def parse_end_time(text: str, now: datetime):
+    """'HH:MM' (bugun, o'tib ketgan bo'lsa ertaga) yoki 'DD.MM.YYYY HH:MM'. Noto'g'ri bo'lsa None."""
+    text = text.strip()
+    try:
+        if re.fullmatch(r'\d{1,2}:\d{2}', text):
+            parsed = datetime.strptime(text, "%H:%M").time()
+            ends = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+            return ends if ends > now else ends + timedelta(days=1)
+        return datetime.strptime(text, "%d.%m.%Y %H:%M").replace(tzinfo=now.tzinfo)
+    except ValueError:
+        return None
+
+@router.callback_query(TestCreationStates.waiting_for_end_time, F.data.startswith('ends_in_'))
+async def process_end_time_choice(callback: CallbackQuery, state: FSMContext):
+    minutes = int(callback.data.split('_')[2])
+    ends_at = int(time.time()) + minutes * 60 if minutes > 0 else None
+    await callback.message.delete()
+    await finish_test_creation(callback.message, callback.from_user.id, state, ends_at)
+    await callback.answer()
+
+@router.message(TestCreationStates.waiting_for_end_time, F.text)
+async def process_end_time_text(message: Message, state: FSMContext):
+    ends = parse_end_time(message.text, datetime.now(ZoneInfo(TIMEZONE)))
+    if ends is None or ends.timestamp() <= time.time():
+        await message.answer(
+            "❌ Vaqt noto'g'ri yoki o'tib ketgan. Iltimos, <code>18:30</code> yoki "
+            "<code>25.12.2025 18:30</code> formatida kelajakdagi vaqtni yuboring."
+        )
+        return
+    await finish_test_creation(message, message.from_user.id, state, int(ends.timestamp()))
+
+async def finish_test_creation(message: Message, owner_user_id: int, state: FSMContext, ends_at):
     data = await state.get_data()
+    duration = data.get('duration', 0)
 
     test_code = await db.create_test(
-        owner_user_id=callback.from_user.id,
+        owner_user_id=owner_user_id,
         question_file_id=data.get('file_id'),
         question_file_type=data.get('file_type'),
         answer_key=data.get('answers'),
-        duration_minutes=duration
+        duration_minutes=duration,
+        ends_at=ends_at
     )
 
-    await callback.message.delete()
     duration_text = f"{duration} daqiqa" if duration > 0 else "Cheklanmagan"
+    if ends_at:
+        end_text = datetime.fromtimestamp(ends_at, ZoneInfo(TIMEZONE)).strftime('%d.%m.%Y %H:%M')
+        closing_text = f"<b>🏁 Avtomatik yakunlanadi:</b> {end_text}\n\n"
+    else:
+        closing_text = "\n"
 
-    await callback.message.answer(
+    await message.answer(
         f"<b>✅ Test muvaffaqiyatli yaratildi!</b>\n\n"
         f"<b>🔑 Test kodi:</b> <code>{test_code}</code> (bu kodni nusxalab, o'quvchilarga tarqating)\n"
-        f"<b>⏳ Har bir o'quvchi uchun vaqt:</b> {duration_text}\n\n"
+        f"<b>⏳ Har bir o'quvchi uchun vaqt:</b> {duration_text}\n"
+        f"{closing_text}"
         f"Natijalarni ko'rish va testni yakunlash uchun "
         f"«📋 Mening Testlarim» bo'limidan foydalaning.",
         # --- BU YERDA XATO BOR EDI. TUZATILDI ---
-        reply_markup=main_menu_keyboard(callback.from_user.id)
+        reply_markup=main_menu_keyboard(owner_user_id)
     )
-    await callback.answer()
     await state.clear()
@@ -7,7 +7,8 @@ import time, datetime, re, asyncio
 import logging
 
 import database as db
-from keyboards import show_error_details_keyboard
+from keyboards import show_error_details_keyboard, my_rank_keyboard
+from services import answer_writer, scoring, leaderboard, deadlines
 
 router = Router()
 
@@ -47,11 +48,17 @@ async def process_test_code(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    if not await db.start_user_session(message.from_user.id, test_id):
+    session = await db.start_user_session(message.from_user.id, test_id, duration)
+    if not session:
         await message.answer("Siz bu testni allaqachon boshlagansiz! Iltimos, javoblaringizni yuboring.")
         await state.clear()
         return
 
+    session_id, deadline_at = session
+    if deadline_at:
+        # "Vaqt tugashiga oz qoldi" va "vaqt tugadi" xabarlari uchun
+        deadlines.schedule(message.bot, session_id, deadline_at)
+
     await state.clear()
     duration_text = f"Testni yechish uchun <b>{duration} daqiqa</b> vaqtingiz bor." if duration > 0 else "Vaqtingiz cheklanmagan."
     end_time_text = ""
@@ -122,12 +129,33 @@ async def process_test_answers(message: Message):
         )
          return
 
-    score = sum(1 for i in range(total_questions) if i < len(user_answers_clean) and user_answers_clean[i] == correct_answers_key[i])
+    score, _ = scoring.score_submission(correct_answers_key, user_answers_clean)
 
-    if not await db.save_user_answer(session_id, message.from_user.id, score, user_answers_clean):
+    if not await answer_writer.submit_answer(session_id, message.from_user.id, score, user_answers_clean):
         await message.answer("Siz bu testga allaqachon javob bergansiz.")
         return
 
-    await message.answer("✅ <b>Javobingiz qabul qilindi!</b>\n\nBarcha natijalar test yakunlangandan so'ng e'lon qilinadi.")
+    await message.answer(
+        "✅ <b>Javobingiz qabul qilindi!</b>\n\nBarcha natijalar test yakunlangandan so'ng e'lon qilinadi.",
+        reply_markup=my_rank_keyboard(test_code)
+    )
+
+@router.callback_query(F.data.startswith("my_rank_"))
+async def my_rank_handler(callback: CallbackQuery):
+    try:
+        test_code = int(callback.data.split("_")[2])
+    except (ValueError, IndexError):
+        await callback.answer("Xatolik: Test kodi topilmadi.", show_alert=True)
+        return
+    test_data = await db.get_test_by_code(test_code)
+    if not test_data:
+        await callback.answer("❌ Test topilmadi.", show_alert=True)
+        return
+    board = await leaderboard.get_board(test_data[0])
+    position = board.rank(callback.from_user.id)
+    if position is None:
+        await callback.answer("Javobingiz hali reytingga qo'shilmagan.", show_alert=True)
+        return
+    await callback.answer(f"Test #{test_code}\nHozirgi o'rningiz: {position[0]} / {len(board)}\n\nYakuniy natijalar test tugagach e'lon qilinadi.", show_alert=True)
 
 # "show_error_details" funksiyasi bu yerdan olib tashlandi va start_handler.py ga ko'chirildi.
@@ -88,6 +88,20 @@ def test_duration_keyboard():
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+def test_end_time_keyboard():
+    kb = [
+        [
+            InlineKeyboardButton(text="1 soatdan keyin", callback_data="ends_in_60"),
+            InlineKeyboardButton(text="3 soatdan keyin", callback_data="ends_in_180"),
+        ],
+        [
+            InlineKeyboardButton(text="1 kundan keyin", callback_data="ends_in_1440"),
+            InlineKeyboardButton(text="1 haftadan keyin", callback_data="ends_in_10080"),
+        ],
+        [InlineKeyboardButton(text="✋ O'zim Yakunlayman", callback_data="ends_in_0")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
 def show_error_details_keyboard(test_code: int):
     kb = [[InlineKeyboardButton(text="🔑 Xatolarimni Ko'rish", callback_data=f"show_errors_{test_code}")]]
     return InlineKeyboardMarkup(inline_keyboard=kb)
@@ -112,10 +126,53 @@ def test_management_keyboard(test_code: int):
             InlineKeyboardButton(text="👥 Ishtirokchilar", callback_data=f"participants_{test_code}"),
             InlineKeyboardButton(text="🏁 Testni Yakunlash", callback_data=f"confirm_close_{test_code}")
         ],
+        [
+            InlineKeyboardButton(text="✏️ Kalitni Tahrirlash", callback_data=f"edit_key_{test_code}"),
+            InlineKeyboardButton(text="📈 Statistika", callback_data=f"stats_{test_code}_0")
+        ],
+        [InlineKeyboardButton(text="🏅 Joriy Reyting", callback_data=f"standings_{test_code}")],
         [InlineKeyboardButton(text="⬅️ Ro'yxatga Qaytish", callback_data="back_to_test_list")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
+def standings_keyboard(test_code: int):
+    kb = [
+        [InlineKeyboardButton(text="🔄 Yangilash", callback_data=f"standings_{test_code}")],
+        [InlineKeyboardButton(text="⬅️ Testga Qaytish", callback_data=f"view_test_{test_code}")]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def my_rank_keyboard(test_code: int):
+    kb = [[InlineKeyboardButton(text="📊 Mening O'rnim", callback_data=f"my_rank_{test_code}")]]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+STATS_QUESTIONS_PER_PAGE = 40
+
+def question_stats_keyboard(test_code: int, total_questions: int, page: int):
+    """Savol raqamlari (8 tadan qator), sahifalar bo'yicha."""
+    first = page * STATS_QUESTIONS_PER_PAGE
+    last = min(total_questions, first + STATS_QUESTIONS_PER_PAGE)
+    numbers = [InlineKeyboardButton(text=str(q + 1), callback_data=f"qstat_{test_code}_{q}") for q in range(first, last)]
+    kb = [numbers[i:i + 8] for i in range(0, len(numbers), 8)]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"stats_{test_code}_{page - 1}"))
+    if last < total_questions:
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"stats_{test_code}_{page + 1}"))
+    if navigation:
+        kb.append(navigation)
+    kb.append([InlineKeyboardButton(text="⬅️ Testga Qaytish", callback_data=f"view_test_{test_code}")])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def question_details_keyboard(test_code: int, question: int):
+    page = question // STATS_QUESTIONS_PER_PAGE
+    kb = [[InlineKeyboardButton(text="⬅️ Savollarga Qaytish", callback_data=f"stats_{test_code}_{page}")]]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+def cancel_edit_key_keyboard(test_code: int):
+    kb = [[InlineKeyboardButton(text="⬅️ Bekor Qilish", callback_data=f"cancel_edit_key_{test_code}")]]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
 def confirm_close_test_keyboard(test_code: int):
     kb = [
         [InlineKeyboardButton(text="✅ Ha, Yakunlansin", callback_data=f"close_test_{test_code}")],
@@ -2,27 +2,36 @@
 
 import asyncio
 import logging
+import signal
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from config import BOT_TOKEN
-from database import setup_database, delete_old_tests
+from config import BOT_TOKEN, BOT_MODE, DROP_PENDING_UPDATES, WORKER_PROCESSES, TIMEZONE, AUTO_CLOSE_CHECK_INTERVAL, RETENTION_HOUR
+from database import setup_database, close_database, pool
 from handlers import start_handler, admin_handler, test_creation, test_process
 from middlewares.subscription_middleware import SubscriptionMiddleware
+from services import cluster
+from services.broadcast import resume_broadcasts
+from services.results import start_result_delivery, stop_result_delivery, close_due_tests
+from services.retention import run_retention
+from services.deadlines import start_deadline_scheduler, stop_deadline_scheduler
+from services.workers import shutdown_workers
+from services.answer_writer import start_answer_writer, stop_answer_writer
+from services.last_seen import start_last_seen_writer, stop_last_seen_writer
+from services.fsm_storage import SQLiteStorage
+from services.webhook import run_webhook
 
-async def scheduled_test_cleanup():
-    await delete_old_tests()
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(processName)s - %(name)s - %(message)s'
 
-async def main():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
-
-    await setup_database()
+def create_bot() -> Bot:
+    return Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
 
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    storage = MemoryStorage()
-    dp = Dispatcher(storage=storage)
+def build_dispatcher(bot: Bot) -> Dispatcher:
+    # FSM holatlari bazada saqlanadi, shuning uchun qayta ishga tushganda yo'qolmaydi
+    dp = Dispatcher(storage=SQLiteStorage())
 
     # Middleware'ni ro'yxatdan o'tkazish
     # Update'lar routerlarga yetib borishidan oldin bu yerdan o'tadi
@@ -33,17 +42,94 @@ async def main():
     dp.include_router(admin_handler.router)
     dp.include_router(test_creation.router)
     dp.include_router(test_process.router)
+    return dp
+
+def worker_process(index: int, address: tuple, token: str):
+    """Ko'p jarayonli rejimdagi ishchi: update'larni qayta ishlaydi, bazaga faqat o'qish uchun ulanadi."""
+    # To'xtatish bosh jarayon orqali boshqariladi (u ishchilarga "stop" yuboradi)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    asyncio.run(_worker_main(index, address, token))
+
+async def _worker_main(index: int, address: tuple, token: str):
+    await pool.open(writer=False)
+    bot = create_bot()
+    dp = build_dispatcher(bot)
+    dp.storage.start()
+    # Javoblar shu yerda guruhlanadi, guruh esa bosh jarayonda bitta tranzaksiyada yoziladi
+    start_answer_writer()
+    start_last_seen_writer()
+
+    async def on_stop():
+        await dp.storage.close()
+        await stop_answer_writer()
+        await stop_last_seen_writer()
+
+    try:
+        await cluster.run_worker(index, address, token, dp, bot, on_stop)
+    finally:
+        shutdown_workers()
+        await bot.session.close()
+        await close_database()
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+
+    await setup_database()
+
+    bot = create_bot()
+    dp = build_dispatcher(bot)
 
     # Rejalashtiruvchini sozlash
-    scheduler = AsyncIOScheduler(timezone="Asia/Tashkent")
-    scheduler.add_job(scheduled_test_cleanup, trigger='interval', days=1, misfire_grace_time=3600)
+    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+    # Eski testlarni arxivlash va bazani ixchamlash - kam yuklangan soatda
+    scheduler.add_job(run_retention, trigger='cron', hour=RETENTION_HOUR, args=[bot], misfire_grace_time=3600,
+                      max_instances=1, coalesce=True)
+    # Tugash vaqti bazada saqlanadi, shuning uchun bot to'xtab turgan paytda tugagan testlar ham darhol yopiladi
+    scheduler.add_job(close_due_tests, trigger='interval', seconds=AUTO_CLOSE_CHECK_INTERVAL, args=[bot],
+                      next_run_time=datetime.now(ZoneInfo(TIMEZONE)), max_instances=1, coalesce=True)
     scheduler.start()
 
-    # Botni ishga tushirishdan oldin eski update'larni o'chirish
-    await bot.delete_webhook(drop_pending_updates=True)
+    # To'xtab qolgan ommaviy xabar yuborishlarni davom ettirish
+    await resume_broadcasts(bot)
+    # Test natijalarini yetkazish navbatini ishga tushirish
+    await start_result_delivery(bot)
+    # Vaqtli sessiyalar muddatlarini qayta yuklash
+    await start_deadline_scheduler(bot)
+
+    supervisor = None
+    if WORKER_PROCESSES > 1:
+        # Bu jarayon update'larni qabul qilib ishchilarga taqsimlaydi va bazaga yagona yozuvchi bo'ladi
+        supervisor = cluster.Supervisor(bot, WORKER_PROCESSES, worker_process)
+        await supervisor.start()
+    else:
+        dp.storage.start()
+        # Javoblarni guruhlab saqlovchi yozuvchini ishga tushirish
+        start_answer_writer()
+        start_last_seen_writer()
 
-    logging.info("Bot ishga tushmoqda...")
-    await dp.start_polling(bot)
+    logging.info(f"Bot ishga tushmoqda ({BOT_MODE}, ishchi jarayonlar: {WORKER_PROCESSES if supervisor else 1})...")
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot, supervisor.dispatch if supervisor else None)
+        else:
+            # Polling uchun webhook o'chiriladi; to'planib qolgan update'lar DROP_PENDING_UPDATES bo'yicha
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+            if supervisor:
+                await supervisor.poll(dp.resolve_used_update_types())
+            else:
+                await dp.start_polling(bot)
+    finally:
+        scheduler.shutdown(wait=False)
+        if supervisor:
+            await supervisor.stop()
+        await dp.storage.close()
+        await stop_result_delivery()
+        await stop_deadline_scheduler()
+        await stop_answer_writer()
+        await stop_last_seen_writer()
+        shutdown_workers()
+        await close_database()
 
 if __name__ == '__main__':
     try:
@@ -4,31 +4,12 @@ from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware, Bot
 from aiogram.types import Update, Message, CallbackQuery
 from aiogram.exceptions import TelegramBadRequest
-import logging
 
 import database as db
 from keyboards import subscribe_keyboard
 from config import SUPER_ADMINS
-
-async def check_subscription(user_id: int, bot: Bot):
-    """
-    Foydalanuvchining majburiy kanallarga obuna bo'lganligini tekshiradi.
-    Yangi baza sxemasini (id, username, link) qo'llab-quvvatlaydi.
-    """
-    try:
-        channels = await db.get_channels()
-        if not channels:
-            return True # Agar majburiy kanallar bo'lmasa, har doim True
-
-        for channel_id, username, invite_link in channels:
-            member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-            if member.status.lower() not in ['member', 'administrator', 'creator']:
-                logging.warning(f"User {user_id} is NOT subscribed to channel {channel_id}. Status: {member.status}")
-                return False
-        return True
-    except Exception as e:
-        logging.error(f"Error during subscription check for user {user_id}: {e}")
-        return False
+from services.subscription import check_subscription
+from services import last_seen
 
 
 class SubscriptionMiddleware(BaseMiddleware):
@@ -53,6 +34,8 @@ class SubscriptionMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         user_id = user_event.from_user.id
+        # Bazaga darhol yozilmaydi - fon vazifasi guruhlab saqlaydi
+        last_seen.touch(user_id)
 
         if user_id in SUPER_ADMINS:
             return await handler(event, data)
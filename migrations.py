@@ -0,0 +1,285 @@
+# migrations.py
+
+import asyncio
+import logging
+import time
+
+from config import MIGRATION_CHUNK_SIZE, MIGRATION_CHUNK_PAUSE
+
+# Har bir migratsiya: (versiya, nomi, sxema funksiyasi, to'ldirish funksiyasi yoki None).
+# Sxema funksiyasi yozuvchi ulanishni oladi va bitta tranzaksiya ichida bajariladi.
+# To'ldirish (backfill) funksiyasi undan keyin, `backfill_in_chunks` orqali qisqa
+# tranzaksiyalarda ishlaydi; to'xtab qolsa, keyingi ishga tushishda davom ettiriladi
+# (shuning uchun sxema funksiyasi qayta bajarilsa ham zarar qilmasligi kerak).
+# Qo'llangan versiyalar `schema_version` jadvalida, oxirgi versiya esa
+# `PRAGMA user_version` da saqlanadi - ishga tushishda faqat shu tekshiriladi.
+
+# Asosiy jadvallar (botning dastlabki sxemasi) va migratsiyalarning o'z jadvallari.
+# Yangi jadvallar shu yerga emas, alohida migratsiya sifatida qo'shiladi.
+BASE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, full_name TEXT, referred_by_id INTEGER, referral_count INTEGER DEFAULT 0, status TEXT DEFAULT 'active')''',
+    '''CREATE TABLE IF NOT EXISTS channels (channel_id INTEGER PRIMARY KEY, username TEXT, invite_link TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY AUTOINCREMENT, test_code INTEGER UNIQUE, owner_user_id INTEGER, question_file_id TEXT, question_file_type TEXT, answer_key TEXT, duration_minutes INTEGER, created_at INTEGER NOT NULL, status TEXT DEFAULT 'active')''',
+    '''CREATE TABLE IF NOT EXISTS user_test_sessions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, test_id INTEGER, start_time INTEGER, FOREIGN KEY (test_id) REFERENCES tests (id) ON DELETE CASCADE, UNIQUE(user_id, test_id))''',
+    '''CREATE TABLE IF NOT EXISTS user_answers (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id INTEGER, user_id INTEGER, score INTEGER, submitted_answers TEXT, submitted_at INTEGER, FOREIGN KEY (session_id) REFERENCES user_test_sessions (id) ON DELETE CASCADE, UNIQUE(session_id, user_id))''',
+    '''CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at INTEGER NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS migration_progress (name TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL)''',
+]
+
+
+async def _column_exists(db, table: str, column: str) -> bool:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in await cursor.fetchall())
+
+
+async def _add_column(db, table: str, column: str, declaration: str):
+    if not await _column_exists(db, table, column):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+async def backfill_in_chunks(db, name: str, table: str, sql: str, chunk_size: int = MIGRATION_CHUNK_SIZE):
+    """
+    `table` jadvalini rowid bo'yicha bo'laklarga bo'lib, har bir bo'lak uchun `sql` ni
+    (pastki_rowid, yuqori_rowid) parametrlari bilan alohida qisqa tranzaksiyada bajaradi.
+    Erishilgan joy `migration_progress` jadvalida saqlanadi, shuning uchun uzilgan
+    to'ldirish keyingi ishga tushishda shu joydan davom etadi.
+    """
+    cursor = await db.execute("SELECT last_rowid FROM migration_progress WHERE name = ?", (name,))
+    row = await cursor.fetchone()
+    last_rowid = row[0] if row else 0
+    processed = 0
+    while True:
+        cursor = await db.execute(f"SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT 1 OFFSET ?", (last_rowid, chunk_size - 1))
+        row = await cursor.fetchone()
+        if row:
+            upper = row[0]
+        else:
+            cursor = await db.execute(f"SELECT MAX(rowid) FROM {table} WHERE rowid > ?", (last_rowid,))
+            upper = (await cursor.fetchone())[0]
+            if upper is None:
+                break
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = await db.execute(sql, (last_rowid, upper))
+            processed += max(cursor.rowcount, 0)
+            await db.execute("INSERT INTO migration_progress (name, last_rowid) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET last_rowid = excluded.last_rowid", (name, upper))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        last_rowid = upper
+        # Yozish qulfini bo'shatib, boshqa yozuvchilarga navbat beramiz
+        await asyncio.sleep(MIGRATION_CHUNK_PAUSE)
+    # Erishilgan joy o'chirilmaydi: migratsiya yozilishidan oldin uzilsa, tugagan
+    # to'ldirish qayta boshlanib, qatorlarni ikki marta qo'shib yubormaydi
+    if processed:
+        logging.info(f"To'ldirish '{name}': {processed} ta qator yangilandi.")
+
+
+async def legacy_columns(db):
+    # Eski bazalarda bo'lmagan ustunlar (avval har ishga tushishda ALTER TABLE bilan qo'shilardi)
+    await _add_column(db, "tests", "status", "TEXT DEFAULT 'active'")
+    await _add_column(db, "tests", "question_file_type", "TEXT")
+    await _add_column(db, "channels", "username", "TEXT")
+    await _add_column(db, "channels", "invite_link", "TEXT")
+
+
+async def hot_query_indexes(db):
+    # get_user_tests: egasining aktiv testlari, eng yangisi birinchi (11-migratsiyada almashtirilgan)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tests_owner_active ON tests (owner_user_id, id DESC, test_code) WHERE status = 'active'")
+    # get_archivable_tests: yopilgan eski testlar
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tests_closed_created ON tests (created_at) WHERE status = 'closed'")
+    # get_contest_stats: faqat ball to'plaganlar, ball bo'yicha kamayish tartibida
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_referrals ON users (referral_count DESC, full_name) WHERE referral_count > 0")
+    # get_all_user_ids, get_active_users_count va ommaviy xabar sahifalari (11-migratsiyada almashtirilgan)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_active ON users (user_id) WHERE status = 'active'")
+    # get_test_results / get_test_participant_count: test -> sessiyalar
+    # (user_answers.session_id uchun UNIQUE(session_id, user_id) indeksi yetarli)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_test ON user_test_sessions (test_id, id, start_time, user_id)")
+    # result_outbox indeksi 12-migratsiyada, jadvalning o'zi bilan birga yaratiladi
+
+
+async def fsm_states(db):
+    # Bot qayta ishga tushganda ham saqlanadigan FSM holatlari (services/fsm_storage.py)
+    await db.execute("CREATE TABLE IF NOT EXISTS fsm_states (storage_key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at INTEGER NOT NULL)")
+    # Tashlab ketilgan holatlarni muddati bo'yicha tozalash uchun
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)")
+
+
+async def item_analytics(db):
+    # Savollar tahlili: har bir javob saqlanganda shu tranzaksiyada oshiriladigan yig'indilar
+    await db.execute("CREATE TABLE IF NOT EXISTS test_stats (test_id INTEGER PRIMARY KEY, participants INTEGER NOT NULL DEFAULT 0, score_sum INTEGER NOT NULL DEFAULT 0, score_sq_sum INTEGER NOT NULL DEFAULT 0)")
+    await db.execute("CREATE TABLE IF NOT EXISTS question_stats (test_id INTEGER, question INTEGER, correct INTEGER NOT NULL DEFAULT 0, correct_score_sum INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (test_id, question)) WITHOUT ROWID")
+    await db.execute("CREATE TABLE IF NOT EXISTS option_stats (test_id INTEGER, question INTEGER, option TEXT, count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (test_id, question, option)) WITHOUT ROWID")
+
+
+# Mavjud javoblardan statistikani tiklash (testlar ID oralig'i bo'yicha bo'laklab)
+_POSITIONS = "WITH RECURSIVE pos(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM pos WHERE i < (SELECT MAX(length(answer_key)) FROM tests)) "
+_ITEM_ANALYTICS_BACKFILL = [
+    ("item_analytics_tests",
+     "INSERT INTO test_stats (test_id, participants, score_sum, score_sq_sum) "
+     "SELECT uts.test_id, COUNT(*), SUM(ua.score), SUM(ua.score * ua.score) FROM user_test_sessions uts JOIN user_answers ua ON ua.session_id = uts.id "
+     "WHERE uts.test_id > ? AND uts.test_id <= ? GROUP BY uts.test_id"),
+    ("item_analytics_questions",
+     _POSITIONS + "INSERT INTO question_stats (test_id, question, correct, correct_score_sum) "
+     "SELECT t.id, pos.i - 1, COUNT(*), SUM(ua.score) FROM tests t JOIN pos ON pos.i <= length(t.answer_key) "
+     "JOIN user_test_sessions uts ON uts.test_id = t.id JOIN user_answers ua ON ua.session_id = uts.id "
+     "WHERE t.id > ? AND t.id <= ? AND substr(ua.submitted_answers, pos.i, 1) = substr(t.answer_key, pos.i, 1) GROUP BY t.id, pos.i"),
+    ("item_analytics_options",
+     _POSITIONS + "INSERT INTO option_stats (test_id, question, option, count) "
+     "SELECT t.id, pos.i - 1, CASE WHEN unicode(substr(ua.submitted_answers, pos.i, 1)) < 128 THEN substr(ua.submitted_answers, pos.i, 1) ELSE '?' END AS opt, COUNT(*) "
+     "FROM tests t JOIN pos ON pos.i <= length(t.answer_key) JOIN user_test_sessions uts ON uts.test_id = t.id JOIN user_answers ua ON ua.session_id = uts.id "
+     "WHERE t.id > ? AND t.id <= ? AND pos.i <= length(ua.submitted_answers) GROUP BY t.id, pos.i, opt"),
+]
+
+
+async def backfill_item_analytics(db):
+    for name, sql in _ITEM_ANALYTICS_BACKFILL:
+        await backfill_in_chunks(db, name, "tests", sql, chunk_size=50)
+
+
+async def referral_contests(db):
+    # Referral konkurslari: yangi konkurs - yangi ID, eski ballarni nolga tushirish shart emas
+    await db.execute("CREATE TABLE IF NOT EXISTS contests (id INTEGER PRIMARY KEY AUTOINCREMENT, started_at INTEGER NOT NULL)")
+    await db.execute("CREATE TABLE IF NOT EXISTS contest_referrals (contest_id INTEGER, user_id INTEGER, count INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (contest_id, user_id)) WITHOUT ROWID")
+    # get_contest_stats: joriy konkursning TOP-N qismi indeksdan o'qiladi
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_contest_referrals_count ON contest_referrals (contest_id, count DESC)")
+    cursor = await db.execute("SELECT 1 FROM contests LIMIT 1")
+    if not await cursor.fetchone():
+        await db.execute("INSERT INTO contests (started_at) VALUES (?)", (int(time.time()),))
+    # users.referral_count endi yangilanmaydi
+    await db.execute("DROP INDEX IF EXISTS idx_users_referrals")
+
+
+async def backfill_referral_contests(db):
+    # Hozirgi konkurs ballari users jadvalidan ko'chiriladi
+    await backfill_in_chunks(
+        db, "referral_contests", "users",
+        "INSERT INTO contest_referrals (contest_id, user_id, count) "
+        "SELECT (SELECT MAX(id) FROM contests), user_id, referral_count FROM users "
+        "WHERE rowid > ? AND rowid <= ? AND referral_count > 0 ON CONFLICT DO NOTHING"
+    )
+
+
+async def sequences(db):
+    # Test kodlari bloklab band qilinadigan ketma-ketlik (services/test_codes.py)
+    await db.execute("CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, next_value INTEGER NOT NULL)")
+    # Avvalgi `MAX(test_code) + 1` mantig'i saqlanadi: kodlar 1001 dan boshlanadi
+    await db.execute("INSERT INTO sequences (name, next_value) VALUES ('test_code', MAX(COALESCE((SELECT MAX(test_code) FROM tests), 1000), 1000) + 1) ON CONFLICT(name) DO NOTHING")
+
+
+async def users_last_seen(db):
+    # Oxirgi faollik vaqti (services/last_seen.py guruhlab yozadi)
+    await _add_column(db, "users", "last_seen", "INTEGER")
+
+
+async def session_deadlines(db):
+    # Vaqtli sessiyalarning tugash vaqti va yuborilgan ogohlantirishlar (0 - yo'q, 1 - "5 daqiqa qoldi", 2 - "vaqt tugadi")
+    await _add_column(db, "user_test_sessions", "deadline_at", "INTEGER")
+    await _add_column(db, "user_test_sessions", "notice_state", "INTEGER DEFAULT 0")
+    # Ishga tushishda faqat hali xabar yuborilmagan muddatlar o'qiladi (services/deadlines.py)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_deadline ON user_test_sessions (deadline_at) WHERE notice_state < 2 AND deadline_at IS NOT NULL")
+
+
+async def backfill_session_deadlines(db):
+    # Mavjud vaqtli sessiyalar; muddati o'tganlari uchun xabar yuborilmaydi
+    await backfill_in_chunks(
+        db, "session_deadlines", "user_test_sessions",
+        "UPDATE user_test_sessions SET deadline_at = start_time + (SELECT duration_minutes * 60 FROM tests WHERE tests.id = test_id), "
+        "notice_state = CASE WHEN start_time + (SELECT duration_minutes * 60 FROM tests WHERE tests.id = test_id) < CAST(strftime('%s', 'now') AS INTEGER) THEN 2 ELSE 0 END "
+        "WHERE rowid > ? AND rowid <= ? AND deadline_at IS NULL AND (SELECT duration_minutes FROM tests WHERE tests.id = test_id) > 0"
+    )
+
+
+async def test_end_times(db):
+    # Belgilangan vaqtda avtomatik yopiladigan testlar (services/results.close_due_tests)
+    await _add_column(db, "tests", "ends_at", "INTEGER")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tests_ends_at ON tests (ends_at) WHERE status = 'active' AND ends_at IS NOT NULL")
+
+
+async def test_archiving(db):
+    # Arxiv fayli yozilgan, lekin bazadan hali to'liq o'chirilmagan testlar (services/retention.py)
+    await _add_column(db, "tests", "archived_at", "INTEGER")
+
+
+async def covering_hot_indexes(db):
+    # idx_users_active foydasiz edi: user_id rowid bo'lgani uchun rejalashtiruvchi baribir
+    # butun jadvalni o'qirdi. status bo'yicha indeks (rowid uning oxirida) get_all_user_ids,
+    # get_active_users_count va ommaviy xabar sahifalari uchun qoplovchi indeks bo'ladi.
+    await db.execute("DROP INDEX IF EXISTS idx_users_active")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON users (status)")
+    # get_user_tests: status ham indeksda - jadvalga murojaatsiz, id tartibida (alohida saralashsiz)
+    await db.execute("DROP INDEX IF EXISTS idx_tests_owner_active")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_tests_owner_status ON tests (owner_user_id, status, id, test_code)")
+
+
+async def background_job_tables(db):
+    # Fon vazifalari jadvallari: natijalarni yetkazish navbati, Telegram fayllari keshi va
+    # ommaviy xabarlar. Eski bazalarda ular allaqachon bor - bu qadam faqat versiyani qayd etadi.
+    await db.execute("CREATE TABLE IF NOT EXISTS result_jobs (test_code INTEGER PRIMARY KEY, owner_user_id INTEGER, total_questions INTEGER, status_chat_id INTEGER, status_message_id INTEGER, total INTEGER DEFAULT 0, report_sent INTEGER DEFAULT 0, status TEXT DEFAULT 'running', created_at INTEGER NOT NULL, finished_at INTEGER)")
+    await db.execute("CREATE TABLE IF NOT EXISTS result_outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, test_code INTEGER, user_id INTEGER, place INTEGER, full_name TEXT, score INTEGER, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, next_attempt_at INTEGER DEFAULT 0, UNIQUE(test_code, user_id))")
+    # Natijalar navbatidan yuborilishi kerak bo'lganlarni olish
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_result_outbox_pending ON result_outbox (next_attempt_at, id) WHERE status = 'pending'")
+    await db.execute("CREATE TABLE IF NOT EXISTS media_files (cache_key TEXT PRIMARY KEY, file_id TEXT NOT NULL, updated_at INTEGER)")
+    await db.execute("CREATE TABLE IF NOT EXISTS broadcast_jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, admin_chat_id INTEGER, from_chat_id INTEGER, message_id INTEGER, status_message_id INTEGER, status TEXT DEFAULT 'running', cursor INTEGER DEFAULT 0, total INTEGER DEFAULT 0, sent INTEGER DEFAULT 0, failed INTEGER DEFAULT 0, blocked INTEGER DEFAULT 0, created_at INTEGER NOT NULL, finished_at INTEGER)")
+
+MIGRATIONS = [
+    (1, "legacy_columns", legacy_columns, None),
+    (2, "hot_query_indexes", hot_query_indexes, None),
+    (3, "fsm_states", fsm_states, None),
+    (4, "item_analytics", item_analytics, backfill_item_analytics),
+    (5, "referral_contests", referral_contests, backfill_referral_contests),
+    (6, "sequences", sequences, None),
+    (7, "users_last_seen", users_last_seen, None),
+    (8, "session_deadlines", session_deadlines, backfill_session_deadlines),
+    (9, "test_end_times", test_end_times, None),
+    (10, "test_archiving", test_archiving, None),
+    (11, "covering_hot_indexes", covering_hot_indexes, None),
+    (12, "background_job_tables", background_job_tables, None),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def apply_migrations(db):
+    """Hali qo'llanmagan migratsiyalarni tartib bilan, har birini alohida tranzaksiyada bajaradi."""
+    # Tez yo'l: baza allaqachon yangi bo'lsa, bitta PRAGMA bilan chiqib ketamiz
+    cursor = await db.execute("PRAGMA user_version")
+    if (await cursor.fetchone())[0] >= LATEST_VERSION:
+        return
+
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        for statement in BASE_SCHEMA:
+            await db.execute(statement)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    cursor = await db.execute("SELECT version FROM schema_version")
+    applied = {row[0] for row in await cursor.fetchall()}
+
+    for version, name, migrate, backfill in MIGRATIONS:
+        if version in applied:
+            continue
+        started = time.monotonic()
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            await migrate(db)
+            if backfill is None:
+                await db.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)", (version, name, int(time.time())))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logging.error(f"Migratsiya #{version} ({name}) bajarilmadi.")
+            raise
+        if backfill is not None:
+            # Katta ma'lumotlar qisqa tranzaksiyalarda to'ldiriladi; versiya faqat oxirida yoziladi
+            await backfill(db)
+            await db.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)", (version, name, int(time.time())))
+            await db.commit()
+        logging.info(f"Migratsiya #{version} ({name}) qo'llandi ({time.monotonic() - started:.2f} s).")
+
+    await db.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+    # Yangi indekslar uchun so'rov rejalashtiruvchisi statistikasini yangilash
+    await db.execute("PRAGMA optimize")
@@ -0,0 +1,89 @@
+# services/answer_writer.py
+
+import asyncio
+import logging
+import time
+
+import database as db
+from config import ANSWER_BATCH_SIZE, ANSWER_BATCH_WINDOW_MS
+
+# Javoblar navbatga qo'yiladi va bitta yozuvchi ularni guruhlab, bitta
+# tranzaksiyada saqlaydi. Topshiruvchi tasdiqni faqat commit'dan keyin oladi.
+_queue = None
+_writer_task = None
+_STOP = object()
+
+
+async def submit_answer(session_id: int, user_id: int, score: int, submitted_answers: str) -> bool:
+    """
+    Javobni saqlaydi. True - javob yozildi, False - bu sessiyada javob allaqachon bor
+    (UNIQUE(session_id, user_id)). Yozuvchi ishga tushirilmagan bo'lsa, to'g'ridan-to'g'ri yoziladi.
+    """
+    if _writer_task is None:
+        return await db.save_user_answer(session_id, user_id, score, submitted_answers)
+    future = asyncio.get_running_loop().create_future()
+    await _queue.put(((session_id, user_id, score, submitted_answers, int(time.time())), future))
+    return await future
+
+
+async def _collect_batch() -> tuple:
+    """Bitta guruhni yig'adi: hajmi yoki vaqt oynasi to'lguncha. (guruh, to'xtash_kerakmi) qaytaradi."""
+    loop = asyncio.get_running_loop()
+    first = await _queue.get()
+    if first is _STOP:
+        return [], True
+    batch = [first]
+    deadline = loop.time() + ANSWER_BATCH_WINDOW_MS / 1000
+    while len(batch) < ANSWER_BATCH_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            item = await asyncio.wait_for(_queue.get(), timeout=remaining)
+        except asyncio.TimeoutError:
+            break
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+async def _write_batch(batch: list):
+    try:
+        results = await db.save_user_answers_batch([row for row, _ in batch])
+    except Exception as e:
+        logging.error(f"{len(batch)} ta javobni saqlashda xato: {e}")
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (_, future), inserted in zip(batch, results):
+        if not future.done():
+            future.set_result(inserted)
+
+
+async def _writer_loop():
+    while True:
+        batch, stop = await _collect_batch()
+        if batch:
+            await _write_batch(batch)
+        if stop:
+            return
+
+
+def start_answer_writer():
+    global _queue, _writer_task
+    if _writer_task is None:
+        _queue = asyncio.Queue()
+        _writer_task = asyncio.create_task(_writer_loop())
+
+
+async def stop_answer_writer():
+    """Yozuvchini to'xtatadi; navbatda qolgan javoblar oldin saqlanadi."""
+    global _writer_task
+    if _writer_task is None:
+        return
+    task, _writer_task = _writer_task, None
+    # Yangi javoblar endi to'g'ridan-to'g'ri yoziladi, navbatdagilar esa oxirigacha saqlanadi
+    await _queue.put(_STOP)
+    await task
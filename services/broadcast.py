@@ -0,0 +1,117 @@
+# services/broadcast.py
+
+import asyncio
+import logging
+from functools import partial
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+import database as db
+from config import BROADCAST_WORKERS, BROADCAST_BATCH_SIZE
+from keyboards import admin_panel_keyboard
+from services import cluster
+from services.sender import deliver, SENT, BLOCKED, FAILED
+
+# Ishlayotgan vazifalar: job_id -> asyncio.Task (vazifa GC tomonidan yo'qolmasligi uchun)
+_running_jobs = {}
+
+
+async def _send_batch(bot: Bot, user_ids: list, from_chat_id: int, message_id: int) -> dict:
+    """Bitta bosqichdagi foydalanuvchilarga cheklangan sondagi ishchilar orqali yuboradi."""
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+    results = {}
+
+    async def worker():
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            send = partial(bot.copy_message, chat_id=user_id, from_chat_id=from_chat_id, message_id=message_id)
+            results[user_id] = await deliver(user_id, send)
+
+    await asyncio.gather(*(worker() for _ in range(min(BROADCAST_WORKERS, len(user_ids)))))
+    return results
+
+
+async def _update_status(bot: Bot, chat_id: int, message_id: int, text: str):
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except TelegramBadRequest:
+        pass
+
+
+async def _run_job(bot: Bot, job):
+    """
+    Vazifani kursordan boshlab oxirigacha yuboradi. Yetkazish "kamida bir marta":
+    kursor faqat butun bosqichdan keyin saqlanadi, shuning uchun jarayon bosqich
+    o'rtasida to'xtasa, davom ettirilganda shu bosqichning allaqachon xabar olgan
+    foydalanuvchilariga (ko'pi bilan BROADCAST_BATCH_SIZE ta) xabar qayta boradi.
+    """
+    (job_id, admin_chat_id, from_chat_id, message_id, status_message_id,
+     cursor, total, sent, failed, blocked) = job
+
+    while True:
+        user_ids = await db.get_active_user_ids_after(cursor, BROADCAST_BATCH_SIZE)
+        if not user_ids:
+            break
+
+        results = await _send_batch(bot, user_ids, from_chat_id, message_id)
+        blocked_ids = [user_id for user_id, result in results.items() if result == BLOCKED]
+        sent += sum(1 for result in results.values() if result == SENT)
+        failed += sum(1 for result in results.values() if result == FAILED)
+        blocked += len(blocked_ids)
+
+        # Botni bloklaganlar keyingi yuborishlarda hisobga olinmaydi
+        await db.mark_users_inactive(blocked_ids)
+        # Kursor butun bosqich yuborilgandan keyin saqlanadi: qayta ishga tushganda
+        # yuborish shu bosqich boshidan davom etadi (ishchilar parallel ishlagani uchun
+        # bosqich ichidagi yuborilganlar ketma-ket prefiks emas va alohida saqlanmaydi)
+        cursor = user_ids[-1]
+        await db.save_broadcast_progress(job_id, cursor, sent, failed, blocked)
+
+        processed = sent + failed + blocked
+        percentage = min(100.0, (processed / total) * 100) if total else 100.0
+        await _update_status(bot, admin_chat_id, status_message_id,
+                             f"⏳ Yuborilmoqda: {percentage:.1f}% ({processed}/{total})")
+
+    await db.finish_broadcast_job(job_id)
+    try:
+        await bot.delete_message(chat_id=admin_chat_id, message_id=status_message_id)
+    except TelegramBadRequest:
+        pass
+    await bot.send_message(
+        admin_chat_id,
+        f"✅ Xabar yuborish yakunlandi!\n\n"
+        f"🟢 Yuborildi: {sent} ta foydalanuvchiga\n"
+        f"🔴 Xatolik: {failed} ta foydalanuvchiga\n"
+        f"🚫 Botni bloklagan: {blocked} ta foydalanuvchi",
+        reply_markup=admin_panel_keyboard()
+    )
+
+
+async def _run_job_safely(bot: Bot, job):
+    job_id = job[0]
+    try:
+        await _run_job(bot, job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Vazifa 'running' holatida qoladi va keyingi ishga tushishda davom ettiriladi
+        logging.error(f"Ommaviy xabar vazifasi #{job_id} to'xtadi: {e}")
+    finally:
+        _running_jobs.pop(job_id, None)
+
+
+@cluster.writer_with_bot
+def start_broadcast_job(bot: Bot, job):
+    job_id = job[0]
+    if job_id in _running_jobs:
+        return
+    _running_jobs[job_id] = asyncio.create_task(_run_job_safely(bot, job))
+
+
+async def resume_broadcasts(bot: Bot):
+    """Jarayon qayta ishga tushganda tugallanmagan ommaviy yuborishlarni davom ettiradi."""
+    for job in await db.get_unfinished_broadcast_jobs():
+        logging.info(f"Ommaviy xabar vazifasi #{job[0]} davom ettirilmoqda (kursor: {job[5]}).")
+        start_broadcast_job(bot, job)
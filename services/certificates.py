@@ -0,0 +1,114 @@
+# services/certificates.py
+
+import hashlib
+import io
+import logging
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFont
+
+from config import CERTIFICATE_TOP_PLACES, CERTIFICATE_GENERIC_TEMPLATE, CERTIFICATE_FONT_PATH, CERTIFICATE_CACHE_SIZE
+from services.cache import TTLCache
+from services.workers import run_in_process
+
+NAME_COLOR = (40, 40, 40)
+PLACE_COLOR = (230, 55, 55)
+DETAILS_COLOR = (90, 60, 20)
+
+# Tayyor sertifikatlar: mazmun xeshi -> JPEG baytlari.
+# Yetkazib berish qayta urinilganda rasm qayta chizilmaydi.
+_rendered_cache = TTLCache(maxsize=CERTIFICATE_CACHE_SIZE)
+
+
+def _own_template(place: int):
+    path = f"{place}-o'rin.png"
+    return path if os.path.exists(path) else None
+
+
+@lru_cache(maxsize=None)
+def _warn_missing_template(place: int):
+    # Har bir o'rin uchun bir marta
+    logging.warning(f"{place}-o'rin uchun sertifikat shabloni yo'q: `{place}-o'rin.png` yoki "
+                    f"`{CERTIFICATE_GENERIC_TEMPLATE}` (CERTIFICATE_GENERIC_TEMPLATE) faylini qo'shing.")
+
+
+def template_path(place: int):
+    """O'rin uchun shablon: avval `N-o'rin.png`, bo'lmasa umumiy shablon. Ikkalasi ham yo'q bo'lsa None."""
+    if place > CERTIFICATE_TOP_PLACES:
+        return None
+    path = _own_template(place)
+    if path is None and os.path.exists(CERTIFICATE_GENERIC_TEMPLATE):
+        path = CERTIFICATE_GENERIC_TEMPLATE
+    if path is None:
+        _warn_missing_template(place)
+    return path
+
+
+# --- Quyidagi funksiyalar ishchi jarayonlarda bajariladi ---
+
+@lru_cache(maxsize=16)
+def _load_template(path: str, mtime: float) -> Image.Image:
+    # Shablon har bir jarayonda bir marta o'qiladi va dekodlangan holda saqlanadi
+    with Image.open(path) as image:
+        return image.convert("RGB")
+
+
+@lru_cache(maxsize=32)
+def _load_font(size: int):
+    try:
+        return ImageFont.truetype(CERTIFICATE_FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _fit_font(draw: ImageDraw.ImageDraw, text: str, size: int, max_width: int):
+    font = _load_font(size)
+    while size > 12 and draw.textlength(text, font=font) > max_width:
+        size -= 2
+        font = _load_font(size)
+    return font
+
+
+def render_certificate(path: str, mtime: float, full_name: str, details: str, place_text: str = None) -> bytes:
+    image = _load_template(path, mtime).copy()
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+
+    if place_text:
+        # Umumiy shablonda o'rin raqami ism ustiga yoziladi
+        place_font = _fit_font(draw, place_text, int(height * 0.075), int(width * 0.6))
+        draw.text((width / 2, height * 0.58), place_text, font=place_font, fill=PLACE_COLOR, anchor="mm")
+    name_font = _fit_font(draw, full_name, int(height * 0.05), int(width * 0.7))
+    draw.text((width / 2, height * 0.655), full_name, font=name_font, fill=NAME_COLOR, anchor="mm")
+    details_font = _fit_font(draw, details, int(height * 0.026), int(width * 0.7))
+    draw.text((width / 2, height * 0.698), details, font=details_font, fill=DETAILS_COLOR, anchor="mm")
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90, optimize=True)
+    return output.getvalue()
+
+
+# --- Asosiy jarayon tomoni ---
+
+async def render(place: int, full_name: str, score: int, total_questions: int, test_code: int, date_text: str):
+    """
+    G'olib uchun shaxsiy sertifikatni chizadi (event loop'ni bloklamasdan).
+    Shablon bo'lmasa yoki chizishda xato bo'lsa None qaytaradi.
+    """
+    path = template_path(place)
+    if path is None:
+        return None
+    mtime = os.path.getmtime(path)
+    details = f"Test #{test_code}  •  Natija: {score}/{total_questions}  •  {date_text}"
+    place_text = f"{place}-O'RIN G'OLIBI" if path != _own_template(place) else None
+    key = hashlib.sha256(f"{path}|{mtime}|{full_name}|{details}|{place_text}".encode()).hexdigest()
+    cached = _rendered_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        data = await run_in_process(render_certificate, path, mtime, full_name, details, place_text)
+    except Exception as e:
+        logging.error(f"Sertifikatni chizishda xato ({place}-o'rin, Test #{test_code}): {e}")
+        return None
+    _rendered_cache.set(key, data)
+    return data
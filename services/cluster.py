@@ -0,0 +1,337 @@
+# services/cluster.py
+
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import pickle
+import secrets
+import struct
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+
+from config import CLUSTER_MAX_IN_FLIGHT
+
+# Ko'p jarayonli rejim (WORKER_PROCESSES > 1):
+#   * bosh jarayon (supervisor) update'larni bir marta qabul qiladi va ularni
+#     user_id bo'yicha ishchi jarayonlarga taqsimlaydi - bitta foydalanuvchining
+#     update'lari doim bitta ishchiga, kelgan tartibida tushadi;
+#   * bazaga yozish faqat bosh jarayonda: `@writer` bilan belgilangan funksiyalar
+#     ishchida chaqirilsa, bosh jarayonda bajariladi va natijasi qaytariladi;
+#   * `@replicated` bilan belgilangan kesh o'zgarishlari bosh jarayondan barcha
+#     ishchilarga tarqatiladi (javobdan oldin, shuning uchun chaqiruvchi ishchi
+#     o'z yozuvining natijasini darhol ko'radi);
+#   * FSM holatlari va obuna keshi foydalanuvchi bo'yicha bo'lingani uchun har
+#     bir ishchida faqat o'z foydalanuvchilariniki saqlanadi.
+# Bitta jarayonli rejimda dekoratorlar funksiyani shundayligicha chaqiradi.
+
+SUPERVISOR = "supervisor"
+WORKER = "worker"
+
+_role = None
+# nomi -> (funksiya, birinchi argument bot'mi)
+_registry = {}
+_call_ids = itertools.count(1)
+_pending_calls = {}
+_background_tasks = set()
+# Ishchida: bosh jarayonga ulanish. Bosh jarayonda: indeks -> ishchi ulanishi
+_connection = None
+_links = {}
+# Bosh jarayonda: `@writer_with_bot` funksiyalariga beriladigan bot
+_bot = None
+
+_HEADER = struct.Struct("!I")
+
+
+def _send(writer: asyncio.StreamWriter, message: tuple):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(payload)) + payload)
+
+
+async def _recv(reader: asyncio.StreamReader) -> tuple:
+    header = await reader.readexactly(_HEADER.size)
+    return pickle.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def _register(func, with_bot: bool = False) -> str:
+    name = f"{func.__module__}.{func.__qualname__}"
+    _registry[name] = (func, with_bot)
+    return name
+
+
+async def _call(name: str, args: tuple, kwargs: dict):
+    if _connection is None or _connection.is_closing():
+        raise ConnectionError("Bosh jarayon bilan aloqa uzilgan.")
+    call_id = next(_call_ids)
+    future = asyncio.get_running_loop().create_future()
+    _pending_calls[call_id] = future
+    _send(_connection, ("call", call_id, name, args, kwargs))
+    await _connection.drain()
+    return await future
+
+
+def writer(func):
+    """Bazaga yozuvchi funksiya: ko'p jarayonli rejimda faqat bosh jarayonda bajariladi."""
+    name = _register(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if _role == WORKER:
+            return await _call(name, args, kwargs)
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+def writer_with_bot(func):
+    """
+    Birinchi argumenti `bot` bo'lgan fon xizmati (natijalarni yetkazish, ommaviy xabar):
+    ishchida chaqirilsa, bosh jarayonda uning boti bilan bajariladi, shunda barcha
+    ommaviy yuborishlar bitta tezlik cheklovi ostida qoladi.
+    """
+    name = _register(func, with_bot=True)
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(bot, *args, **kwargs):
+            if _role == WORKER:
+                return await _call(name, args, kwargs)
+            return await func(bot, *args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(bot, *args, **kwargs):
+            if _role == WORKER:
+                _spawn(_call(name, args, kwargs))
+                return None
+            return func(bot, *args, **kwargs)
+    return wrapper
+
+
+def replicated(func):
+    """Jarayon ichidagi kesh o'zgarishi: bosh jarayonda bajarilsa, barcha ishchilarda ham takrorlanadi."""
+    name = _register(func)
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        func(*args)
+        if _role == SUPERVISOR:
+            for link in _links.values():
+                _send(link, ("event", name, args))
+    return wrapper
+
+
+def shard_key(update: dict) -> int:
+    """Update'ni yuborgan foydalanuvchi (topilmasa - chat) ID'si."""
+    for key, value in update.items():
+        if isinstance(value, dict):
+            owner = value.get("from") or value.get("user") or value.get("chat")
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+    return 0
+
+
+async def _execute(link: asyncio.StreamWriter, call_id: int, name: str, args: tuple, kwargs: dict):
+    func, with_bot = _registry[name]
+    try:
+        result = func(_bot, *args, **kwargs) if with_bot else func(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            result = await result
+        reply = ("reply", call_id, True, result)
+    except Exception as e:
+        logging.error(f"Ishchi so'rovini ({name}) bajarishda xato: {e}")
+        reply = ("reply", call_id, False, e)
+    if link.is_closing():
+        return
+    try:
+        _send(link, reply)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        _send(link, ("reply", call_id, False, RuntimeError(repr(reply[3]))))
+    await link.drain()
+
+
+class Supervisor:
+    """Ishchi jarayonlarni boshqaradi, update'larni taqsimlaydi va ularning yozish so'rovlarini bajaradi."""
+
+    def __init__(self, bot: Bot, processes: int, target):
+        self.bot = bot
+        self.processes = processes
+        self.target = target
+        self._token = secrets.token_hex(16)
+        self._context = multiprocessing.get_context("spawn")
+        self._children = {}
+        self._ready = {index: asyncio.Event() for index in range(processes)}
+        self._in_flight = {index: 0 for index in range(processes)}
+        self._slots = asyncio.Semaphore(CLUSTER_MAX_IN_FLIGHT)
+        self._server = None
+        self._address = None
+        self._stopping = False
+
+    async def start(self):
+        global _role, _bot
+        _role, _bot = SUPERVISOR, self.bot
+        self._server = await asyncio.start_server(self._on_connect, "127.0.0.1", 0)
+        self._address = self._server.sockets[0].getsockname()[:2]
+        for index in range(self.processes):
+            self._start_child(index)
+        await asyncio.gather(*(event.wait() for event in self._ready.values()))
+        logging.info(f"{self.processes} ta ishchi jarayon ishga tushdi.")
+
+    def _start_child(self, index: int):
+        process = self._context.Process(target=self.target, args=(index, self._address, self._token), name=f"worker-{index}")
+        process.start()
+        self._children[index] = process
+
+    async def _on_connect(self, reader: asyncio.StreamReader, link: asyncio.StreamWriter):
+        try:
+            kind, token, index = await _recv(reader)
+        except Exception:
+            link.close()
+            return
+        if kind != "hello" or not secrets.compare_digest(token, self._token) or index not in self._ready:
+            link.close()
+            return
+        _links[index] = link
+        self._ready[index].set()
+        try:
+            while True:
+                message = await _recv(reader)
+                if message[0] == "call":
+                    _spawn(_execute(link, *message[1:]))
+                elif message[0] == "done":
+                    self._in_flight[index] -= 1
+                    self._slots.release()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._ready[index].clear()
+            _links.pop(index, None)
+            link.close()
+            # Ishchi bilan birga yo'qolgan update'lar uchun joylarni bo'shatamiz
+            for _ in range(self._in_flight[index]):
+                self._slots.release()
+            self._in_flight[index] = 0
+        if not self._stopping:
+            logging.error(f"Ishchi #{index} bilan aloqa uzildi, qayta ishga tushirilmoqda.")
+            await asyncio.get_running_loop().run_in_executor(None, self._children[index].join, 5)
+            self._start_child(index)
+
+    async def dispatch(self, update: dict):
+        """Update'ni foydalanuvchining ishchisiga yuboradi. Joy bo'lmasa, bo'shaguncha kutadi."""
+        index = abs(shard_key(update)) % self.processes
+        await self._slots.acquire()
+        await self._ready[index].wait()
+        link = _links[index]
+        self._in_flight[index] += 1
+        _send(link, ("update", update))
+        await link.drain()
+
+    async def poll(self, allowed_updates: list):
+        """Long polling orqali update'larni olib, ishchilarga taqsimlaydi."""
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates,
+                                                     request_timeout=int(self.bot.session.timeout + 30))
+            except Exception as e:
+                logging.error(f"Update'larni olishda xato: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await self.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+    async def stop(self, timeout: float = 30):
+        """Ishchilarga to'xtash buyrug'ini beradi: ular qo'lidagi update'larni tugatib, buferlarini yozib chiqadi."""
+        self._stopping = True
+        for link in list(_links.values()):
+            _send(link, ("stop",))
+        loop = asyncio.get_running_loop()
+        for process in self._children.values():
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._server is not None:
+            self._server.close()
+        # Ishchilardan kelgan so'nggi yozish so'rovlari ham tugashi kerak
+        if _background_tasks:
+            await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+
+async def run_worker(index: int, address: tuple, token: str, dp: Dispatcher, bot: Bot, on_stop):
+    """
+    Ishchi jarayonning asosiy sikli: update'larni qayta ishlaydi (bitta foydalanuvchiniki
+    ketma-ket, turli foydalanuvchilarniki parallel) va bosh jarayondan kelgan kesh
+    o'zgarishlarini qo'llaydi. To'xtash buyrug'ida `on_stop()` ni chaqiradi.
+    """
+    global _role, _connection
+    _role = WORKER
+    reader, _connection = await asyncio.open_connection(*address)
+    _send(_connection, ("hello", token, index))
+    await _connection.drain()
+    link = _connection
+    tails = {}
+    updates_in_progress = set()
+
+    async def process(previous, update: dict):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            result = await dp.feed_raw_update(bot, update)
+            if isinstance(result, TelegramMethod):
+                await dp.silent_call_request(bot, result)
+        except Exception as e:
+            logging.error(f"Update #{update.get('update_id')} ni qayta ishlashda xato: {e}")
+        finally:
+            if not link.is_closing():
+                _send(link, ("done",))
+
+    def forget(user_id, task):
+        updates_in_progress.discard(task)
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    async def shutdown():
+        if updates_in_progress:
+            await asyncio.gather(*updates_in_progress, return_exceptions=True)
+        try:
+            await on_stop()
+        finally:
+            link.close()
+
+    try:
+        while True:
+            message = await _recv(reader)
+            kind = message[0]
+            if kind == "update":
+                update = message[1]
+                user_id = shard_key(update)
+                task = asyncio.create_task(process(tails.get(user_id), update))
+                tails[user_id] = task
+                updates_in_progress.add(task)
+                task.add_done_callback(functools.partial(forget, user_id))
+            elif kind == "event":
+                _registry[message[1]][0](*message[2])
+            elif kind == "reply":
+                _, call_id, ok, result = message
+                future = _pending_calls.pop(call_id, None)
+                if future is not None and not future.done():
+                    future.set_result(result) if ok else future.set_exception(result)
+            elif kind == "stop":
+                # Javoblarni qabul qilishda davom etamiz: on_stop() hali yozish so'rovlarini yuboradi
+                _spawn(shutdown())
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        for future in _pending_calls.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Bosh jarayon bilan aloqa uzildi."))
+        _pending_calls.clear()
+        if _background_tasks:
+            await asyncio.gather(*_background_tasks, return_exceptions=True)
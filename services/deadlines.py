@@ -0,0 +1,170 @@
+# services/deadlines.py
+
+import asyncio
+import heapq
+import logging
+import time
+from array import array
+from functools import partial
+from aiogram import Bot
+
+import database as db
+from config import (
+    DEADLINE_WARNING_MINUTES, DEADLINE_TICK_SECONDS, DEADLINE_MISSED_GRACE,
+    DEADLINE_NOTICE_WORKERS
+)
+from services import cluster
+from services.sender import deliver, SENT, BLOCKED
+
+WARNED = 1
+EXPIRED = 2
+# Bitta so'rovda tekshiriladigan sessiyalar soni
+_CHUNK_SIZE = 500
+# Yetkazilmagan xabar shuncha soniyadan keyin, ko'pi bilan _MAX_RETRIES marta qayta yuboriladi
+_RETRY_DELAY = 60
+_MAX_RETRIES = 3
+
+
+class TimerWheel:
+    """
+    Muddatlar DEADLINE_TICK_SECONDS aniqlikdagi savatlarga joylanadi. Har bir savat -
+    butun sonlar massivi (bitta hodisa uchun 8 bayt), savatlar kalitlari esa min-heap'da,
+    shuning uchun millionlab muddat ham kam xotira oladi va navbatdagisi darhol topiladi.
+    Hodisa `session_id * 4 + holat` ko'rinishida saqlanadi.
+    """
+
+    def __init__(self, tick: int):
+        self.tick = max(1, tick)
+        self._buckets = {}
+        self._heap = []
+        self._count = 0
+
+    def add(self, at: int, session_id: int, state: int):
+        key = -(-at // self.tick)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = array("q")
+            heapq.heappush(self._heap, key)
+        bucket.append(session_id * 4 + state)
+        self._count += 1
+
+    def pop_due(self, now: float) -> list:
+        """Vaqti kelgan hodisalar: [(session_id, holat), ...]."""
+        due = []
+        while self._heap and self._heap[0] * self.tick <= now:
+            bucket = self._buckets.pop(heapq.heappop(self._heap))
+            self._count -= len(bucket)
+            due.extend((item >> 2, item & 3) for item in bucket)
+        return due
+
+    def __len__(self):
+        return self._count
+
+
+_wheel = TimerWheel(DEADLINE_TICK_SECONDS)
+_scheduler_task = None
+_retries = {}
+
+
+def _add(session_id: int, deadline_at: int, notice_state: int = 0):
+    warn_at = deadline_at - DEADLINE_WARNING_MINUTES * 60
+    if notice_state < WARNED and DEADLINE_WARNING_MINUTES > 0 and warn_at > time.time():
+        _wheel.add(warn_at, session_id, WARNED)
+    _wheel.add(deadline_at, session_id, EXPIRED)
+
+
+@cluster.writer_with_bot
+def schedule(bot: Bot, session_id: int, deadline_at: int):
+    """Yangi vaqtli sessiyani rejalashtiradi (ko'p jarayonli rejimda bosh jarayonda)."""
+    _add(session_id, deadline_at)
+
+
+def _notice_text(test_code: int, state: int) -> str:
+    if state == WARNED:
+        return (f"⏳ <b>Test #{test_code}</b>: vaqt tugashiga <b>{DEADLINE_WARNING_MINUTES} daqiqa</b> qoldi!\n\n"
+                f"Javoblaringizni <code>{test_code}*abcd...</code> formatida yuborishga ulguring.")
+    return f"⌛️ <b>Test #{test_code}</b>: sizga ajratilgan vaqt tugadi. Endi javob qabul qilinmaydi."
+
+
+async def _notify(bot: Bot, session_ids: list, state: int):
+    """Bir guruh sessiyaga xabar yuboradi: umumiy tezlik cheklovi ostida, cheklangan sondagi ishchilar bilan."""
+    for start in range(0, len(session_ids), _CHUNK_SIZE):
+        chunk = session_ids[start:start + _CHUNK_SIZE]
+        recipients = await db.get_deadline_recipients(chunk, state)
+        queue = asyncio.Queue()
+        for recipient in recipients:
+            queue.put_nowait(recipient)
+        blocked_ids = []
+        failed = set()
+
+        async def worker():
+            while not queue.empty():
+                session_id, user_id, test_code = queue.get_nowait()
+                try:
+                    result = await deliver(user_id, partial(bot.send_message, user_id, _notice_text(test_code, state)))
+                except Exception as e:
+                    logging.error(f"Foydalanuvchi {user_id} ga muddat haqidagi xabarni yuborishda xato: {e}")
+                    result = None
+                if result == BLOCKED:
+                    blocked_ids.append(user_id)
+                elif result != SENT:
+                    failed.add(session_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(DEADLINE_NOTICE_WORKERS, len(recipients)))))
+        await db.mark_users_inactive(blocked_ids)
+        retry_at = time.time() + _RETRY_DELAY
+        for session_id in failed:
+            attempts = _retries.get((session_id, state), 0) + 1
+            if attempts > _MAX_RETRIES:
+                _retries.pop((session_id, state), None)
+                logging.warning(f"Sessiya {session_id} uchun muddat haqidagi xabar {_MAX_RETRIES} urinishda ham yetkazilmadi.")
+                continue
+            _retries[(session_id, state)] = attempts
+            _wheel.add(retry_at, session_id, state)
+        # Yuborilgan, bloklangan, javob bergan yoki test yopilgan sessiyalar belgilanadi - qayta yuklanmaydi.
+        # Yetkazilmaganlar esa belgilanmaydi: qayta urinish yoki bot qayta ishga tushganda yana yuboriladi.
+        retrying = {session_id for session_id in failed if (session_id, state) in _retries}
+        for session_id in chunk:
+            if session_id not in retrying:
+                _retries.pop((session_id, state), None)
+        await db.set_notice_state([session_id for session_id in chunk if session_id not in retrying], state)
+
+
+async def _scheduler_loop(bot: Bot):
+    while True:
+        due = _wheel.pop_due(time.time())
+        for state in (WARNED, EXPIRED):
+            session_ids = [session_id for session_id, event in due if event == state]
+            if session_ids:
+                try:
+                    await _notify(bot, session_ids, state)
+                except Exception as e:
+                    logging.error(f"{len(session_ids)} ta sessiyaga muddat xabarini yuborishda xato: {e}")
+        await asyncio.sleep(DEADLINE_TICK_SECONDS)
+
+
+async def start_deadline_scheduler(bot: Bot):
+    """Kutilayotgan muddatlarni bazadan yuklaydi va rejalashtiruvchini ishga tushiradi."""
+    global _scheduler_task
+    if _scheduler_task is not None:
+        return
+    loaded = 0
+    async for rows in db.iter_pending_deadlines(int(time.time()) - DEADLINE_MISSED_GRACE):
+        for session_id, deadline_at, notice_state in rows:
+            _add(session_id, deadline_at, notice_state)
+        loaded += len(rows)
+    if loaded:
+        logging.info(f"{loaded} ta vaqtli sessiya muddati qayta rejalashtirildi.")
+    _scheduler_task = asyncio.create_task(_scheduler_loop(bot))
+
+
+async def stop_deadline_scheduler():
+    global _scheduler_task
+    if _scheduler_task is None:
+        return
+    task, _scheduler_task = _scheduler_task, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,149 @@
+# services/fsm_storage.py
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+import database as db
+from config import FSM_STATE_TTL, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, FSM_FLUSH_MAX_PENDING
+from services.cache import TTLCache
+
+# Muddati o'tgan holatlarni bazadan tozalash oralig'i (soniya)
+_PURGE_INTERVAL = 600
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM holatlarini bot bazasidagi `fsm_states` jadvalida saqlaydi.
+
+    O'qishlar hajmi cheklangan LRU keshdan, o'zgarishlar esa `_dirty` buferidan
+    fon vazifasi orqali guruhlab yoziladi: FSM_FLUSH_INTERVAL ichida bir kalitga
+    bo'lgan bir nechta `set_state`/`set_data` bitta qatorga birlashadi.
+    FSM_STATE_TTL davomida o'zgarmagan (tashlab ketilgan) holatlar hisobga
+    olinmaydi va vaqti-vaqti bilan bazadan o'chiriladi.
+    """
+
+    def __init__(self, ttl: int = FSM_STATE_TTL, cache_size: int = FSM_CACHE_SIZE,
+                 flush_interval: float = FSM_FLUSH_INTERVAL, max_pending: int = FSM_FLUSH_MAX_PENDING):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # kalit -> (holat, ma'lumot)
+        self._cache = TTLCache(cache_size, default_ttl=ttl)
+        # Hali bazaga yozilmagan o'zgarishlar: kalit -> (holat, ma'lumot)
+        self._dirty = {}
+        self._wakeup = asyncio.Event()
+        self._flush_task = None
+        self._closing = False
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _load(self, key: str) -> tuple:
+        record = self._dirty.get(key)
+        if record is not None:
+            return record
+        record = self._cache.get(key)
+        if record is not None:
+            return record
+        row = await db.get_fsm_record(key, int(time.time()) - self.ttl)
+        # Bazani kutayotganda holat o'zgargan bo'lishi mumkin - yangisi ustun
+        record = self._dirty.get(key) or self._cache.get(key)
+        if record is not None:
+            return record
+        record = (row[0], json.loads(row[1]) if row[1] else {}) if row else (None, {})
+        self._cache.set(key, record)
+        return record
+
+    def _store(self, key: str, state, data: dict):
+        record = (state, data)
+        self._cache.set(key, record)
+        self._dirty[key] = record
+        if len(self._dirty) >= self.max_pending:
+            self._wakeup.set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data = await self._load(storage_key)
+        self._store(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._load(storage_key)
+        self._store(storage_key, state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(self.key_builder.build(key))
+        return copy.deepcopy(data)
+
+    async def flush(self):
+        """Yig'ilgan o'zgarishlarni bitta tranzaksiyada bazaga yozadi."""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        now = int(time.time())
+        records = []
+        for key, (state, data) in pending.items():
+            if state is None and not data:
+                records.append((key, None, None, now))
+            else:
+                records.append((key, state, json.dumps(data, ensure_ascii=False), now))
+        try:
+            await db.save_fsm_records(records)
+        except Exception as e:
+            logging.error(f"FSM holatlarini saqlashda xato ({len(records)} ta): {e}")
+            # Yozilmaganlarni qaytaramiz, agar shu orada yangisi kelmagan bo'lsa
+            for key, record in pending.items():
+                self._dirty.setdefault(key, record)
+
+    async def _purge_expired(self):
+        before = int(time.time()) - self.ttl
+        removed = 0
+        while True:
+            count = await db.delete_expired_fsm_records(before)
+            removed += count
+            if count < 5000:
+                break
+            await asyncio.sleep(0)
+        if removed:
+            logging.info(f"Muddati o'tgan {removed} ta FSM holati o'chirildi.")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if self._closing:
+                return
+            if time.monotonic() - self._last_purge >= _PURGE_INTERVAL:
+                self._last_purge = time.monotonic()
+                try:
+                    await self._purge_expired()
+                except Exception as e:
+                    logging.error(f"Eskirgan FSM holatlarini tozalashda xato: {e}")
+
+    async def close(self) -> None:
+        """Fon vazifasini to'xtatadi va qolgan o'zgarishlarni yozadi (bir necha marta chaqirish mumkin)."""
+        if self._flush_task is not None:
+            task, self._flush_task = self._flush_task, None
+            # Yozish o'rtasida uzib qo'ymaslik uchun bekor qilmasdan, to'xtash belgisini beramiz
+            self._closing = True
+            self._wakeup.set()
+            await task
+        await self.flush()
@@ -0,0 +1,56 @@
+# services/last_seen.py
+
+import asyncio
+import logging
+import time
+
+import database as db
+from config import LAST_SEEN_FLUSH_INTERVAL
+
+# Har bir update'da foydalanuvchining oxirgi faolligi faqat xotirada yangilanadi;
+# to'plangan qiymatlar LAST_SEEN_FLUSH_INTERVAL da bir marta, bitta tranzaksiyada yoziladi.
+_pending = {}
+_flush_task = None
+_stopping = None
+
+
+def touch(user_id: int):
+    if _flush_task is not None:
+        _pending[user_id] = int(time.time())
+
+
+async def flush():
+    global _pending
+    if not _pending:
+        return
+    items, _pending = list(_pending.items()), {}
+    try:
+        await db.save_last_seen(items)
+    except Exception as e:
+        logging.error(f"{len(items)} ta foydalanuvchining oxirgi faolligini saqlashda xato: {e}")
+
+
+async def _flush_loop():
+    while not _stopping.is_set():
+        try:
+            await asyncio.wait_for(_stopping.wait(), timeout=LAST_SEEN_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush()
+
+
+def start_last_seen_writer():
+    global _flush_task, _stopping
+    if _flush_task is None:
+        _stopping = asyncio.Event()
+        _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop_last_seen_writer():
+    """To'xtatadi; xotirada qolgan qiymatlar oxirgi marta yoziladi."""
+    global _flush_task
+    if _flush_task is None:
+        return
+    task, _flush_task = _flush_task, None
+    _stopping.set()
+    await task
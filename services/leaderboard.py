@@ -0,0 +1,97 @@
+# services/leaderboard.py
+
+import asyncio
+from bisect import bisect_left, insort
+
+import database as db
+from config import LEADERBOARD_CACHE_SIZE
+from services import cluster
+from services.cache import TTLCache
+
+
+class Leaderboard:
+    """
+    Bitta testning joriy reytingi: (-ball, sarflangan_vaqt, user_id) kalitlari
+    bisect bilan tartibda saqlanadigan massivda. O'rin va TOP-N qidiruvi O(log n).
+    """
+
+    def __init__(self, rows=()):
+        # rows: (user_id, full_name, score, duration) - bazadan tartiblangan holda keladi
+        self._keys = []
+        self._entries = {}
+        self._names = {}
+        for user_id, full_name, score, duration in rows:
+            self._entries[user_id] = key = (-score, duration, user_id)
+            self._names[user_id] = full_name
+            self._keys.append(key)
+        self._keys.sort()
+
+    def add(self, user_id: int, full_name: str, score: int, duration: int):
+        old = self._entries.get(user_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old)]
+        self._entries[user_id] = key = (-score, duration, user_id)
+        self._names[user_id] = full_name
+        insort(self._keys, key)
+
+    def rank(self, user_id: int):
+        """(o'rin, ball, vaqt) yoki None - o'rin 1 dan boshlanadi."""
+        key = self._entries.get(user_id)
+        if key is None:
+            return None
+        return bisect_left(self._keys, key) + 1, -key[0], key[1]
+
+    def top(self, n: int) -> list:
+        return [(key[2], self._names.get(key[2]), -key[0], key[1]) for key in self._keys[:n]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# test_id -> Leaderboard. Hajmi cheklangan: uzoq ko'rilmagan reytinglar kerak bo'lganda qayta tiklanadi
+_boards = TTLCache(maxsize=LEADERBOARD_CACHE_SIZE)
+# Yuklanayotgan reytinglar: test_id -> (vazifa, yuklash davomida kelgan natijalar)
+_loads = {}
+
+
+async def _load(test_id: int):
+    pending = _loads[test_id][1]
+    try:
+        board = Leaderboard(await db.get_leaderboard_rows(test_id))
+        # Bazadan o'qish davomida saqlangan javoblar ham qo'shiladi (add takrorni almashtiradi)
+        for entry in pending:
+            board.add(*entry)
+        _boards.set(test_id, board)
+        return board
+    finally:
+        del _loads[test_id]
+
+
+async def get_board(test_id: int) -> Leaderboard:
+    """Test reytingini qaytaradi; xotirada bo'lmasa (masalan, qayta ishga tushgandan keyin) bazadan bir marta tiklaydi."""
+    board = _boards.get(test_id)
+    if board is not None:
+        return board
+    if test_id not in _loads:
+        _loads[test_id] = (asyncio.ensure_future(_load(test_id)), [])
+    return await asyncio.shield(_loads[test_id][0])
+
+
+@cluster.replicated
+def record(entries):
+    """Yangi saqlangan natijalar: (test_id, user_id, full_name, score, duration) ro'yxati."""
+    for test_id, *entry in entries:
+        board = _boards.get(test_id)
+        if board is not None:
+            board.add(*entry)
+        elif test_id in _loads:
+            _loads[test_id][1].append(entry)
+
+
+@cluster.replicated
+def invalidate(test_id: int):
+    """Ballar qayta hisoblanganda reyting keyingi so'rovda bazadan tiklanadi."""
+    _boards.pop(test_id)
+    if test_id in _loads:
+        # Yuklanayotgan ma'lumot eskirgan bo'lishi mumkin - keshga yozilmasin
+        _loads[test_id][0].add_done_callback(lambda _: _boards.pop(test_id))
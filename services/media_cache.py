@@ -0,0 +1,66 @@
+# services/media_cache.py
+
+import asyncio
+import hashlib
+import logging
+from functools import lru_cache
+from aiogram import Bot
+from aiogram.types import FSInputFile
+from aiogram.exceptions import TelegramBadRequest
+
+import database as db
+
+# Bir marta yuklangan fayllarning Telegram file_id'lari: kesh kaliti -> file_id
+_file_ids = {}
+_upload_locks = {}
+
+
+@lru_cache(maxsize=None)
+def _cache_key(path: str) -> str:
+    # Kalitga fayl mazmunining xeshi qo'shiladi: rasm almashtirilsa, u qayta yuklanadi
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    return f"{path}:{digest}"
+
+
+async def _get_file_id(key: str):
+    if key not in _file_ids:
+        _file_ids[key] = await db.get_media_file_id(key)
+    return _file_ids[key]
+
+
+def _is_stale_file_error(error: TelegramBadRequest) -> bool:
+    text = str(error).lower()
+    return "file" in text and ("identifier" in text or "reference" in text or "not found" in text)
+
+
+async def send_cached_photo(bot: Bot, chat_id: int, path: str, **kwargs):
+    """
+    Rasmni yuboradi: fayl avval yuklangan bo'lsa, saqlangan file_id ishlatiladi,
+    aks holda u bir marta yuklanadi va file_id bazaga yoziladi. Telegram eskirgan
+    file_id'ni rad etsa, fayl qayta yuklanadi.
+    """
+    key = _cache_key(path)
+    file_id = await _get_file_id(key)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            if not _is_stale_file_error(e):
+                raise
+            logging.warning(f"{path} uchun saqlangan file_id eskirgan, qayta yuklanadi: {e}")
+            if _file_ids.get(key) == file_id:
+                _file_ids[key] = None
+                await db.delete_media_file_id(key)
+
+    # Bir nechta ishchi bir vaqtda kelsa, faqat bittasi faylni yuklaydi
+    lock = _upload_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        file_id = _file_ids.get(key)
+        if file_id:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        message = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(path), **kwargs)
+        file_id = message.photo[-1].file_id
+        _file_ids[key] = file_id
+        await db.save_media_file_id(key, file_id)
+        return message
@@ -0,0 +1,76 @@
+# services/rate_limiter.py
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Klassik "token bucket": soniyasiga `rate` ta token to'planadi, eng ko'pi
+    `capacity` ta. Har bir `acquire()` bitta token sarflaydi yoki token
+    paydo bo'lguncha kutadi. Kutayotganlar navbat bo'yicha xizmat qilinadi.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Telegram flood-wait qaytarganda barcha yuborishlarni to'xtatib turadi."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatRateLimiter:
+    """Bitta chatga yuboriladigan xabarlar orasidagi minimal intervalni ta'minlaydi."""
+
+    def __init__(self, interval: float, max_tracked: int = 50000):
+        self.interval = interval
+        self.max_tracked = max_tracked
+        self._next_allowed = {}
+
+    def _prune(self, now: float):
+        expired = [chat_id for chat_id, at in self._next_allowed.items() if at <= now]
+        for chat_id in expired:
+            del self._next_allowed[chat_id]
+
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        if len(self._next_allowed) >= self.max_tracked:
+            self._prune(now)
+        slot = max(now, self._next_allowed.get(chat_id, 0.0))
+        self._next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class TelegramRateLimiter:
+    """Telegram'ning umumiy (bot bo'yicha) va har bir chat bo'yicha cheklovlari."""
+
+    def __init__(self, global_rate: float, per_chat_interval: float):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat = ChatRateLimiter(per_chat_interval)
+
+    def pause(self, seconds: float):
+        self.global_bucket.pause(seconds)
+
+    async def acquire(self, chat_id: int):
+        await self.per_chat.acquire(chat_id)
+        await self.global_bucket.acquire()
@@ -0,0 +1,113 @@
+# services/regrade.py
+
+import asyncio
+import logging
+import time
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+import database as db
+from config import REGRADE_CHUNK_SIZE
+from keyboards import test_management_keyboard
+from services import cluster, scoring
+
+# Bitta testni bir vaqtda faqat bitta qayta baholash yozadi: kalit ketma-ket ikki marta
+# tahrirlansa, ikkinchisi birinchisi tugashini kutadi va bazadagi eng yangi kalit bilan ishlaydi.
+_locks = {}
+_background_tasks = set()
+# Holat xabari shuncha soniyadan tez-tez yangilanmaydi
+_PROGRESS_INTERVAL = 3
+
+
+async def regrade_test(test_id: int, on_progress=None) -> tuple:
+    """
+    Testning barcha saqlangan javoblarini bazadagi joriy kalit bo'yicha qayta baholaydi.
+    Javoblar REGRADE_CHUNK_SIZE tadan o'qiladi va vektorlashgan holda baholanadi;
+    bazaga faqat bali o'zgargan qatorlar, har bo'lak alohida qisqa tranzaksiyada yoziladi.
+    Kalit shu orada yana o'zgarsa, to'xtaydi va None qaytaradi - yangi kalit bo'yicha navbatdagi
+    qayta baholash davom ettiradi. Aks holda (tekshirilgan, o'zgargan) sonlarini qaytaradi.
+    """
+    # test_id -> [qulf, uni kutayotgan yoki ushlab turganlar soni]
+    entry = _locks.setdefault(test_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            return await _regrade(test_id, on_progress)
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _locks.pop(test_id, None)
+
+
+async def _regrade(test_id: int, on_progress) -> tuple:
+    answer_key = await db.get_answer_key(test_id)
+    checked = changed = 0
+    if answer_key is None:
+        return checked, changed
+    last_session_id = 0
+    while True:
+        rows = await db.get_test_submissions_after(test_id, last_session_id, REGRADE_CHUNK_SIZE)
+        if not rows:
+            break
+        scores, _ = scoring.score_bulk(answer_key, [row[2] or "" for row in rows])
+        changes = [(int(new_score), row[1]) for row, new_score in zip(rows, scores) if new_score != row[3]]
+        if changes and not await db.update_answer_scores(test_id, answer_key, changes):
+            logging.info(f"Test (ID: {test_id}) kaliti qayta baholash paytida yana o'zgardi, eski kalit bo'yicha baholash to'xtatildi.")
+            return None
+        checked += len(rows)
+        changed += len(changes)
+        last_session_id = rows[-1][0]
+        if on_progress is not None:
+            await on_progress(checked)
+        # Bo'laklar orasida boshqa foydalanuvchilarning so'rovlariga navbat beriladi
+        await asyncio.sleep(0)
+    # Savollar tahlili eski kalit bo'yicha yig'ilgan edi - yangi ballar bilan qayta hisoblanadi
+    await db.rebuild_item_stats(test_id)
+    logging.info(f"Test (ID: {test_id}) qayta baholandi: {checked} ta javob, {changed} tasining bali o'zgardi.")
+    return checked, changed
+
+
+async def _edit_status(bot: Bot, chat_id: int, message_id: int, text: str, **kwargs):
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+    except TelegramBadRequest:
+        pass
+
+
+async def _run_regrade(bot: Bot, test_code: int, test_id: int, chat_id: int, message_id: int):
+    total = await db.get_test_participant_count(test_code)
+    last_update = time.monotonic()
+
+    async def on_progress(checked: int):
+        nonlocal last_update
+        if time.monotonic() - last_update < _PROGRESS_INTERVAL:
+            return
+        last_update = time.monotonic()
+        await _edit_status(bot, chat_id, message_id, f"⏳ Test #{test_code} javoblari qayta baholanmoqda: {checked}/{total}")
+
+    try:
+        result = await regrade_test(test_id, on_progress)
+    except Exception as e:
+        logging.error(f"Test #{test_code} ni qayta baholashda xato: {e}")
+        await _edit_status(bot, chat_id, message_id, f"❌ Test #{test_code} javoblarini qayta baholashda xatolik yuz berdi.",
+                           reply_markup=test_management_keyboard(test_code))
+        return
+    if result is None:
+        await _edit_status(bot, chat_id, message_id, f"ℹ️ Test #{test_code} kaliti yana o'zgardi: javoblar eng yangi kalit bo'yicha qayta baholanmoqda.")
+        return
+    checked, changed = result
+    await _edit_status(
+        bot, chat_id, message_id,
+        f"✅ <b>Test #{test_code}</b> kaliti yangilandi.\n\n"
+        f"Tekshirilgan javoblar: <b>{checked} ta</b>\n"
+        f"Bali o'zgarganlar: <b>{changed} ta</b>",
+        reply_markup=test_management_keyboard(test_code)
+    )
+
+
+@cluster.writer_with_bot
+def start_regrade(bot: Bot, test_code: int, test_id: int, chat_id: int, message_id: int):
+    """Qayta baholashni fonda boshlaydi (ko'p jarayonli rejimda bosh jarayonda - qulf bitta joyda bo'lishi uchun)."""
+    task = asyncio.create_task(_run_regrade(bot, test_code, test_id, chat_id, message_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
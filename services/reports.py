@@ -0,0 +1,54 @@
+# services/reports.py
+
+import io
+from datetime import timedelta
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
+
+import database as db
+from services.workers import run_in_process
+
+HEADERS = ["№", "F.I.O", "Telegram ID", "To'g'ri javoblar", "Natija (%)", "Sarflangan vaqt (MM:SS)"]
+
+
+def build_excel_report(test_id: int, test_code: int, total_questions: int) -> bytes:
+    """
+    Hisobotni write-only rejimida yaratadi: qatorlar bazadan to'g'ridan-to'g'ri
+    oqim sifatida yoziladi, shuning uchun xotira ishtirokchilar soniga bog'liq emas.
+    Alohida jarayonda ishlaydi va o'z ulanishini ochadi.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=f"Test #{test_code} Natijalari")
+
+    with db.open_readonly_connection() as conn:
+        # write-only rejimida ustun kengliklari qatorlardan oldin yozilishi kerak,
+        # shuning uchun ular katakchalarni qayta ko'rib chiqish o'rniga agregat so'rovdan olinadi
+        count, name_length, id_length = db.get_test_results_summary(conn, test_id)
+        data_lengths = [len(str(count)), name_length, id_length, len(f"{total_questions}/{total_questions}"), len("100.0%"), len("00:00")]
+        for index, (header, length) in enumerate(zip(HEADERS, data_lengths), 1):
+            sheet.column_dimensions[get_column_letter(index)].width = max(len(header), length) + 2
+
+        header_cells = []
+        for header in HEADERS:
+            cell = WriteOnlyCell(sheet, value=header)
+            cell.font = Font(bold=True)
+            cell.alignment = Alignment(horizontal='center')
+            header_cells.append(cell)
+        sheet.append(header_cells)
+
+        for i, row in enumerate(db.stream_test_results(conn, test_id), 1):
+            user_id, full_name, score, start_time, submitted_at = row
+            percentage = f"{(score / total_questions) * 100:.1f}%" if total_questions > 0 else "0.0%"
+            time_taken_seconds = submitted_at - start_time
+            time_taken_formatted = str(timedelta(seconds=time_taken_seconds)).split('.')[0][2:]
+            sheet.append([i, full_name, user_id, f"{score}/{total_questions}", percentage, time_taken_formatted])
+
+    file_stream = io.BytesIO()
+    workbook.save(file_stream)
+    return file_stream.getvalue()
+
+
+async def generate_excel_report(test_id: int, test_code: int, total_questions: int) -> bytes:
+    return await run_in_process(build_excel_report, test_id, test_code, total_questions)
@@ -0,0 +1,253 @@
+# services/results.py
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from functools import partial
+from aiogram import Bot
+from aiogram.types import BufferedInputFile
+from aiogram.exceptions import TelegramBadRequest
+
+import database as db
+from config import (
+    RESULT_DELIVERY_WORKERS, RESULT_DELIVERY_BATCH_SIZE, RESULT_MAX_ATTEMPTS,
+    RESULT_RETRY_DELAY, RESULT_PROGRESS_INTERVAL
+)
+from keyboards import show_error_details_keyboard
+from services import certificates, cluster
+from services.media_cache import send_cached_photo
+from services.reports import generate_excel_report
+from services.sender import deliver, SENT, BLOCKED
+
+CERTIFICATE_TITLES = {
+    1: "🏆 TABRIKLAYMIZ, SIZ MUTLAQ G'OLIBSIZ! 🏆",
+    2: "🥈 TABRIKLAYMIZ, SIZ 2-O'RIN SOVRINDORISIZ! 🥈",
+    3: "🥉 TABRIKLAYMIZ, SIZ 3-O'RIN SOVRINDORISIZ! 🥉",
+}
+
+# Barcha yopilgan testlar natijalari bitta navbat (result_outbox) orqali,
+# bitta umumiy tezlik cheklovi ostida yuboriladi.
+_wakeup = asyncio.Event()
+_delivery_task = None
+_background_tasks = set()
+_last_progress_at = {}
+
+# result_jobs.report_sent holatlari
+REPORT_PENDING = 0
+REPORT_SENT = 1
+REPORT_SKIPPED = 2
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _prepare_send(bot: Bot, test_code: int, user_id: int, place: int, full_name: str, score: int, total_questions: int):
+    percentage = (score / total_questions) * 100 if total_questions > 0 else 0
+    photo_path = certificates.template_path(place)
+    if photo_path:
+        caption_title = CERTIFICATE_TITLES.get(place, f"🎖 TABRIKLAYMIZ, SIZ {place}-O'RIN SOVRINDORISIZ! 🎖")
+        caption_text = (f"<b>{caption_title}</b>\n\n"
+                        f"Siz <b>Test #{test_code}</b> da faxrli <b>{place}-o'rinni</b> egalladingiz!\n\n"
+                        f"Natijangiz: <b>{score}/{total_questions}</b> ({percentage:.1f}%)")
+        certificate = await certificates.render(place, full_name or f"ID: {user_id}", score, total_questions, test_code,
+                                                datetime.now().strftime("%d.%m.%Y"))
+        if certificate is not None:
+            photo = BufferedInputFile(certificate, filename=f"sertifikat_{test_code}_{place}.jpg")
+            return partial(bot.send_photo, chat_id=user_id, photo=photo, caption=caption_text,
+                           reply_markup=show_error_details_keyboard(test_code))
+        # Chizib bo'lmasa, umumiy (shaxsiylashtirilmagan) sertifikat yuboriladi
+        return partial(send_cached_photo, bot, user_id, photo_path, caption=caption_text,
+                       reply_markup=show_error_details_keyboard(test_code))
+    result_text = (f"<b>Test #{test_code} Natijasi</b>\n\nIshtirokchi: <b>{full_name}</b>\nTo'g'ri javoblar soni: <b>{score} / {total_questions}</b>\nO'zlashtirish: <b>{percentage:.1f}%</b>")
+    return partial(bot.send_message, user_id, result_text, reply_markup=show_error_details_keyboard(test_code))
+
+
+async def _send_batch(bot: Bot, rows) -> list:
+    """Outbox qatorlarini cheklangan sondagi ishchilar orqali yuboradi va yangi holatlarni qaytaradi."""
+    queue = asyncio.Queue()
+    for row in rows:
+        queue.put_nowait(row)
+    updates = []
+    blocked_ids = []
+
+    async def worker():
+        while not queue.empty():
+            outbox_id, test_code, user_id, place, full_name, score, attempts, total_questions = queue.get_nowait()
+            try:
+                send = await _prepare_send(bot, test_code, user_id, place, full_name, score, total_questions)
+                result = await deliver(user_id, send)
+            except Exception as e:
+                # Bitta qatordagi xato qolgan ishchilarni to'xtatmaydi va yuborilganlar holatini yo'qotmaydi
+                logging.error(f"Test #{test_code} natijasini {user_id} ga yuborishda xato: {e}")
+                result = None
+            attempts += 1
+            if result == SENT:
+                updates.append(('sent', attempts, 0, outbox_id))
+            elif result == BLOCKED:
+                updates.append(('blocked', attempts, 0, outbox_id))
+                blocked_ids.append(user_id)
+            elif attempts >= RESULT_MAX_ATTEMPTS:
+                updates.append(('failed', attempts, 0, outbox_id))
+            else:
+                # Keyingi urinish vaqti har safar uzaytiriladi
+                updates.append(('pending', attempts, int(time.time()) + RESULT_RETRY_DELAY * attempts, outbox_id))
+
+    await asyncio.gather(*(worker() for _ in range(min(RESULT_DELIVERY_WORKERS, len(rows)))))
+    await db.mark_users_inactive(blocked_ids)
+    return updates
+
+
+async def _edit_status(bot: Bot, chat_id: int, message_id: int, text: str):
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except TelegramBadRequest:
+        pass
+
+
+async def _refresh_progress(bot: Bot, test_code: int, force: bool = False):
+    """Test egasining holat xabarini yangilaydi; barcha natijalar yuborilgach vazifani yakunlaydi."""
+    job = await db.get_result_job(test_code)
+    if not job or job[6] != 'running':
+        return
+    _, owner_id, status_chat_id, status_message_id, total, report_sent, _ = job
+    counts = await db.get_result_delivery_counts(test_code)
+    pending = counts.get('pending', 0)
+
+    if pending == 0:
+        # Hisobot bosqichi tugamagan bo'lsa, yakuniy xabarni _after_close yuboradi.
+        # Yakunlash atomar: yetkazish sikli va _after_close bir vaqtda kelsa ham xabar bir marta ketadi.
+        if report_sent == REPORT_PENDING or not await db.finish_result_job(test_code):
+            return
+        _last_progress_at.pop(test_code, None)
+        final_text = f"✅ Test #{test_code} muvaffaqiyatli yakunlandi.\n\nNatijalar {counts.get('sent', 0)} ta ishtirokchiga yuborildi."
+        if report_sent == REPORT_SENT: final_text += "\n\n📊 Batafsil hisobot (Excel) sizga shaxsiy xabar qilib yuborildi."
+        if status_message_id:
+            await _edit_status(bot, status_chat_id, status_message_id, final_text)
+        else:
+            await deliver(owner_id, partial(bot.send_message, owner_id, final_text))
+        return
+
+    now = time.monotonic()
+    if not status_message_id or (not force and now - _last_progress_at.get(test_code, 0) < RESULT_PROGRESS_INTERVAL):
+        return
+    _last_progress_at[test_code] = now
+    await _edit_status(bot, status_chat_id, status_message_id,
+                       f"⏳ Test #{test_code} yakunlanmoqda... Natijalar yuborilmoqda: {total - pending}/{total}")
+
+
+async def _delivery_loop(bot: Bot):
+    while True:
+        # Event so'rovdan oldin tozalanadi: so'rov va kutish orasida kelgan signal yo'qolmaydi
+        _wakeup.clear()
+        try:
+            rows = await db.get_pending_result_deliveries(RESULT_DELIVERY_BATCH_SIZE)
+            if rows:
+                updates = await _send_batch(bot, rows)
+                await db.update_result_deliveries(updates)
+                for test_code in {row[1] for row in rows}:
+                    await _refresh_progress(bot, test_code)
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Natijalarni yetkazishda xato: {e}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=RESULT_RETRY_DELAY)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _send_report(bot: Bot, test_code: int, test_id: int, owner_id: int, participants: int, total_questions: int):
+    if not participants:
+        await db.mark_result_report_sent(test_code, REPORT_SKIPPED)
+        return
+    try:
+        excel_bytes = await generate_excel_report(test_id, test_code, total_questions)
+        report_file = BufferedInputFile(excel_bytes, filename=f"test_{test_code}_natijalar.xlsx")
+        await bot.send_document(chat_id=owner_id, document=report_file, caption=f"✅ <b>Test #{test_code}</b> uchun yakuniy hisobot.")
+    except Exception as e:
+        logging.error(f"Excel hisobotini yuborishda xato: {e}")
+        await db.mark_result_report_sent(test_code, REPORT_SKIPPED)
+        await deliver(owner_id, partial(bot.send_message, owner_id, f"❗️ Test #{test_code} uchun Excel-hisobotni yaratishda xatolik yuz berdi."))
+        return
+    await db.mark_result_report_sent(test_code, REPORT_SENT)
+
+
+async def _after_close(bot: Bot, test_code: int, test_id: int, owner_id: int, participants: int, total_questions: int):
+    await _send_report(bot, test_code, test_id, owner_id, participants, total_questions)
+    _wakeup.set()
+    await _refresh_progress(bot, test_code, force=True)
+
+
+@cluster.writer_with_bot
+async def close_test_and_notify(bot: Bot, test_code: int, status_chat_id: int = None, status_message_id: int = None) -> bool:
+    """
+    Testni yopadi va natijalarni yetkazish navbatiga qo'yadi. Darhol qaytadi:
+    sertifikatlar, natijalar va Excel-hisobot fon rejimida yuboriladi.
+    Test allaqachon yopilgan bo'lsa False qaytaradi.
+    """
+    closed = await db.close_test_with_outbox(test_code, status_chat_id, status_message_id)
+    if closed is None:
+        return False
+    test_id, owner_id, answer_key, participants = closed
+    _spawn(_after_close(bot, test_code, test_id, owner_id, participants, len(answer_key)))
+    return True
+
+
+async def _after_close_many(bot: Bot, closed: list):
+    # Hisobotlar ketma-ket tayyorlanadi; natijalar esa allaqachon umumiy navbatda
+    for test_code, test_id, owner_id, answer_key, participants in closed:
+        await _after_close(bot, test_code, test_id, owner_id, participants, len(answer_key))
+
+
+async def close_due_tests(bot: Bot):
+    """
+    Tugash vaqti kelgan testlarni yopadi (rejalashtiruvchi har AUTO_CLOSE_CHECK_INTERVAL da chaqiradi).
+    Bir vaqtda tugagan testlarning natijalari bitta `result_outbox` navbatiga tushadi va
+    umumiy tezlik cheklovi ostida yuboriladi - har bir test uchun alohida oqim ochilmaydi.
+    """
+    closed = []
+    for test_code, owner_id in await db.get_due_tests(int(time.time())):
+        # Avval test yopiladi: qo'lda yoki boshqa tekshiruvda yopilgan bo'lsa, egasiga xabar yuborilmaydi
+        result = await db.close_test_with_outbox(test_code)
+        if result is None:
+            continue
+        status = []
+
+        async def send_status():
+            status.append(await bot.send_message(owner_id, f"⏳ Test #{test_code} belgilangan vaqtda yakunlandi. Natijalar yuborilmoqda..."))
+
+        # Hisobot bosqichi hali boshlanmagan, shuning uchun vazifa bu xabar saqlanmaguncha yakunlanmaydi
+        if await deliver(owner_id, send_status) == SENT:
+            await db.set_result_job_status_message(test_code, owner_id, status[0].message_id)
+        closed.append((test_code, *result))
+    if closed:
+        logging.info(f"{len(closed)} ta test belgilangan vaqtda yakunlandi.")
+        _wakeup.set()
+        _spawn(_after_close_many(bot, closed))
+
+
+async def start_result_delivery(bot: Bot):
+    """Yetkazish jarayonini ishga tushiradi va qayta ishga tushishdan oldin qolib ketgan ishlarni tiklaydi."""
+    global _delivery_task
+    if _delivery_task is None:
+        _delivery_task = asyncio.create_task(_delivery_loop(bot))
+    for test_code, report_sent in await db.get_running_result_jobs():
+        job = await db.get_result_job(test_code)
+        test_data = await db.get_test_by_code(test_code)
+        if report_sent == REPORT_PENDING and test_data:
+            _spawn(_after_close(bot, test_code, test_data[0], job[1], job[4], len(test_data[5])))
+        else:
+            _spawn(_refresh_progress(bot, test_code, force=True))
+
+
+async def stop_result_delivery():
+    global _delivery_task
+    if _delivery_task is not None:
+        _delivery_task.cancel()
+        _delivery_task = None
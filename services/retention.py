@@ -0,0 +1,195 @@
+# services/retention.py
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from aiogram import Bot
+
+import database as db
+from config import (
+    DB_NAME, SUPER_ADMINS, RETENTION_DAYS, ARCHIVE_DIR, RETENTION_CHUNK_SIZE,
+    RETENTION_CHUNK_PAUSE, VACUUM_STEP_PAGES
+)
+
+# Eski yopilgan testlar bazadan bir martada o'chirilmaydi:
+#   1) test va uning barcha javoblari siqilgan JSONL faylga yoziladi (ARCHIVE_DIR);
+#   2) fayl diskka tushgach, test `archived_at` bilan belgilanadi;
+#   3) sessiyalar, javoblar va natijalar navbati kichik bo'laklarda o'chiriladi;
+#   4) ota qatori qolmagan (yetim) qatorlar tozalanadi;
+#   5) bo'shagan sahifalar incremental vacuum bilan fayldan qirqiladi.
+# Har bir qadam alohida qisqa tranzaksiya, uzilsa keyingi ishga tushishda davom etadi.
+
+_AUTO_VACUUM_INCREMENTAL = 2
+_lock = asyncio.Lock()
+
+
+def _archive_path(test_code: int, test_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"test_{test_code}_{test_id}.jsonl.gz")
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _database_size() -> int:
+    return _file_size(DB_NAME) + _file_size(DB_NAME + "-wal")
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+
+
+def _open_archive(path: str):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    return gzip.open(path, "wt", encoding="utf-8")
+
+
+def _close_archive(archive, tmp_path: str, path: str):
+    archive.close()
+    # Fayl diskka to'liq tushmaguncha bazadan hech narsa o'chirilmaydi
+    with open(tmp_path, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+async def _archive_test(test) -> int:
+    """Testni arxiv fayliga yozadi va fayl hajmini qaytaradi."""
+    test_id, test_code, owner_user_id, answer_key, duration_minutes, created_at = test
+    path = _archive_path(test_code, test_id)
+    tmp_path = path + ".tmp"
+    archive = await asyncio.to_thread(_open_archive, tmp_path)
+    try:
+        header = {"type": "test", "id": test_id, "test_code": test_code, "owner_user_id": owner_user_id,
+                  "answer_key": answer_key, "duration_minutes": duration_minutes, "created_at": created_at}
+        await asyncio.to_thread(archive.write, json.dumps(header, ensure_ascii=False) + "\n")
+        after_session_id = 0
+        while True:
+            rows = await db.get_test_archive_rows(test_id, after_session_id, RETENTION_CHUNK_SIZE)
+            if not rows:
+                break
+            lines = "".join(
+                json.dumps({"type": "session", "session_id": session_id, "user_id": user_id, "start_time": start_time,
+                            "score": score, "answers": submitted_answers, "submitted_at": submitted_at}, ensure_ascii=False) + "\n"
+                for session_id, user_id, start_time, score, submitted_answers, submitted_at in rows
+            )
+            await asyncio.to_thread(archive.write, lines)
+            after_session_id = rows[-1][0]
+        await asyncio.to_thread(_close_archive, archive, tmp_path, path)
+    except BaseException:
+        archive.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+async def _purge_test(test_id: int, test_code: int) -> int:
+    """Arxivlangan testni bazadan bo'laklab o'chiradi. O'chirilgan qatorlar soni."""
+    deleted = 0
+    while True:
+        count = await db.delete_archived_test_chunk(test_id, test_code, RETENTION_CHUNK_SIZE)
+        if not count:
+            break
+        deleted += count
+        await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+    await db.delete_archived_test(test_id, test_code)
+    return deleted
+
+
+async def archive_old_tests() -> tuple:
+    """(arxivlangan testlar soni, arxiv fayllari hajmi, o'chirilgan qatorlar soni)."""
+    archived = archive_bytes = deleted = 0
+    # Avvalgi ishga tushishda arxivlanib, o'chirilishi tugamay qolganlar
+    for test_id, test_code in await db.get_archived_tests():
+        deleted += await _purge_test(test_id, test_code)
+    older_than = int(time.time()) - RETENTION_DAYS * 24 * 60 * 60
+    while True:
+        tests = await db.get_archivable_tests(older_than)
+        if not tests:
+            break
+        for test in tests:
+            archive_bytes += await _archive_test(test)
+            await db.mark_test_archived(test[0])
+            deleted += await _purge_test(test[0], test[1])
+            archived += 1
+    return archived, archive_bytes, deleted
+
+
+async def delete_orphans() -> int:
+    """Ota qatori yo'q qatorlarni rowid oraliqlari bo'yicha, qisqa tranzaksiyalarda o'chiradi."""
+    deleted = 0
+    window = RETENTION_CHUNK_SIZE * 10
+    for table in db.ORPHAN_RULES:
+        max_rowid = await db.get_max_rowid(table)
+        low = 0
+        while low < max_rowid:
+            count = await db.delete_orphans_in_range(table, low, low + window)
+            low += window
+            if count:
+                deleted += count
+                await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+    deleted += await db.delete_orphan_stats()
+    return deleted
+
+
+async def compact_database() -> int:
+    """Bo'sh sahifalarni fayldan qirqadi. Bo'shatilgan sahifalar soni."""
+    stats = await db.get_storage_stats()
+    if not stats["freelist_count"]:
+        return 0
+    if stats["auto_vacuum"] != _AUTO_VACUUM_INCREMENTAL:
+        # Eski baza: bir martalik to'liq VACUUM, keyingi safarlardan boshlab faqat incremental
+        logging.info("Baza incremental vacuum rejimiga o'tkazilmoqda (bir martalik to'liq VACUUM)...")
+        await db.enable_incremental_vacuum()
+        return stats["freelist_count"]
+    freed = 0
+    while True:
+        before = stats["freelist_count"]
+        await db.incremental_vacuum(VACUUM_STEP_PAGES)
+        stats = await db.get_storage_stats()
+        freed += before - stats["freelist_count"]
+        if not stats["freelist_count"] or stats["freelist_count"] >= before:
+            break
+        await asyncio.sleep(RETENTION_CHUNK_PAUSE)
+    return freed
+
+
+async def run_retention(bot: Bot = None) -> dict:
+    """Arxivlash, tozalash va ixchamlash (rejalashtiruvchi har kuni kam yuklangan soatda chaqiradi)."""
+    if _lock.locked():
+        logging.warning("Arxivlash allaqachon ishlamoqda.")
+        return {}
+    async with _lock:
+        started = time.monotonic()
+        size_before = _database_size()
+        archived, archive_bytes, deleted = await archive_old_tests()
+        orphans = await delete_orphans()
+        freed_pages = await compact_database()
+        await db.checkpoint_wal()
+        report = {
+            "archived_tests": archived, "archive_bytes": archive_bytes, "deleted_rows": deleted,
+            "orphans": orphans, "freed_pages": freed_pages,
+            "size_before": size_before, "size_after": _database_size(),
+            "seconds": time.monotonic() - started,
+        }
+    reclaimed = report["size_before"] - report["size_after"]
+    text = (f"🗄 <b>Arxivlash va tozalash</b>\n\n"
+            f"Arxivlangan testlar: <b>{archived} ta</b> ({format_size(archive_bytes)})\n"
+            f"O'chirilgan qatorlar: <b>{deleted} ta</b>, yetim qatorlar: <b>{orphans} ta</b>\n"
+            f"Baza hajmi: {format_size(report['size_before'])} → <b>{format_size(report['size_after'])}</b> "
+            f"(bo'shatildi: {format_size(reclaimed)})\n"
+            f"Vaqt: {report['seconds']:.1f} s")
+    logging.info(text.replace("<b>", "").replace("</b>", "").replace("\n\n", ": ").replace("\n", "; "))
+    if bot is not None and (archived or orphans or freed_pages):
+        for admin_id in SUPER_ADMINS:
+            try:
+                await bot.send_message(admin_id, text)
+            except Exception as e:
+                logging.error(f"Admin {admin_id} ga arxivlash hisobotini yuborishda xato: {e}")
+    return report
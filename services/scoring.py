@@ -0,0 +1,92 @@
+# services/scoring.py
+
+import numpy as np
+
+# Javoblar kaliti va o'quvchi javoblari ixcham bayt massivlari (har bir savolga 1 bayt)
+# sifatida solishtiriladi. ASCII bo'lmagan belgi "?" ga aylanadi: kalit faqat lotin
+# harflaridan iborat bo'lgani uchun bunday javob baribir noto'g'ri hisoblanadi.
+# Bitta javob ham, butun test ham bir xil vektorlashgan yo'l bilan baholanadi.
+
+
+def encode_answers(answers: str) -> bytes:
+    return answers.lower().encode("ascii", "replace")
+
+
+def _matrix(submissions, total_questions: int) -> np.ndarray:
+    """Javoblarni (soni x savollar) o'lchamli uint8 matritsaga joylaydi; yetishmagan javoblar 0 bilan to'ldiriladi."""
+    rows = [encode_answers(answers)[:total_questions].ljust(total_questions, b"\0") for answers in submissions]
+    return np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(len(rows), total_questions)
+
+
+def grade_bulk(answer_key: str, submissions) -> tuple:
+    """
+    Bir testning barcha javoblarini bittada baholaydi.
+    (ballar, to'g'rilik matritsasi) qaytaradi: ballar - int32 massiv,
+    matritsa - har bir javob va savol uchun True/False.
+    """
+    key = np.frombuffer(encode_answers(answer_key), dtype=np.uint8)
+    if not submissions:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, len(key)), dtype=bool)
+    correct = _matrix(submissions, len(key)) == key
+    return correct.sum(axis=1, dtype=np.int32), correct
+
+
+def score_bulk(answer_key: str, submissions) -> tuple:
+    """(ballar, bitmaplar) - bitmap har bir javob uchun ceil(savollar/8) baytli qator."""
+    scores, correct = grade_bulk(answer_key, submissions)
+    return scores, np.packbits(correct, axis=1)
+
+
+def score_submission(answer_key: str, submitted_answers: str) -> tuple:
+    """Bitta javob uchun (ball, bitmap bytes)."""
+    scores, bitmaps = score_bulk(answer_key, [submitted_answers])
+    return int(scores[0]), bitmaps[0].tobytes()
+
+
+def unpack_bitmap(bitmap: bytes, total_questions: int) -> list:
+    """Bitmapni har bir savol uchun True/False ro'yxatiga qaytaradi."""
+    bits = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))[:total_questions]
+    return bits.astype(bool).tolist()
+
+
+def item_increments(answer_key: str, submissions, scores) -> tuple:
+    """
+    Yangi javoblar bo'yicha savollar statistikasiga qo'shiladigan qiymatlar:
+    ([(savol, to'g'ri_soni, to'g'ri_javob_berganlar_ballari_yig'indisi)],
+     [(savol, variant, tanlaganlar_soni)]). Savollar 0 dan raqamlanadi.
+    """
+    key = np.frombuffer(encode_answers(answer_key), dtype=np.uint8)
+    if not len(submissions) or not len(key):
+        return [], []
+    matrix = _matrix(submissions, len(key))
+    correct = matrix == key
+    score_column = np.asarray(scores, dtype=np.int64)[:, None]
+    correct_counts = correct.sum(axis=0)
+    correct_score_sums = (correct * score_column).sum(axis=0)
+    questions = [(q, int(correct_counts[q]), int(correct_score_sums[q])) for q in np.flatnonzero(correct_counts).tolist()]
+    options = []
+    for value in np.unique(matrix).tolist():
+        if value == 0:
+            continue
+        counts = (matrix == value).sum(axis=0)
+        options.extend((q, chr(value), int(counts[q])) for q in np.flatnonzero(counts).tolist())
+    return questions, options
+
+
+def item_statistics(participants: int, score_sum: int, score_sq_sum: int, correct: int, correct_score_sum: int) -> tuple:
+    """
+    Savolning qiyinligi (to'g'ri javoblar ulushi) va ajrata olish ko'rsatkichi
+    (nuqtali-biserial korrelyatsiya) - faqat oldindan yig'ilgan yig'indilardan, O(1).
+    Hisoblab bo'lmasa (hamma to'g'ri/noto'g'ri yoki ballar bir xil) ko'rsatkich None.
+    """
+    if participants <= 0:
+        return None, None
+    difficulty = correct / participants
+    mean = score_sum / participants
+    variance = score_sq_sum / participants - mean * mean
+    if correct in (0, participants) or variance <= 1e-12:
+        return difficulty, None
+    mean_correct = correct_score_sum / correct
+    mean_incorrect = (score_sum - correct_score_sum) / (participants - correct)
+    discrimination = (mean_correct - mean_incorrect) / variance ** 0.5 * (difficulty * (1 - difficulty)) ** 0.5
+    return difficulty, discrimination
@@ -0,0 +1,59 @@
+# services/sender.py
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNetworkError, TelegramServerError
+)
+
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_INTERVAL, SEND_MAX_RETRIES
+from services.rate_limiter import TelegramRateLimiter
+
+# Yetkazib berish natijalari
+SENT = "sent"
+BLOCKED = "blocked"   # Foydalanuvchi botni bloklagan yoki akkaunti o'chirilgan
+FAILED = "failed"
+
+# Ommaviy yuborishlar uchun umumiy cheklovchi: barcha fon vazifalari
+# bitta limitni baham ko'radi, shuning uchun birgalikda ham Telegram chegarasidan oshmaydi.
+telegram_limiter = TelegramRateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_INTERVAL)
+
+_BLOCKED_MARKERS = ("chat not found", "user is deactivated", "bot was blocked")
+
+
+async def deliver(chat_id: int, send: Callable[[], Awaitable], limiter: TelegramRateLimiter = telegram_limiter) -> str:
+    """
+    `send()` ni tezlik cheklovi ostida chaqiradi. Flood-wait (RetryAfter) bo'lsa
+    butun limiter to'xtatiladi va urinish takrorlanadi; tarmoq xatolarida
+    eksponensial kutish bilan qayta uriniladi.
+    """
+    attempt = 0
+    while True:
+        await limiter.acquire(chat_id)
+        try:
+            await send()
+            return SENT
+        except TelegramRetryAfter as e:
+            if attempt >= SEND_MAX_RETRIES:
+                logging.error(f"Chat {chat_id} ga yuborib bo'lmadi: flood-wait takrorlanmoqda.")
+                return FAILED
+            logging.warning(f"Flood-wait: {e.retry_after} soniya kutilmoqda (chat {chat_id}).")
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return BLOCKED
+        except TelegramBadRequest as e:
+            if any(marker in str(e).lower() for marker in _BLOCKED_MARKERS):
+                return BLOCKED
+            logging.error(f"Chat {chat_id} ga yuborishda xato: {e}")
+            return FAILED
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if attempt >= SEND_MAX_RETRIES:
+                logging.error(f"Chat {chat_id} ga yuborib bo'lmadi: {e}")
+                return FAILED
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            logging.error(f"Chat {chat_id} ga yuborishda kutilmagan xato: {e}")
+            return FAILED
+        attempt += 1
@@ -0,0 +1,77 @@
+# services/subscription.py
+
+import asyncio
+import logging
+from aiogram import Bot
+
+import database as db
+from config import (
+    SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_POSITIVE_TTL, SUBSCRIPTION_NEGATIVE_TTL,
+    SUBSCRIPTION_CHECK_CONCURRENCY, SUBSCRIPTION_CHECK_TIMEOUT
+)
+from services.cache import TTLCache
+
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+# (user_id, channel_id) -> a'zo yoki yo'q.
+# A'zolik uzoqroq, a'zo emaslik esa qisqa muddat saqlanadi, chunki foydalanuvchi
+# kanalga qo'shilgach tezda botdan foydalana olishi kerak.
+subscription_cache = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE)
+
+# Barcha foydalanuvchilar uchun bir vaqtda bajariladigan get_chat_member so'rovlari chegarasi
+_api_semaphore = asyncio.Semaphore(SUBSCRIPTION_CHECK_CONCURRENCY)
+
+
+async def _is_member(bot: Bot, user_id: int, channel_id: int) -> bool:
+    async with _api_semaphore:
+        member = await asyncio.wait_for(
+            bot.get_chat_member(chat_id=channel_id, user_id=user_id),
+            timeout=SUBSCRIPTION_CHECK_TIMEOUT
+        )
+    is_member = member.status.lower() in MEMBER_STATUSES
+    ttl = SUBSCRIPTION_POSITIVE_TTL if is_member else SUBSCRIPTION_NEGATIVE_TTL
+    subscription_cache.set((user_id, channel_id), is_member, ttl=ttl)
+    if not is_member:
+        logging.warning(f"User {user_id} is NOT subscribed to channel {channel_id}. Status: {member.status}")
+    return is_member
+
+
+async def check_subscription(user_id: int, bot: Bot, use_cache: bool = True) -> bool:
+    """
+    Foydalanuvchining majburiy kanallarga obuna bo'lganligini tekshiradi.
+    Keshda yo'q kanallar bir vaqtda so'raladi; birinchi "a'zo emas" javobida
+    qolgan so'rovlar bekor qilinadi. `use_cache=False` bo'lsa, kesh chetlab o'tiladi.
+    """
+    try:
+        channels = await db.get_channels()
+    except Exception as e:
+        logging.error(f"Error during subscription check for user {user_id}: {e}")
+        return False
+    if not channels:
+        return True # Agar majburiy kanallar bo'lmasa, har doim True
+
+    pending = []
+    for channel_id, username, invite_link in channels:
+        cached = subscription_cache.get((user_id, channel_id)) if use_cache else None
+        if cached is False:
+            return False
+        if cached is None:
+            pending.append(channel_id)
+    if not pending:
+        return True
+
+    tasks = [asyncio.create_task(_is_member(bot, user_id, channel_id)) for channel_id in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            if not await next_done:
+                return False
+        return True
+    except Exception as e:
+        logging.error(f"Error during subscription check for user {user_id}: {e!r}")
+        return False
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception() # "exception was never retrieved" ogohlantirishining oldini olish
@@ -0,0 +1,74 @@
+# services/test_codes.py
+
+import asyncio
+import logging
+import secrets
+
+import database as db
+from config import TEST_CODE_MODE, TEST_CODE_BLOCK_SIZE, TEST_CODE_RANDOM_DIGITS
+
+# Yangi test kodlari shu yerda, xotiradan beriladi. Bazaga faqat zaxira tugaganda
+# murojaat qilinadi: ketma-ket rejimda `sequences` jadvalidan bir blok band qilinadi,
+# tasodifiy rejimda esa bir guruh nomzod kod bitta so'rov bilan tekshiriladi.
+# Kodlarni faqat bazaga yozuvchi jarayon ajratadi (create_test - cluster.writer),
+# ishlatilmay qolgan kodlar qayta ishga tushganda shunchaki tashlab yuboriladi.
+
+# Ketma-ket shuncha guruhda birorta ham bo'sh kod chiqmasa, ajratish xato bilan to'xtaydi
+_MAX_EMPTY_ROUNDS = 20
+
+
+class TestCodeAllocator:
+
+    def __init__(self, mode: str = TEST_CODE_MODE, block_size: int = TEST_CODE_BLOCK_SIZE, digits: int = TEST_CODE_RANDOM_DIGITS):
+        self.mode = mode
+        self.block_size = max(1, block_size)
+        self.low = 10 ** (digits - 1)
+        self.high = 10 ** digits
+        self._next = self._end = 0
+        self._random = []
+        self._lock = asyncio.Lock()
+
+    async def allocate(self) -> int:
+        """Keyingi bo'sh test kodi. Zaxirada kod bo'lsa, bazaga murojaat qilinmaydi."""
+        if self.mode == "random":
+            if not self._random:
+                async with self._lock:
+                    rounds = 0
+                    while not self._random:
+                        rounds += 1
+                        self._random = await self._random_block(rounds)
+            return self._random.pop()
+        if self._next >= self._end:
+            async with self._lock:
+                if self._next >= self._end:
+                    self._next = await db.reserve_sequence_block("test_code", self.block_size)
+                    self._end = self._next + self.block_size
+        code = self._next
+        self._next += 1
+        return code
+
+    async def _random_block(self, rounds: int = 1) -> list:
+        space = self.high - self.low
+        if self.block_size >= space:
+            # Blok butun kodlar maydonidan katta bo'lsa, tasodifiy tanlash hech qachon tugamas edi
+            candidates = set(range(self.low, self.high))
+        else:
+            candidates = set()
+            while len(candidates) < self.block_size:
+                candidates.add(self.low + secrets.randbelow(space))
+        taken = await db.find_existing_test_codes(candidates)
+        if len(taken) == len(candidates):
+            # Birorta ham bo'sh kod chiqmadi: maydon to'lgan yoki deyarli to'lgan
+            if rounds >= _MAX_EMPTY_ROUNDS or await db.count_test_codes_between(self.low, self.high) >= space:
+                raise RuntimeError("Bo'sh tasodifiy test kodi topilmadi: TEST_CODE_RANDOM_DIGITS ni oshiring.")
+        if len(taken) > self.block_size // 2:
+            # Kodlar maydoni to'lib bormoqda - TEST_CODE_RANDOM_DIGITS ni oshirish vaqti
+            logging.warning(f"Tasodifiy test kodlarining {len(taken)}/{len(candidates)} tasi band.")
+        return list(candidates - taken)
+
+
+allocator = TestCodeAllocator()
+
+
+async def allocate() -> int:
+    return await allocator.allocate()
@@ -0,0 +1,104 @@
+# services/webhook.py
+
+import asyncio
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+
+from config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_MAX_IN_FLIGHT, WEBHOOK_MAX_CONNECTIONS, DROP_PENDING_UPDATES
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookView:
+    """
+    Telegram'dan kelgan update'ni qabul qiladigan aiohttp ko'rinishi.
+
+    Bitta jarayonli rejimda update darhol tasdiqlanadi (200) va fon vazifasida
+    `dispatcher.feed_webhook_update` orqali ishlanadi, lekin bir vaqtda ko'pi bilan
+    `max_in_flight` ta update ishlanadi. Chegara to'lganda so'rov javobsiz kutib turadi -
+    Telegram esa yangi update'larni o'z navbatida ushlab turadi.
+    Ko'p jarayonli rejimda update shu yerda ishlanmaydi, `dispatch` orqali ishchi jarayonga uzatiladi.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str, max_in_flight: int, dispatch=None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.dispatch = dispatch
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tasks: set[asyncio.Task] = set()
+
+    def register(self, app: web.Application, path: str) -> None:
+        app.router.add_post(path, self.handle)
+        app.on_shutdown.append(self.close)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json(loads=self.bot.session.json_loads)
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+
+        if self.dispatch is not None:
+            # Ishchilar band bo'lsa, dispatch joy bo'shaguncha kutadi
+            await self.dispatch(update)
+        else:
+            await self._slots.acquire()
+            task = asyncio.create_task(self._feed_update(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.json_response({})
+
+    async def _feed_update(self, update: dict) -> None:
+        try:
+            await self.dispatcher.feed_webhook_update(self.bot, update)
+        except Exception as e:
+            logging.error(f"Update'ni qayta ishlashda xato: {e}")
+        finally:
+            self._slots.release()
+
+    async def close(self, app: web.Application = None) -> None:
+        # Qabul qilingan update'lar oxirigacha ishlanadi, keyin sessiya yopiladi
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.bot.session.close()
+
+
+def build_app(dp: Dispatcher, bot: Bot, dispatch=None) -> web.Application:
+    app = web.Application()
+    view = WebhookView(dp, bot, secret_token=WEBHOOK_SECRET, max_in_flight=WEBHOOK_MAX_IN_FLIGHT, dispatch=dispatch)
+    view.register(app, path=WEBHOOK_PATH)
+    # Dispatcher'ning startup/shutdown hodisalari (FSM saqlagichini yopish ham) ilovaga bog'lanadi
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, dispatch=None):
+    """aiohttp serverini ishga tushiradi va to'xtatilguncha kutadi."""
+    app = build_app(dp, bot, dispatch)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    # DROP_PENDING_UPDATES=false bo'lsa, yangi versiya chiqarilganda to'plangan update'lar saqlanib qoladi
+    await bot.set_webhook(
+        url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=DROP_PENDING_UPDATES,
+    )
+    logging.info(f"Webhook {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} manzilida tinglanmoqda.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,31 @@
+# services/workers.py
+
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config import CPU_WORKERS
+
+# Og'ir hisoblashlar (rasm chizish, Excel yaratish) uchun umumiy jarayonlar hovuzi
+_executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # "spawn": ishchilar ishlab turgan event loop va baza oqimlarini meros qilib olmaydi
+        _executor = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def run_in_process(func, *args):
+    """`func(*args)` ni alohida jarayonda bajaradi; event loop bloklanmaydi."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+def shutdown_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
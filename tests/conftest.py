@@ -0,0 +1,31 @@
+# tests/conftest.py
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# config.py import paytida o'qiladi: haqiqiy .env bo'lmasa ham modullar yuklanishi uchun
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("DB_NAME", os.path.join(tempfile.mkdtemp(prefix="bot-tests-"), "bot.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def run_with_db(tmp_path, monkeypatch):
+    """Korutinani har bir test uchun alohida, vaqtinchalik bazada bajaradi."""
+    monkeypatch.setattr(database.pool, "path", str(tmp_path / "bot.db"))
+
+    def run(coro_factory):
+        async def main():
+            await database.setup_database()
+            try:
+                return await coro_factory()
+            finally:
+                await database.close_database()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,71 @@
+# tests/test_test_codes.py
+
+import asyncio
+
+import pytest
+
+import database
+from services import test_codes
+
+
+def _use_allocator(monkeypatch, mode, block_size, digits=6):
+    monkeypatch.setattr(test_codes, "allocator", test_codes.TestCodeAllocator(mode, block_size, digits))
+
+
+async def _create_many(tasks: int, per_task: int) -> list:
+    async def create(owner: int) -> list:
+        return [await database.create_test(owner, "file", "photo", "abcd", 0) for _ in range(per_task)]
+    batches = await asyncio.gather(*(create(owner) for owner in range(tasks)))
+    return [code for batch in batches for code in batch]
+
+
+async def _stored_codes() -> list:
+    async with database.pool.read() as db:
+        cursor = await db.execute("SELECT test_code FROM tests")
+        return [row[0] for row in await cursor.fetchall()]
+
+
+@pytest.mark.parametrize("mode, block_size, digits", [
+    ("sequential", 7, 6),
+    ("random", 50, 4),
+])
+def test_concurrent_codes_are_unique(run_with_db, monkeypatch, mode, block_size, digits):
+    _use_allocator(monkeypatch, mode, block_size, digits)
+
+    async def scenario():
+        codes = await _create_many(tasks=40, per_task=15)
+        return codes, await _stored_codes()
+
+    codes, stored = run_with_db(scenario)
+    assert len(codes) == 600
+    assert len(set(codes)) == len(codes)
+    assert sorted(stored) == sorted(codes)
+
+
+def test_sequential_blocks_survive_restart(run_with_db, monkeypatch):
+    async def scenario():
+        codes = []
+        # Har bir yangi ajratuvchi - bot qayta ishga tushgandek: ishlatilmagan kodlar tashlab yuboriladi
+        for _ in range(3):
+            _use_allocator(monkeypatch, "sequential", 10)
+            codes += await _create_many(tasks=5, per_task=3)
+        return codes
+
+    codes = run_with_db(scenario)
+    assert len(set(codes)) == len(codes) == 45
+
+
+@pytest.mark.parametrize("block_size", [3, 100])
+def test_random_codes_exhausted_raises(run_with_db, monkeypatch, block_size):
+    # 1 xonali kodlar: atigi 9 ta (1..9)
+    _use_allocator(monkeypatch, "random", block_size, digits=1)
+
+    async def scenario():
+        codes = await _create_many(tasks=3, per_task=3)
+        with pytest.raises(RuntimeError):
+            # Osilib qolish ham xato hisoblanadi
+            await asyncio.wait_for(database.create_test(1, "file", "photo", "abcd", 0), timeout=10)
+        return codes
+
+    codes = run_with_db(scenario)
+    assert sorted(codes) == list(range(1, 10))
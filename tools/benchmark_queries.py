@@ -0,0 +1,148 @@
+# tools/benchmark_queries.py
+"""
+Asosiy so'rovlarning rejasi (EXPLAIN QUERY PLAN) va tezligini sintetik bazada o'lchaydi.
+
+Ishlatish:
+    python tools/benchmark_queries.py --users 1000000 --answers 10000000
+    python tools/benchmark_queries.py --db bench.db --reuse --without-indexes
+
+Baza sxemasi botning o'z `setup_database()` funksiyasi (migratsiyalar bilan) orqali yaratiladi.
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tez so'rovlar uchun qo'shilgan indekslar (--without-indexes ularsiz solishtiradi)
+INDEXES = [
+    "idx_tests_owner_status", "idx_tests_closed_created", "idx_users_status", "idx_sessions_test",
+]
+
+# (nomi, so'rov, parametrlar) - database.py dagi so'rovlar bilan bir xil
+QUERIES = [
+    ("get_user_tests",
+     "SELECT test_code FROM tests WHERE owner_user_id = ? AND status = 'active' ORDER BY id DESC", (42,)),
+    ("get_archivable_tests",
+     "SELECT t.id, t.test_code FROM tests t WHERE t.created_at < ? AND t.status = 'closed' AND t.archived_at IS NULL "
+     "AND NOT EXISTS (SELECT 1 FROM result_jobs j WHERE j.test_code = t.test_code AND j.status = 'running') LIMIT 100", (1_000_000,)),
+    ("get_contest_stats",
+     "SELECT cr.user_id, u.full_name, cr.count FROM contest_referrals cr LEFT JOIN users u ON u.user_id = cr.user_id WHERE cr.contest_id = (SELECT MAX(id) FROM contests) ORDER BY cr.count DESC LIMIT 10", ()),
+    ("get_all_user_ids",
+     "SELECT user_id FROM users WHERE status = 'active'", ()),
+    ("get_active_users_count",
+     "SELECT COUNT(user_id) FROM users WHERE status = 'active'", ()),
+    ("get_active_user_ids_after",
+     "SELECT user_id FROM users WHERE status = 'active' AND user_id > ? ORDER BY user_id LIMIT 200", (500_000,)),
+    ("get_test_participant_count",
+     "SELECT COUNT(ua.id) FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id JOIN tests t ON uts.test_id = t.id WHERE t.test_code = ?", (1500,)),
+    ("get_test_results",
+     "SELECT u.user_id, u.full_name, ua.score, uts.start_time, ua.submitted_at FROM user_answers ua JOIN user_test_sessions uts ON ua.session_id = uts.id JOIN users u ON ua.user_id = u.user_id WHERE uts.test_id = ? ORDER BY ua.score DESC, (ua.submitted_at - uts.start_time) ASC", (500,)),
+]
+
+
+def populate(path: str, users: int, tests: int, answers: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    started = time.monotonic()
+    with conn:
+        conn.execute(
+            "WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq LIMIT ?) "
+            "INSERT INTO users (user_id, username, full_name, referred_by_id, referral_count, status) "
+            "SELECT x, 'user' || x, 'Foydalanuvchi ' || x, NULL, CASE WHEN x % 50 = 0 THEN abs(random()) % 100 ELSE 0 END, "
+            "CASE WHEN x % 20 = 0 THEN 'inactive' ELSE 'active' END FROM seq", (users,))
+        conn.execute(
+            "INSERT INTO contest_referrals (contest_id, user_id, count) "
+            "SELECT (SELECT MAX(id) FROM contests), user_id, referral_count FROM users WHERE referral_count > 0")
+        conn.execute(
+            "WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq LIMIT ?) "
+            "INSERT INTO tests (test_code, owner_user_id, question_file_id, question_file_type, answer_key, duration_minutes, created_at, status) "
+            "SELECT 1000 + x, x % 5000, 'file', 'photo', 'abcdabcdabcdabcdabcdabcdabcdab', 60, x * 100, "
+            "CASE WHEN x % 3 = 0 THEN 'closed' ELSE 'active' END FROM seq", (tests,))
+        # Har bir foydalanuvchi turli testlarda qatnashadi: (user_id, test_id) juftligi takrorlanmaydi
+        conn.execute(
+            "WITH RECURSIVE seq(x) AS (SELECT 0 UNION ALL SELECT x + 1 FROM seq LIMIT ?) "
+            "INSERT INTO user_test_sessions (user_id, test_id, start_time) "
+            "SELECT (x % :users) + 1, ((x / :users) + (x % :users) * 7) % :tests + 1, 1000000 + x FROM seq"
+            .replace(":users", str(users)).replace(":tests", str(tests)), (answers,))
+        conn.execute(
+            "INSERT INTO user_answers (session_id, user_id, score, submitted_answers, submitted_at) "
+            "SELECT id, user_id, abs(random()) % 31, 'abcdabcdabcdabcdabcdabcdabcdab', start_time + abs(random()) % 3600 FROM user_test_sessions")
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"Sintetik ma'lumotlar yaratildi: {time.monotonic() - started:.1f} s")
+
+
+def measure(conn, sql: str, params: tuple, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="benchmark.db")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--tests", type=int, default=20_000)
+    parser.add_argument("--answers", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="mavjud bazani qayta yaratmaslik")
+    parser.add_argument("--without-indexes", action="store_true", help="solishtirish uchun yangi indekslarni o'chirish")
+    args = parser.parse_args()
+
+    if not args.reuse:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    # Sxema botning o'zi kabi yaratiladi (barcha migratsiyalar bilan)
+    os.environ["DB_NAME"] = os.path.abspath(args.db)
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    sys.path.insert(0, ROOT)
+    import database
+
+    async def create_schema():
+        await database.setup_database()
+        await database.close_database()
+    asyncio.run(create_schema())
+
+    if not args.reuse:
+        populate(args.db, args.users, args.tests, args.answers)
+
+    conn = sqlite3.connect(args.db)
+    copy_path = None
+    if args.without_indexes:
+        # Indekslar vaqtinchalik nusxada o'chiriladi: asosiy baza keyingi --reuse o'lchovlari uchun o'zgarmaydi
+        copy_path = args.db + ".noindex"
+        copy = sqlite3.connect(copy_path)
+        conn.backup(copy)
+        conn.close()
+        conn = copy
+        for name in INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+        print("Diqqat: yangi indekslar vaqtinchalik nusxada o'chirildi (--without-indexes).")
+
+    try:
+        for name, sql, params in QUERIES:
+            plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            latency = measure(conn, sql, params, args.repeat)
+            print(f"\n{name}: {latency:.2f} ms (mediana, {args.repeat} marta)")
+            for step in plan:
+                print(f"    {step}")
+    finally:
+        conn.close()
+        if copy_path and os.path.exists(copy_path):
+            os.remove(copy_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# tools/load_generator.py
+"""
+Webhook manziliga sintetik Telegram update'larini yuborib, soniyasiga qabul
+qilingan update'lar sonini va javob kechikishini o'lchaydi.
+
+Ishlatish (bot BOT_MODE=webhook bilan ishga tushirilgan bo'lishi kerak):
+    python tools/load_generator.py --url http://127.0.0.1:8080/webhook --secret <WEBHOOK_SECRET>
+    python tools/load_generator.py --updates 20000 --concurrency 200 --users 5000 --text "🏆 Reyting"
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import time
+
+import aiohttp
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"Foydalanuvchi {user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def run(args):
+    update_ids = itertools.count(1)
+    latencies = []
+    statuses = {}
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+
+    async def worker(session: aiohttp.ClientSession, count: int):
+        for _ in range(count):
+            update = make_update(next(update_ids), random.randint(1, args.users), args.text)
+            started = time.perf_counter()
+            try:
+                async with session.post(args.url, json=update, headers=headers) as response:
+                    await response.read()
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] = statuses.get(type(e).__name__, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    per_worker, extra = divmod(args.updates, args.concurrency)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session, per_worker + (1 if i < extra else 0)) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    print(f"Yuborildi: {args.updates} ta update, {elapsed:.2f} s -> {args.updates / elapsed:.0f} update/s")
+    print(f"Javob kodlari: {statuses}")
+    if latencies:
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"Kechikish: mediana {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=1000, help="nechta turli foydalanuvchi nomidan yuboriladi")
+    parser.add_argument("--text", default="/help")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
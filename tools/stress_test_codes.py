@@ -0,0 +1,98 @@
+# tools/stress_test_codes.py
+"""
+Test kodlarini ajratuvchini parallel yuklama ostida tekshiradi: bir nechta jarayon
+va har birida ko'plab parallel vazifa bir vaqtda `create_test` ni chaqiradi.
+Oxirida barcha qaytarilgan kodlar takrorlanmasligi va har bir test bazaga
+yozilgani tekshiriladi; muammo bo'lsa, skript 1 kodi bilan tugaydi.
+
+Ishlatish:
+    python tools/stress_test_codes.py
+    python tools/stress_test_codes.py --processes 4 --tasks 50 --per-task 20 --mode random --block-size 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _configure(args):
+    os.environ["DB_NAME"] = os.path.abspath(args.db)
+    os.environ.setdefault("BOT_TOKEN", "0:stress")
+    os.environ["TEST_CODE_MODE"] = args.mode
+    os.environ["TEST_CODE_BLOCK_SIZE"] = str(args.block_size)
+    os.environ["TEST_CODE_RANDOM_DIGITS"] = str(args.digits)
+    sys.path.insert(0, ROOT)
+
+
+def run_process(args) -> list:
+    """Bitta jarayon: `tasks` ta vazifa, har biri ketma-ket `per_task` ta test yaratadi."""
+    _configure(args)
+    import database
+
+    async def create_many(owner: int) -> list:
+        return [await database.create_test(owner, "file", "photo", "abcd", 0) for _ in range(args.per_task)]
+
+    async def main() -> list:
+        await database.setup_database()
+        try:
+            batches = await asyncio.gather(*(create_many(owner) for owner in range(args.tasks)))
+        finally:
+            await database.close_database()
+        return [code for batch in batches for code in batch]
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="stress_codes.db")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--tasks", type=int, default=50)
+    parser.add_argument("--per-task", type=int, default=20)
+    parser.add_argument("--mode", choices=("sequential", "random"), default="sequential")
+    parser.add_argument("--block-size", type=int, default=10)
+    parser.add_argument("--digits", type=int, default=6)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.db + suffix):
+            os.remove(args.db + suffix)
+
+    # Sxema bir marta, jarayonlar ishga tushishidan oldin yaratiladi
+    _configure(args)
+    import database
+
+    async def create_schema():
+        await database.setup_database()
+        await database.close_database()
+    asyncio.run(create_schema())
+
+    started = time.monotonic()
+    with multiprocessing.get_context("spawn").Pool(args.processes) as workers:
+        results = workers.map(run_process, [args] * args.processes)
+    elapsed = time.monotonic() - started
+
+    codes = [code for result in results for code in result]
+    expected = args.processes * args.tasks * args.per_task
+    duplicates = [code for code, count in Counter(codes).items() if count > 1]
+    conn = sqlite3.connect(args.db)
+    stored, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT test_code) FROM tests").fetchone()
+    conn.close()
+
+    print(f"Yaratilgan testlar: {len(codes)}/{expected} ({elapsed:.2f} s, {len(codes) / elapsed:.0f} test/s)")
+    print(f"Bazada: {stored} ta, noyob kodlar: {distinct} ta, takrorlangan kodlar: {len(duplicates)} ta")
+    if len(codes) != expected or duplicates or stored != expected or distinct != expected:
+        print("XATO: kodlar takrorlangan yoki testlar yo'qolgan!")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()